@@ -1,167 +1,532 @@
 import os
-from flask import Flask, request, jsonify
-import psycopg2
-from groq import Groq
+from flask import Flask, request, jsonify, Response, stream_with_context
 import json
-from dotenv import load_dotenv
+import hmac
+import time
 from flask_cors import CORS
-import socket
-from datetime import datetime, timezone # <--- CAMBIO 1: Importamos timezone
-
-# Intentamos cargar .env (busca en la carpeta actual o superior)
-load_dotenv()
+from db_pool import PoolConexiones
+from cache_semantica import huella_contexto, normalizar_prompt
+from paginacion import Presupuesto, TokenInvalido, limitar_sql, leer_token
+from formatos import elegir_formato, codificar, columnar, valor_json, MIME_JSON, PYARROW_DISPONIBLE
+from respuestas import LatenciaEstrategias, respuesta_local
+from planificador_llm import PlanificadorLLM, INTERACTIVA, LOTE, fijar_plazo
+from validacion_sql import SQLRechazado, comprobar_plan
+from derivacion import derivar
+from metricas import (
+    etapa, medir, anotar, iniciar_peticion, tiempos_actuales,
+    registrar_tokens, registrar_filas, registrar_fuente, exportar,
+)
+# Configuración, prompts y funciones puras compartidas con app_async.py (ver comun.py)
+from comun import (
+    DB_URI, GROQ_API_KEY, ADMIN_TOKEN, CALENTAR,
+    DB_POOL_MIN, DB_POOL_MAX, DB_POOL_MAX_USOS, DB_POOL_MAX_EDAD, DB_POOL_TIMEOUT, DB_POOL_PING,
+    RESULTADO_MAX_FILAS, RESULTADO_MAX_BYTES, DB_TAMANO_LOTE, PAGINACION_SECRETO, PAGINACION_TTL,
+    CACHE_RESULTADOS_MAX_BYTES, PLANTILLA_MAX_FILAS, ESQUEMA_DINAMICO,
+    SQL_MAX_COSTE, SQL_MAX_FILAS_ESTIMADAS, SQL_TIMEOUT_MS, VUELO_UNICO, LOTE_CONCURRENCIA, SESIONES_MAX,
+    LLM_MODELO_RESPALDO, LLM_CONCURRENCIA, LLM_REINTENTOS, LLM_PLAZO, LLM_UMBRAL_RESPALDO, LLM_KEEPALIVE,
+    READY_TIMEOUT, READY_CACHE, READY_COMPROBAR_LLM, modelo_groq,
+    crear_cache_intencion, crear_cache_resultados, crear_escucha_invalidaciones, crear_indice_esquema,
+    crear_rutas_rollup, crear_refresco_rollups, crear_vuelos, crear_sesiones, crear_enviador_logs,
+    formatear_syslog, mensajes_intencion, mensajes_respuesta, texto_esquema, esquema_sesion, huella_intencion,
+    comprobar_sql, reescribir_rollup, resumen_para_llm, info_paginacion, estrategia_pedida,
+    bloque_grafico, datos_a_enviar, leer_lote, cuerpo_lote, preparar_lote,
+)
+import uuid
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 
 app = Flask(__name__)
 
-# ======================
-# CONFIGURACIÓN
-# ======================
-DB_URI = os.environ.get("DATABASE_URL")
-GROQ_API_KEY = os.environ.get("GROQ_API_KEY")
-QRADAR_HOST = os.environ.get("QRADAR_HOST", "127.0.0.1")
-QRADAR_PORT = int(os.environ.get("QRADAR_PORT", 1514))
-
 # HABILITAR CORS
 CORS(app, supports_credentials=True)
 
-# CLIENTE GROQ
-modelo_groq = "llama-3.3-70b-versatile"
-client = Groq(api_key=GROQ_API_KEY)
+@app.before_request
+def limpiar_contexto():
+    # Los hilos de gunicorn atienden una petición tras otra y los contextvars siguen ahí: sin
+    # esto, una petición que no fija plazo (p. ej. /consulta/lote) heredaría el de la anterior,
+    # que suele estar ya vencido. Las que lo necesitan lo fijan después con fijar_plazo
+    fijar_plazo(None)
+
+# CLIENTE GROQ (se crea con la primera llamada: importar groq es lo más lento del arranque)
+
+def crear_cliente_groq():
+    # Sin reintentos en el cliente: los hace el planificador, que conoce el cupo y el plazo.
+    # Las conexiones ociosas duran LLM_KEEPALIVE s (httpx las cierra a los 5 s por defecto)
+    import httpx
+    from groq import DefaultHttpxClient, Groq
+    limites = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=LLM_KEEPALIVE)
+    return Groq(api_key=GROQ_API_KEY, max_retries=0, http_client=DefaultHttpxClient(limits=limites))
+
+llm = PlanificadorLLM(
+    None, modelo_groq,
+    modelo_respaldo=LLM_MODELO_RESPALDO or None,
+    max_concurrencia=LLM_CONCURRENCIA,
+    reintentos=LLM_REINTENTOS,
+    umbral_respaldo=LLM_UMBRAL_RESPALDO,
+    plazo=LLM_PLAZO,
+    crear_cliente=crear_cliente_groq,
+)
+
+# POOL BBDD (las conexiones se abren en el primer uso)
+pool_db = PoolConexiones(
+    DB_URI,
+    minimo=DB_POOL_MIN,
+    maximo=DB_POOL_MAX,
+    max_usos=DB_POOL_MAX_USOS,
+    max_edad=DB_POOL_MAX_EDAD,
+    timeout=DB_POOL_TIMEOUT,
+    ping=DB_POOL_PING,
+    readonly=True,
+)
+
+# CACHÉ DE RESULTADOS + invalidación por NOTIFY (opcional)
+cache_resultados = crear_cache_resultados()
+# Se arranca en cada proceso que atiende peticiones (ver iniciar_hilos), no al importar
+escucha_invalidaciones = crear_escucha_invalidaciones(cache_resultados)
+
+# ROLLUPS: el SQL que encaja se lee de los agregados precalculados
+rutas_rollup = crear_rutas_rollup(pool_db, cache_resultados)
+refresco_rollups = crear_refresco_rollups()
+
+# Deduplicación de trabajo en curso (Groq y BBDD)
+vuelos = crear_vuelos()
+
+def una_vez(tipo, clave, fn):
+    # Si ya hay una petición calculando lo mismo, esperamos su resultado
+    return vuelos.ejecutar(tipo, clave, fn) if VUELO_UNICO else fn()
+
+# Latencia de la respuesta textual según la estrategia usada
+latencia_estrategias = LatenciaEstrategias()
+
+# ÍNDICE DEL ESQUEMA (mientras no se haya cargado, o si está desactivado, se usa DB_SCHEMA)
+indice_esquema = crear_indice_esquema(pool_db)
+
+# CACHÉ DE INTENCIÓN (la huella cambia si cambia el esquema o el modelo)
+cache_intencion = crear_cache_intencion()
+
+# SESIONES (historial por conversación y último resultado para los seguimientos)
+sesiones = crear_sesiones()
+
+# Los logs salen desde un hilo en segundo plano: la petición nunca espera a QRadar
+enviador_logs = crear_enviador_logs()
 
-# ESQUEMA DB
-DB_SCHEMA = """
-Tabla 1: clientes (columnas: id_cliente,nombre,apellidos,email,pais,ciudad,edad,genero)
-Tabla 2: transacciones (columnas: id_transaccion,id_cliente,fecha_compra,producto,categoria_producto,precio_unitario,cantidad,importe_total,metodo_pago,coste_envio,coste_fabricacion)
-Relación: clientes.id_cliente = transacciones.id_cliente
-"""
+# Los contadores de cada componente también se publican en /metrics (Prometheus)
+registrar_fuente("pool_db", pool_db.estadisticas)
+registrar_fuente("cache_intencion", cache_intencion.estadisticas)
+registrar_fuente("logs_qradar", enviador_logs.estadisticas)
+registrar_fuente("cache_resultados", cache_resultados.estadisticas)
+registrar_fuente("respuesta_por_estrategia", latencia_estrategias.estadisticas, {"": "estrategia"})
+registrar_fuente("esquema", indice_esquema.estadisticas)
+registrar_fuente("vuelo_unico", vuelos.estadisticas)
+registrar_fuente("llm", llm.estadisticas, {"cola": "prioridad", "cupo": "modelo"})
+registrar_fuente("rollups", rutas_rollup.estadisticas, {"disponibles": "rollup", "reescritas": "rollup"})
+registrar_fuente("sesiones", sesiones.estadisticas)
+
+def send_to_qradar(level, message, extra=None):
+    # Solo encola; si QRadar no está (en local) los mensajes se descartan sin hacer ruido
+    enviador_logs.enviar(formatear_syslog(level, message, extra))
 
 # ======================
-# FUNCIÓN LOGS (Silenciosa en Local)
+# PROCESOS (gunicorn con preload_app)
 # ======================
-def send_to_qradar(level, message, extra=None):
-    # <--- CAMBIO 2: Arreglado el warning de datetime
-    timestamp = datetime.now(timezone.utc).isoformat()
-    
-    hostname = "bi-api"
-    appname = "flask-groq"
-    payload = {
-        "level": level,
-        "message": message,
-        "extra": extra or {},
-        "timestamp": timestamp
-    }
-    syslog_message = f"<134>{timestamp} {hostname} {appname}: {json.dumps(payload)}\n"
-    
+def tras_fork():
+    """
+    Lo llama gunicorn (post_fork) en cada worker. El módulo se importa una vez en el
+    proceso maestro y los workers heredan la memoria, pero no los hilos ni los sockets:
+    se rehacen aquí. Los hilos de logs y del índice del esquema ya arrancan solos por pid.
+    """
+    pool_db.tras_fork()
+    cache_intencion.tras_fork()
+    # El cliente HTTP de Groq no se comparte entre procesos: cada worker crea el suyo
+    llm.cliente = None
+
+def iniciar_hilos():
+    """
+    Arranca el LISTEN de invalidaciones y el refresco de rollups en este proceso. Lo
+    llama gunicorn (post_worker_init) en cada worker, o __main__ en desarrollo: al
+    importar no se arranca nada, así el maestro de gunicorn no tiene conexiones ni
+    hilos que no atienden peticiones.
+    """
+    if escucha_invalidaciones is not None:
+        escucha_invalidaciones.iniciar()
+    if refresco_rollups is not None:
+        refresco_rollups.iniciar()
+
+_sondas = {"instante": 0.0, "resultado": None}
+_sondas_lock = threading.Lock()
+
+def _sonda(fn):
+    inicio = time.perf_counter()
     try:
-        # Timeout muy corto (0.5s) para no bloquear tu PC si no hay QRadar
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.settimeout(0.5) 
-        s.connect((QRADAR_HOST, QRADAR_PORT))
-        s.sendall(syslog_message.encode())
-        s.close()
-    except Exception:
-        # Si falla (porque estás en local), no hacemos nada ni imprimimos error.
-        # Así mantenemos la terminal limpia.
-        pass
+        fn()
+        estado = {"ok": True}
+    except Exception as e:
+        estado = {"ok": False, "error": f"{type(e).__name__}: {e}"[:200]}
+    estado["ms"] = round(1000 * (time.perf_counter() - inicio), 1)
+    return estado
+
+def _ping_bd():
+    with pool_db.conexion() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SET LOCAL statement_timeout = %s", (int(READY_TIMEOUT * 1000),))
+            cur.execute("SELECT 1")
+
+def _ping_llm():
+    # Listar modelos no consume tokens
+    llm.cliente.models.list(timeout=READY_TIMEOUT)
+
+def comprobar_dependencias():
+    """{"bd": {...}, "llm": {...}} con el último resultado de menos de READY_CACHE segundos."""
+    with _sondas_lock:
+        if _sondas["resultado"] is not None and time.monotonic() - _sondas["instante"] < READY_CACHE:
+            return _sondas["resultado"]
+        resultado = {"bd": _sonda(_ping_bd)}
+        if READY_COMPROBAR_LLM:
+            resultado["llm"] = _sonda(_ping_llm)
+        _sondas.update(instante=time.monotonic(), resultado=resultado)
+        return resultado
+
+def _calentar_bd():
+    pool_db.abrir()
+    _ping_bd()
+    if ESQUEMA_DINAMICO:
+        indice_esquema.iniciar()
+
+def _calentar_modulos():
+    # Lo que se importa en diferido y pagaría la primera petición que lo use
+    import psycopg2  # noqa: F401
+    if PYARROW_DISPONIBLE:
+        import pyarrow.ipc  # noqa: F401
+
+def calentar():
+    """
+    Deja el proceso listo antes de la primera pregunta: abre las conexiones mínimas del
+    pool, crea el cliente de Groq con una llamada que deja abierta la conexión TLS y
+    carga los módulos diferidos. Devuelve lo mismo que /ready por cada paso.
+    """
+    pasos = {"modulos": _sonda(_calentar_modulos)}
+    if DB_URI:
+        pasos["bd"] = _sonda(_calentar_bd)
+    if GROQ_API_KEY:
+        pasos["llm"] = _sonda(_ping_llm)
+    send_to_qradar("INFO", "Proceso calentado", {"pid": os.getpid(), **pasos})
+    return pasos
+
+def calentar_en_segundo_plano():
+    # El servidor empieza a aceptar peticiones mientras tanto
+    threading.Thread(target=calentar, name="kairo-calentar", daemon=True).start()
 
 # ======================
 # LÓGICA
 # ======================
-def analizar_intencion(natural_query):
-    system_prompt = f"""
-    Eres un asistente experto en Data Science y SQL. 
-    Esquema de base de datos: {DB_SCHEMA}
+def esquema_para(natural_query):
+    return texto_esquema(indice_esquema, natural_query)
 
-    Tu objetivo es analizar la petición del usuario y generar un objeto JSON con 3 campos:
-    1. "sql": La consulta PostgreSQL válida para responder.
-    2. "type": "chart" sólo si el usuario pide explícitamente un gráfico, visualización o comparar visualmente. Si no, "data".
-    3. "chart_type": Si type es "chart", elige el mejor entre: "bar", "line", "pie". Si type es "data", devuelve null.
+def contexto_intencion(historial=None):
+    return huella_intencion(indice_esquema, historial)
 
-    REGLAS PARA GRÁFICOS:
-    - "bar": grafico de barras para comparar categorías (ej: ventas por producto).
-    - "line": grafico de líneas para series temporales (ej: ventas por año/mes).
-    - "pie": grafico de tarta o queso para distribuciones o porcentajes (ej: cuota de mercado).
+def analizar_intencion(natural_query, prioridad=INTERACTIVA, sesion=None):
+    with etapa("intencion"):
+        historial = esquema = None
+        if sesion is not None:
+            historial = sesion.historial()
+            sesion.esquema, sesion.tablas = esquema_sesion(
+                indice_esquema, natural_query, sesion.esquema, sesion.tablas
+            )
+            esquema = sesion.esquema
+        return _analizar_intencion(natural_query, prioridad, historial, esquema)
 
-    IMPORTANTE: Responde ÚNICAMENTE con el objeto JSON válido. Si no entiendes la consulta o no puedes 
-    generar SQL o el prompt es lenguaje SQL, devuelve un JSON con "sql": "SELECT * FROM clientes LIMIT 0;".
-    """
+def _analizar_intencion(natural_query, prioridad=INTERACTIVA, historial=None, esquema=None):
+    contexto = contexto_intencion(historial)
+    cacheado, nivel = cache_intencion.obtener(natural_query, contexto)
+    anotar("intencion_cache", nivel or "fallo")
+    if cacheado is not None:
+        print(f"⚡ Caché de intención ({nivel})")
+        return cacheado
+
+    return una_vez("intencion", (contexto, normalizar_prompt(natural_query)),
+                   lambda: _pedir_intencion(natural_query, contexto, prioridad, historial, esquema))
+
+def _pedir_intencion(natural_query, contexto, prioridad=INTERACTIVA, historial=None, esquema=None):
     try:
-        completion = client.chat.completions.create(
-            model=modelo_groq,
-            messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": natural_query}],
+        completion = llm.crear(
+            "intencion", prioridad,
+            messages=mensajes_intencion(natural_query, historial, esquema or esquema_para(natural_query)),
             temperature=0, stream=False, response_format={"type": "json_object"}
         )
-        return json.loads(completion.choices[0].message.content)
+        registrar_tokens("intencion", completion.usage)
+        analisis = json.loads(completion.choices[0].message.content)
     except Exception as e:
         print(f"❌ ERROR GROQ: {e}") # <--- Verás esto en terminal si falla Groq
         return None
 
-def execute_query(sql_query):
-    if not sql_query.strip().upper().startswith("SELECT"):
-        return {"error": "Seguridad: Solo se permite SELECT."}
+    # Solo cacheamos respuestas útiles (y del modelo principal, no del de respaldo)
+    if isinstance(analisis, dict) and analisis.get("sql") and completion.model == modelo_groq:
+        cache_intencion.guardar(natural_query, contexto, analisis)
+    return analisis
 
-    send_to_qradar("INFO", "Ejecutando SQL", {"sql": sql_query})
-    conn = None
+def validar(sql_query):
+    """Devuelve None si el SQL se puede ejecutar o {"error"} con el motivo del rechazo."""
+    try:
+        comprobar_sql(indice_esquema, sql_query)
+    except SQLRechazado as e:
+        send_to_qradar("WARNING", "SQL rechazado", {"sql": sql_query, "motivo": str(e)})
+        return {"error": f"Seguridad: {e}"}
+    return None
+
+def execute_query(sql_query, offset=0):
+    """
+    Devuelve {"columns", "rows", "truncated", "next_offset", "cache"} o {"error"}.
+    Primero mira en la caché de resultados; si no está, va a la BBDD.
+    """
+    rechazo = validar(sql_query)
+    if rechazo:
+        return rechazo
+
+    usar_cache = CACHE_RESULTADOS_MAX_BYTES > 0
+    clave = cache_resultados.clave(sql_query, offset, RESULTADO_MAX_FILAS, RESULTADO_MAX_BYTES)
+    if usar_cache:
+        cacheado, edad = cache_resultados.obtener(clave)
+        if cacheado is not None:
+            send_to_qradar("INFO", "SQL servido desde caché", {"sql": sql_query, "offset": offset})
+            return {**cacheado, "cache": {"hit": True, "edad_s": round(edad, 3)}}
+
+    def consultar():
+        resultado = _consultar_bd(sql_query, offset)
+        if usar_cache and "error" not in resultado:
+            cache_resultados.guardar(clave, resultado)
+        return resultado
+
+    # Mismo SQL normalizado en curso en otra petición: compartimos su resultado
+    resultado = una_vez("sql", clave, consultar)
+    if "error" not in resultado:
+        resultado = {**resultado, "cache": {"hit": False, "edad_s": 0.0}}
+    return resultado
+
+def consultar_en_sesion(sesion, sql_query):
+    """
+    Como execute_query, pero si el SQL es el del turno anterior de la sesión con más
+    filtros o menos dimensiones, se calcula desde su resultado sin ir a la BBDD.
+    """
+    anterior = sesion.ultimo() if sesion is not None else None
+    if anterior is not None and anterior.resultado is not None:
+        with etapa("sesion_derivacion"):
+            derivado = derivar(anterior.sql, sql_query, anterior.resultado)
+        # Aunque no toque la BBDD, el SQL pasa la misma validación que el resto
+        if derivado is not None and validar(sql_query) is None:
+            anotar("sesion_derivado", True)
+            send_to_qradar("INFO", "SQL derivado del turno anterior", {"sql": sql_query, "sesion": sesion.id})
+            return {**derivado, "cache": {"hit": False, "edad_s": 0.0},
+                    "rollup": anterior.resultado.get("rollup"), "derivado": True}
+    return execute_query(sql_query)
+
+def _consultar_bd(sql_query, offset=0):
+    """
+    Ejecuta el SQL con un cursor de servidor que trae las filas por lotes,
+    parando al llegar a RESULTADO_MAX_FILAS o RESULTADO_MAX_BYTES.
+    """
+    send_to_qradar("INFO", "Ejecutando SQL", {"sql": sql_query, "offset": offset})
     try:
         # Importante: Si esto falla, saltará al 'except' de abajo
-        conn = psycopg2.connect(DB_URI)
-        conn.set_session(readonly=True)
-        cur = conn.cursor()
-        cur.execute(sql_query)
-        
-        if cur.description:
-            columns = [desc[0] for desc in cur.description]
-            rows = cur.fetchall()
-            return [dict(zip(columns, row)) for row in rows]
-        return []
-            
+        # La conexión sale del pool ya en modo solo lectura y vuelve a él al terminar
+        inicio = time.perf_counter()
+        with pool_db.conexion() as conn:
+            medir("bd_conexion", time.perf_counter() - inicio)
+            return _ejecutar_sql(conn, sql_query, offset)
+
+    except SQLRechazado as e:
+        send_to_qradar("WARNING", "SQL rechazado por coste", {"sql": sql_query, "motivo": str(e)})
+        return {"error": f"Coste: {e}"}
     except Exception as e:
         print(f"❌ ERROR BBDD: {e}") # <--- Verás esto en terminal si falla la base de datos
         return {"error": str(e)}
-        
-    finally:
-        if conn: conn.close()
 
-def generar_respuesta_natural(pregunta_usuario, resultados_db):
+def sql_a_ejecutar(sql_query):
+    return reescribir_rollup(rutas_rollup, sql_query)
+
+def _ejecutar_sql(conn, sql_query, offset=0):
+    # Plan, ejecución y lectura por lotes sobre una conexión ya sacada del pool
+    sql_ejecutar, rollup = sql_a_ejecutar(sql_query)
+    sql_limitado = limitar_sql(sql_ejecutar, RESULTADO_MAX_FILAS, offset)
+    with conn.cursor() as cur:
+        # Solo afecta a esta transacción: al volver al pool se hace rollback
+        cur.execute("SET LOCAL statement_timeout = %s", (SQL_TIMEOUT_MS,))
+        if SQL_MAX_COSTE or SQL_MAX_FILAS_ESTIMADAS:
+            with etapa("bd_plan"):
+                cur.execute("EXPLAIN (FORMAT JSON) " + sql_limitado)
+                coste, _ = comprobar_plan(cur.fetchone()[0], SQL_MAX_COSTE, SQL_MAX_FILAS_ESTIMADAS)
+            anotar("bd_coste_estimado", coste)
+
+    # Cursor con nombre = cursor del lado del servidor (no se trae todo de golpe)
+    with conn.cursor(name=f"kairo_{uuid.uuid4().hex[:12]}") as cur:
+        cur.itersize = DB_TAMANO_LOTE
+        with etapa("bd_ejecucion"):
+            cur.execute(sql_limitado)
+
+        # Con cursor de servidor buena parte del trabajo de PostgreSQL ocurre en el primer FETCH
+        with etapa("bd_lectura"):
+            presupuesto = Presupuesto(RESULTADO_MAX_FILAS, RESULTADO_MAX_BYTES)
+            rows, truncated = [], False
+            while not truncated:
+                lote = cur.fetchmany(DB_TAMANO_LOTE)
+                if not lote:
+                    break
+                for row in lote:
+                    if not presupuesto.admite(row):
+                        truncated = True
+                        break
+                    rows.append(row)
+        registrar_filas(len(rows))
+
+        columns = [desc[0] for desc in cur.description] if cur.description else []
+        return {
+            "columns": columns,
+            "rows": rows,
+            "truncated": truncated,
+            "next_offset": offset + len(rows) if truncated else None,
+            "rollup": rollup,
+        }
+
+def execute_queries(sqls):
     """
-    Toma la pregunta y los datos crudos, y crea una frase amable.
+    Varias consultas de una vez (primera página de cada una). Las que no están en caché
+    se ejecutan seguidas sobre una sola conexión del pool. Devuelve {sql: resultado o {"error"}}.
     """
-    
-    # IMPORTANTE: Convertimos los datos a string, pero limitamos la longitud
-    # para no saturar al LLM si la consulta devuelve 1000 filas.
-    data_str = str(resultados_db)[:2000] 
-    
-    system_prompt = f"""
-    Eres un asistente de análisis de datos amable y profesional.
-    
-    Tus instrucciones:
-    1. Recibirás una PREGUNTA del usuario y unos DATOS (resultado de una base de datos).
-    2. Debes responder a la pregunta basándote EXCLUSIVAMENTE en los datos proporcionados.
-    3. Si los datos están vacíos, di amablemente que no encontraste información.
-    4. No menciones "SQL" ni "Query" a menos que sea necesario. Habla en lenguaje natural.
-    5. Si hay muchos datos, resume los hallazgos principales.
-    6. Si te piden una visualización o gráfico, ignora esa parte y céntrate en dar una respuesta textual clara. 
-    No menciones la petición ni nada relaccionado con graficos.
+    claves, resueltas, pendientes = preparar_lote(sqls, cache_resultados, validar)
+    if pendientes:
+        resueltas.update(_consultar_bd_lote(pendientes))
+    return {sql: resueltas[clave] for sql, clave in claves.items()}
+
+def _consultar_bd_lote(pendientes):
+    resultados = {}
+    try:
+        inicio = time.perf_counter()
+        with pool_db.conexion() as conn:
+            medir("bd_conexion", time.perf_counter() - inicio)
+            for clave, sql_query in pendientes.items():
+                send_to_qradar("INFO", "Ejecutando SQL (lote)", {"sql": sql_query})
+                try:
+                    resultado = _ejecutar_sql(conn, sql_query)
+                except SQLRechazado as e:
+                    send_to_qradar("WARNING", "SQL rechazado por coste", {"sql": sql_query, "motivo": str(e)})
+                    resultados[clave] = {"error": f"Coste: {e}"}
+                    conn.rollback()
+                    continue
+                except Exception as e:
+                    print(f"❌ ERROR BBDD (lote): {e}")
+                    resultados[clave] = {"error": str(e)}
+                    # La transacción queda abortada; si la conexión está rota, salta al except de fuera
+                    conn.rollback()
+                    continue
+                if CACHE_RESULTADOS_MAX_BYTES > 0:
+                    cache_resultados.guardar(clave, resultado)
+                resultados[clave] = {**resultado, "cache": {"hit": False, "edad_s": 0.0}}
+    except Exception as e:
+        print(f"❌ ERROR BBDD (lote): {e}")
+        for clave in pendientes:
+            resultados.setdefault(clave, {"error": str(e)})
+    return resultados
+
+def generar_respuesta_natural(pregunta_usuario, resultados_db, prioridad=INTERACTIVA):
     """
-    
-    user_message = f"""
-    PREGUNTA: {pregunta_usuario}
-    DATOS OBTENIDOS: {data_str}
+    Toma la pregunta y el resumen de los datos, y crea una frase amable.
     """
+    clave = (normalizar_prompt(pregunta_usuario), huella_contexto(resultados_db))
+    return una_vez("respuesta", clave, lambda: _pedir_respuesta(pregunta_usuario, resultados_db, prioridad))
 
+def _pedir_respuesta(pregunta_usuario, resultados_db, prioridad=INTERACTIVA):
     try:
-        completion = client.chat.completions.create(
-            model=modelo_groq, # último modelo
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_message}
-            ],
+        completion = llm.crear(
+            "respuesta", prioridad,
+            messages=mensajes_respuesta(pregunta_usuario, resultados_db),
             temperature=0.2, # Un poco más creativo para hablar
         )
+        registrar_tokens("respuesta", completion.usage)
         return completion.choices[0].message.content
     except Exception as e:
         return "Tengo los datos pero hubo un error al resumirlos."
 
+def generar_respuesta(pregunta_usuario, resultado, estrategia, prioridad=INTERACTIVA):
+    """
+    Respuesta textual según la estrategia: plantilla local, resumen de Groq o nada.
+    Devuelve (texto, {"estrategia": usada, "ms": latencia}).
+    """
+    inicio = time.perf_counter()
+    with etapa("respuesta"):
+        texto, usada = respuesta_local(resultado, estrategia, PLANTILLA_MAX_FILAS)
+        if usada == "llm":
+            texto = generar_respuesta_natural(pregunta_usuario, resumen_para_llm(resultado), prioridad)
+    segundos = time.perf_counter() - inicio
+    latencia_estrategias.registrar(usada, segundos)
+    return texto, {"estrategia": usada, "ms": round(1000 * segundos, 3)}
+
+def generar_respuesta_natural_stream(pregunta_usuario, resultados_db):
+    """
+    Igual que generar_respuesta_natural pero va devolviendo los tokens según llegan de Groq.
+    """
+    try:
+        stream = llm.crear(
+            "respuesta",
+            messages=mensajes_respuesta(pregunta_usuario, resultados_db),
+            temperature=0.2,
+            stream=True,
+        )
+        for chunk in stream:
+            # Groq manda el uso de tokens en el último chunk (x_groq.usage)
+            registrar_tokens("respuesta", getattr(getattr(chunk, "x_groq", None), "usage", None))
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                yield delta
+    except Exception as e:
+        print(f"❌ ERROR GROQ (stream): {e}")
+        yield "Tengo los datos pero hubo un error al resumirlos."
+
+def _evento_sse(evento, datos):
+    # Decimal y fechas se serializan igual que en la respuesta JSON normal
+    return f"event: {evento}\ndata: {json.dumps(datos, default=valor_json, ensure_ascii=False)}\n\n"
+
+def sesion_pedida(data, cabecera=None):
+    """
+    Sesión de la petición: {"sesion": "<id>"} (o la cabecera X-Kairo-Sesion) continúa una
+    conversación y {"sesion": true} empieza una nueva. Sin ninguna de las dos, pregunta suelta.
+    """
+    valor = (data or {}).get("sesion") or cabecera
+    if not valor or SESIONES_MAX <= 0:
+        return None
+    return sesiones.obtener(valor if isinstance(valor, str) else None)
+
+def cerrar_turno(sesion, pregunta, analisis, resultado):
+    # Guarda el turno en la sesión y devuelve el bloque "sesion" de la respuesta
+    if sesion is None:
+        return None
+    sesiones.registrar(sesion, pregunta, analisis, resultado)
+    return {"id": sesion.id, "turno": len(sesion.turnos), "derivado": bool(resultado.get("derivado"))}
+
+def quiere_tiempos(data):
+    # Bloque "timings" para depurar: {"timings": true} en el body o cabecera X-Kairo-Timings: 1
+    return bool((data or {}).get("timings")) or request.headers.get("X-Kairo-Timings") == "1"
+
+def responder(envelope, resultado, data=None):
+    """
+    Serializa la respuesta en el formato negociado con el cliente
+    (campo "format" del body o cabecera Accept): JSON columnar, Arrow IPC o Parquet.
+    """
+    formato = elegir_formato((data or {}).get("format"), request.headers.get("Accept"))
+    tiempos = tiempos_actuales()
+    detalle = tiempos is not None and quiere_tiempos(data)
+    if detalle:
+        # La serialización aún no ha ocurrido: su duración va en la cabecera Server-Timing
+        envelope["metadata"] = {**envelope.get("metadata", {}), "timings": tiempos.resumen()}
+    with etapa("serializacion"):
+        cuerpo, mimetype = codificar(envelope, resultado, formato)
+    respuesta = Response(cuerpo, mimetype=mimetype)
+    if tiempos is not None:
+        medir("total", time.perf_counter() - tiempos.inicio)
+        if detalle:
+            respuesta.headers["Server-Timing"] = tiempos.server_timing()
+    return respuesta
+
 # ======================
 # ENDPOINTS
 # ======================
@@ -170,37 +535,270 @@ def generar_respuesta_natural(pregunta_usuario, resultados_db):
 def home():
     return "API Kairo 🚀"
 
+@app.route('/health', methods=['GET'])
+def health():
+    # Liveness: el proceso atiende peticiones. No toca BBDD ni Groq
+    return jsonify({"estado": "ok", "pid": os.getpid()})
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    # Readiness: BBDD y Groq alcanzables; si no, 503 para que el balanceador no mande tráfico
+    comprobaciones = comprobar_dependencias()
+    listo = all(c["ok"] for c in comprobaciones.values())
+    return jsonify({"listo": listo, **comprobaciones}), 200 if listo else 503
+
+@app.route('/metricas', methods=['GET'])
+def metricas():
+    return jsonify({
+        "pool_db": pool_db.estadisticas(),
+        "cache_intencion": cache_intencion.estadisticas(),
+        "logs_qradar": enviador_logs.estadisticas(),
+        "cache_resultados": cache_resultados.estadisticas(),
+        "respuesta_por_estrategia": latencia_estrategias.estadisticas(),
+        "esquema": indice_esquema.estadisticas(),
+        "vuelo_unico": vuelos.estadisticas(),
+        "llm": llm.estadisticas(),
+        "rollups": rutas_rollup.estadisticas(),
+        "sesiones": sesiones.estadisticas(),
+    })
+
+@app.route('/metrics', methods=['GET'])
+def metrics_prometheus():
+    cuerpo, content_type = exportar()
+    return Response(cuerpo, content_type=content_type)
+
+@app.route('/admin/cache/invalidar', methods=['POST'])
+def invalidar_cache():
+    """
+    Invalida la caché de resultados. Body: {"tablas": ["clientes", ...]} (vacío = todo).
+    Requiere la cabecera X-Admin-Token.
+    """
+    if not ADMIN_TOKEN or not hmac.compare_digest(request.headers.get("X-Admin-Token", ""), ADMIN_TOKEN):
+        return jsonify({"error": "No autorizado"}), 403
+    tablas = (request.get_json(silent=True) or {}).get("tablas")
+    borradas = cache_resultados.invalidar(tablas)
+    send_to_qradar("INFO", "Caché de resultados invalidada", {"tablas": tablas or "*", "entradas": borradas})
+    return jsonify({"invalidadas": borradas, "tablas": tablas or "*"})
+
 @app.route('/consulta', methods=['POST'])
 def process_request():
+    iniciar_peticion()
+    fijar_plazo(LLM_PLAZO)
     data = request.json
     pregunta = data.get('prompt')
+    sesion = sesion_pedida(data, request.headers.get("X-Kairo-Sesion"))
     
     print(f"📩 Recibida pregunta: {pregunta}") # Debug
 
-    # 1. Analizar
-    analisis = analizar_intencion(pregunta)
+    # 1. Analizar (con el historial de la sesión, si la hay)
+    analisis = analizar_intencion(pregunta, sesion=sesion)
     if not analisis or "sql" not in analisis:
         return jsonify({"error": "Fallo en Groq al generar SQL"}), 500
     
-    # 2. Consultar
-    raw_data = execute_query(analisis["sql"])
+    # 2. Consultar (o derivar del resultado anterior de la sesión)
+    resultado = consultar_en_sesion(sesion, analisis["sql"])
     
     # Si la BBDD devolvió error, devolvemos 500 y mostramos el detalle
-    if isinstance(raw_data, dict) and "error" in raw_data:
-        print(f"⚠️ Devolviendo Error 500 por fallo SQL: {raw_data['error']}")
-        return jsonify({"respuesta": "Error Técnico", "detalle": raw_data}), 500
+    if "error" in resultado:
+        print(f"⚠️ Devolviendo Error 500 por fallo SQL: {resultado['error']}")
+        return jsonify({"respuesta": "Error Técnico", "detalle": resultado}), 500
     
-    # 3. Responder
-    respuesta = generar_respuesta_natural(pregunta, raw_data)
+    info_sesion = cerrar_turno(sesion, pregunta, analisis, resultado)
+
+    # 3. Responder (plantilla local, resumen LLM o nada, según la estrategia)
+    respuesta, info_respuesta = generar_respuesta(pregunta, resultado, estrategia_pedida(data))
+    grafico = bloque_grafico(analisis, resultado)
     
-    return jsonify({
-        "metadata": {"prompt": pregunta},
+    return responder({
+        "metadata": {"prompt": pregunta, "cache": resultado["cache"], "rollup": resultado.get("rollup"),
+                     "respuesta": info_respuesta, "sesion": info_sesion},
         "sql": analisis["sql"],
         "type": analisis.get("type", "data"),
         "chart_type": analisis.get("chart_type"),
-        "data": raw_data,
+        "grafico": grafico,
+        **info_paginacion(analisis["sql"], resultado),
         "respuesta_bot": respuesta
-    })
+    }, datos_a_enviar(resultado, grafico, data), data)
+
+def item_lote(pregunta, analisis, resultado, estrategia):
+    """Entrada de /consulta/lote para una pregunta: sus datos y su respuesta, o su error."""
+    if not isinstance(analisis, dict) or not analisis.get("sql"):
+        return {"prompt": pregunta, "ok": False, "error": "Fallo en Groq al generar SQL"}
+    if "error" in resultado:
+        return {"prompt": pregunta, "ok": False, "sql": analisis["sql"],
+                "error": "Error Técnico", "detalle": resultado}
+    respuesta, info_respuesta = generar_respuesta(pregunta, resultado, estrategia, LOTE)
+    return {
+        "prompt": pregunta,
+        "ok": True,
+        "metadata": {"cache": resultado["cache"], "rollup": resultado.get("rollup"), "respuesta": info_respuesta},
+        "sql": analisis["sql"],
+        "type": analisis.get("type", "data"),
+        "chart_type": analisis.get("chart_type"),
+        "grafico": bloque_grafico(analisis, resultado),
+        "data": columnar(resultado),
+        **info_paginacion(analisis["sql"], resultado),
+        "respuesta_bot": respuesta,
+    }
+
+@app.route('/consulta/lote', methods=['POST'])
+def process_batch():
+    """
+    Varias preguntas en una sola petición. Body: {"prompts": ["...", ...], "respuesta": "auto"}.
+    Las intenciones se piden a Groq en paralelo (máximo LOTE_CONCURRENCIA a la vez), los SQL
+    repetidos se ejecutan una vez y todos sobre la misma conexión. Cada elemento trae su
+    resultado o su error: un fallo no tumba el lote.
+    """
+    tiempos = iniciar_peticion()
+    data = request.json or {}
+    preguntas, error = leer_lote(data)
+    if error:
+        return jsonify({"error": error}), 400
+    estrategia = estrategia_pedida(data)
+
+    def analizar(pregunta):
+        if not isinstance(pregunta, str) or not pregunta.strip():
+            return None
+        # Prioridad de lote: las preguntas interactivas pasan delante en la cola de Groq
+        return analizar_intencion(pregunta, LOTE)
+
+    def en_paralelo(ejecutor, funcion, elementos):
+        # Los hilos del ejecutor no heredan los contextvars (tiempos por etapa, plazo de Groq):
+        # cada tarea corre en su propia copia del contexto de la petición
+        futuros = [ejecutor.submit(contextvars.copy_context().run, funcion, e) for e in elementos]
+        return [f.result() for f in futuros]
+
+    with ThreadPoolExecutor(max_workers=max(1, LOTE_CONCURRENCIA)) as ejecutor:
+        # 1. Analizar (en paralelo)
+        with etapa("lote_intencion"):
+            analisis = en_paralelo(ejecutor, analizar, preguntas)
+
+        # 2. Consultar (SQL únicos, una conexión)
+        sqls = [a["sql"] if isinstance(a, dict) and a.get("sql") else None for a in analisis]
+        with etapa("lote_bd"):
+            resultados = execute_queries([sql for sql in sqls if sql])
+
+        # 3. Responder (en paralelo; las plantillas no llaman a Groq)
+        with etapa("lote_respuesta"):
+            items = en_paralelo(
+                ejecutor,
+                lambda i: item_lote(preguntas[i], analisis[i], resultados.get(sqls[i]), estrategia),
+                range(len(preguntas)),
+            )
+
+    send_to_qradar("INFO", "Lote procesado", {"preguntas": len(preguntas), "sql_distintos": len(resultados)})
+    timings = tiempos.resumen() if quiere_tiempos(data) else None
+    return Response(cuerpo_lote(items, timings), mimetype=MIME_JSON)
+
+@app.route('/consulta/pagina', methods=['POST'])
+def process_page():
+    """
+    Devuelve la siguiente página de un resultado truncado a partir de su "next_token".
+    Cada página vuelve a ejecutar el SQL con OFFSET: sin ORDER BY en la consulta, las
+    páginas pueden solaparse o saltarse filas (ver paginacion.limitar_sql).
+    """
+    iniciar_peticion()
+    data = request.json or {}
+    token = data.get('token')
+    if not token:
+        return jsonify({"error": "Falta el token de página"}), 400
+    try:
+        sql_query, offset = leer_token(PAGINACION_SECRETO, token, ttl=PAGINACION_TTL)
+    except TokenInvalido as e:
+        return jsonify({"error": f"Token de página no válido: {e}"}), 400
+
+    resultado = execute_query(sql_query, offset=offset)
+    if "error" in resultado:
+        return jsonify({"respuesta": "Error Técnico", "detalle": resultado}), 500
+
+    return responder({
+        "metadata": {"cache": resultado["cache"], "rollup": resultado.get("rollup")},
+        "sql": sql_query,
+        "offset": offset,
+        **info_paginacion(sql_query, resultado),
+    }, resultado, data)
+
+@app.route('/consulta/stream', methods=['POST'])
+def process_request_stream():
+    """
+    Versión en streaming (Server-Sent Events) de /consulta. Eventos, en orden:
+    "sql" -> "data" -> "token" (varios) -> "fin". Si algo falla se emite "error".
+    """
+    data = request.json
+    pregunta = data.get('prompt')
+    sesion = sesion_pedida(data, request.headers.get("X-Kairo-Sesion"))
+
+    estrategia = estrategia_pedida(data)
+    con_tiempos = quiere_tiempos(data)
+
+    print(f"📩 Recibida pregunta (stream): {pregunta}") # Debug
+
+    def generar():
+        iniciar_peticion()
+        fijar_plazo(LLM_PLAZO)
+        # 1. Analizar
+        analisis = analizar_intencion(pregunta, sesion=sesion)
+        if not analisis or "sql" not in analisis:
+            yield _evento_sse("error", {"error": "Fallo en Groq al generar SQL"})
+            return
+        yield _evento_sse("sql", {
+            "metadata": {"prompt": pregunta, "sesion": sesion.id if sesion else None},
+            "sql": analisis["sql"],
+            "type": analisis.get("type", "data"),
+            "chart_type": analisis.get("chart_type"),
+        })
+
+        # 2. Consultar
+        resultado = consultar_en_sesion(sesion, analisis["sql"])
+        if "error" in resultado:
+            yield _evento_sse("error", {"respuesta": "Error Técnico", "detalle": resultado})
+            return
+        grafico = bloque_grafico(analisis, resultado)
+        yield _evento_sse("data", {
+            "data": columnar(datos_a_enviar(resultado, grafico, data)),
+            "grafico": grafico,
+            "cache": resultado["cache"],
+            "rollup": resultado.get("rollup"),
+            "sesion": cerrar_turno(sesion, pregunta, analisis, resultado),
+            **info_paginacion(analisis["sql"], resultado),
+        })
+
+        # 3. Responder: token a token si es el LLM, de una vez si es una plantilla
+        inicio = time.perf_counter()
+        texto, usada = respuesta_local(resultado, estrategia, PLANTILLA_MAX_FILAS)
+        if usada == "llm":
+            partes = []
+            for token in generar_respuesta_natural_stream(pregunta, resumen_para_llm(resultado)):
+                if not partes:
+                    medir("respuesta_primer_token", time.perf_counter() - inicio)
+                partes.append(token)
+                yield _evento_sse("token", {"token": token})
+            texto = "".join(partes)
+        elif texto:
+            yield _evento_sse("token", {"token": texto})
+        segundos = time.perf_counter() - inicio
+        medir("respuesta", segundos)
+        latencia_estrategias.registrar(usada, segundos)
+        fin = {
+            "respuesta_bot": texto,
+            "respuesta": {"estrategia": usada, "ms": round(1000 * segundos, 3)},
+        }
+        if con_tiempos:
+            fin["timings"] = tiempos_actuales().resumen()
+        yield _evento_sse("fin", fin)
+
+    return Response(
+        stream_with_context(generar()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    # Solo para desarrollo; en producción: gunicorn -c gunicorn.conf.py app:app
+    depurar = os.environ.get("FLASK_DEBUG") == "1"
+    # Con el recargador de debug, el proceso que vigila los ficheros no atiende peticiones
+    if not depurar or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        iniciar_hilos()
+        if CALENTAR:
+            calentar_en_segundo_plano()
+    app.run(debug=depurar, host='0.0.0.0', port=int(os.environ.get("PORT", 5000)))
\ No newline at end of file
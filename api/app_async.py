@@ -0,0 +1,581 @@
+"""
+Versión asíncrona (ASGI) de la API Kairo.
+
+Mismo contrato que /consulta en app.py, pero sin bloquear un hilo por petición:
+cliente AsyncGroq, pool asyncpg y el mismo envío de logs a QRadar en segundo plano.
+Permite cientos de preguntas en vuelo por proceso.
+
+Arranque:  uvicorn app_async:app --host 0.0.0.0 --port 5001 --workers 4 --timeout-keep-alive 5
+"""
+import asyncio
+import json
+import os
+import re
+import time
+from contextlib import asynccontextmanager
+
+import asyncpg
+from quart import Quart, request, jsonify, Response
+from quart_cors import cors
+
+# Configuración, prompts y funciones puras compartidas con app.py (importar app.py crearía
+# su pool psycopg2, sus cachés y sus hilos; aquí cada componente es propio)
+from comun import (
+    DB_URI, GROQ_API_KEY,
+    DB_POOL_MIN, DB_POOL_MAX, DB_POOL_MAX_USOS, DB_POOL_MAX_EDAD, DB_POOL_TIMEOUT,
+    RESULTADO_MAX_FILAS, RESULTADO_MAX_BYTES, DB_TAMANO_LOTE, PAGINACION_SECRETO, PAGINACION_TTL,
+    CACHE_RESULTADOS_MAX_BYTES, PLANTILLA_MAX_FILAS, SESIONES_MAX,
+    SQL_MAX_COSTE, SQL_MAX_FILAS_ESTIMADAS, SQL_TIMEOUT_MS, VUELO_UNICO, LOTE_CONCURRENCIA,
+    LLM_MODELO_RESPALDO, LLM_CONCURRENCIA, LLM_REINTENTOS, LLM_PLAZO, LLM_UMBRAL_RESPALDO, LLM_KEEPALIVE,
+    READY_TIMEOUT, READY_CACHE, READY_COMPROBAR_LLM, CALENTAR, modelo_groq,
+    crear_cache_intencion, crear_cache_resultados, crear_escucha_invalidaciones, crear_indice_esquema,
+    crear_rutas_rollup, crear_refresco_rollups, crear_vuelos, crear_sesiones, crear_enviador_logs,
+    formatear_syslog, mensajes_intencion, mensajes_respuesta, texto_esquema, esquema_sesion, huella_intencion,
+    comprobar_sql, reescribir_rollup, resumen_para_llm, info_paginacion, estrategia_pedida,
+    bloque_grafico, datos_a_enviar, leer_lote, cuerpo_lote, preparar_lote,
+)
+from db_pool import PoolConexiones
+from planificador_llm import PlanificadorLLM, INTERACTIVA, LOTE, fijar_plazo
+from cache_semantica import huella_contexto, normalizar_prompt
+from paginacion import Presupuesto, TokenInvalido, limitar_sql, leer_token
+from formatos import elegir_formato, codificar, columnar, MIME_JSON, PYARROW_DISPONIBLE
+from respuestas import LatenciaEstrategias, respuesta_local
+from validacion_sql import SQLRechazado, comprobar_plan
+from derivacion import derivar
+from metricas import (
+    etapa, medir, anotar, iniciar_peticion, tiempos_actuales, registrar_tokens, registrar_filas, exportar,
+    registrar_fuente,
+)
+
+# Como flask-cors con supports_credentials: se devuelve el Origin de la petición (quart-cors
+# no admite "*" con credenciales)
+app = cors(Quart(__name__), allow_origin=re.compile(r".*"), allow_credentials=True)
+
+# CLIENTE GROQ ASÍNCRONO (los reintentos los hace el planificador; se crea con la primera llamada)
+def crear_cliente_groq():
+    import httpx
+    from groq import AsyncGroq, DefaultAsyncHttpxClient
+    limites = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=LLM_KEEPALIVE)
+    return AsyncGroq(api_key=GROQ_API_KEY, max_retries=0, http_client=DefaultAsyncHttpxClient(limits=limites))
+
+llm = PlanificadorLLM(
+    None, modelo_groq,
+    modelo_respaldo=LLM_MODELO_RESPALDO or None,
+    max_concurrencia=LLM_CONCURRENCIA,
+    reintentos=LLM_REINTENTOS,
+    umbral_respaldo=LLM_UMBRAL_RESPALDO,
+    plazo=LLM_PLAZO,
+    crear_cliente=crear_cliente_groq,
+)
+# COMPONENTES (propios de este proceso, con la misma configuración que app.py)
+cache_resultados = crear_cache_resultados()
+escucha_invalidaciones = crear_escucha_invalidaciones(cache_resultados)
+refresco_rollups = crear_refresco_rollups()
+cache_intencion = crear_cache_intencion()
+vuelos = crear_vuelos()
+sesiones = crear_sesiones()
+latencia_estrategias = LatenciaEstrategias()
+enviador_logs = crear_enviador_logs()
+
+# El índice del esquema y el estado de los rollups se releen en hilos de fondo, fuera del
+# event loop; usan un pool psycopg2 pequeño que no atiende peticiones
+pool_fondo = PoolConexiones(DB_URI, minimo=0, maximo=2, max_edad=DB_POOL_MAX_EDAD, timeout=DB_POOL_TIMEOUT)
+indice_esquema = crear_indice_esquema(pool_fondo)
+rutas_rollup = crear_rutas_rollup(pool_fondo, cache_resultados)
+
+registrar_fuente("llm", llm.estadisticas, {"cola": "prioridad", "cupo": "modelo"})
+registrar_fuente("cache_intencion", cache_intencion.estadisticas)
+registrar_fuente("logs_qradar", enviador_logs.estadisticas)
+registrar_fuente("cache_resultados", cache_resultados.estadisticas)
+registrar_fuente("respuesta_por_estrategia", latencia_estrategias.estadisticas, {"": "estrategia"})
+registrar_fuente("esquema", indice_esquema.estadisticas)
+registrar_fuente("vuelo_unico", vuelos.estadisticas)
+registrar_fuente("rollups", rutas_rollup.estadisticas, {"disponibles": "rollup", "reescritas": "rollup"})
+registrar_fuente("sesiones", sesiones.estadisticas)
+
+def send_to_qradar(level, message, extra=None):
+    # Solo encola; el envío va en el hilo del EnviadorSyslog
+    enviador_logs.enviar(formatear_syslog(level, message, extra))
+
+# Se crea al arrancar el servidor (necesita el event loop)
+pool_db = None
+_creadas = {}   # pid del backend -> instante en que se abrió la conexión (reciclado por edad)
+
+# ======================
+# CICLO DE VIDA
+# ======================
+async def _init_conexion(conn):
+    # Sesión de solo lectura, una vez por conexión
+    await conn.execute("SET SESSION CHARACTERISTICS AS TRANSACTION READ ONLY")
+    _creadas[conn.get_server_pid()] = time.monotonic()
+
+@asynccontextmanager
+async def conexion_bd():
+    """
+    Conexión del pool asyncpg. Como en db_pool.py, se recicla tras DB_POOL_MAX_USOS consultas
+    (max_queries de asyncpg) o DB_POOL_MAX_EDAD segundos de vida: si ha caducado se cierra
+    al devolverla y el pool abre otra en el siguiente acquire.
+    """
+    async with pool_db.acquire(timeout=DB_POOL_TIMEOUT) as conn:
+        try:
+            yield conn
+        finally:
+            pid = conn.get_server_pid()
+            creada = _creadas.get(pid)
+            if DB_POOL_MAX_EDAD and creada is not None and time.monotonic() - creada > DB_POOL_MAX_EDAD:
+                del _creadas[pid]
+                await conn.close()
+
+@app.before_request
+async def limpiar_contexto():
+    # Como en app.py: ninguna petición parte con el plazo de Groq de otra anterior
+    fijar_plazo(None)
+
+@app.before_serving
+async def arrancar():
+    global pool_db
+    pool_db = await asyncpg.create_pool(
+        DB_URI,
+        min_size=DB_POOL_MIN,
+        max_size=DB_POOL_MAX,
+        max_queries=DB_POOL_MAX_USOS,
+        init=_init_conexion,
+    )
+    # Hilos de fondo en cada worker de uvicorn, no al importar el módulo
+    if escucha_invalidaciones is not None:
+        escucha_invalidaciones.iniciar()
+    if refresco_rollups is not None:
+        refresco_rollups.iniciar()
+    if CALENTAR:
+        # Sin bloquear el arranque: el servidor ya acepta peticiones mientras tanto
+        _calentando.append(asyncio.get_running_loop().create_task(calentar()))
+
+_calentando = []
+
+async def calentar():
+    """Como app.calentar: módulos diferidos, índice del esquema y conexión con Groq abierta."""
+    if PYARROW_DISPONIBLE:
+        import pyarrow.ipc  # noqa: F401
+    indice_esquema.iniciar()
+    pasos = {}
+    if GROQ_API_KEY:
+        pasos["llm"] = await _sonda(llm.cliente.models.list(timeout=READY_TIMEOUT))
+    send_to_qradar("INFO", "Proceso calentado", {"pid": os.getpid(), **pasos})
+    return pasos
+
+@app.after_serving
+async def parar():
+    enviador_logs.parar()
+    if pool_db is not None:
+        await pool_db.close()
+
+_sondas = {"instante": 0.0, "resultado": None}
+
+async def _sonda(corrutina):
+    inicio = time.perf_counter()
+    try:
+        await corrutina
+        estado = {"ok": True}
+    except Exception as e:
+        estado = {"ok": False, "error": f"{type(e).__name__}: {e}"[:200]}
+    estado["ms"] = round(1000 * (time.perf_counter() - inicio), 1)
+    return estado
+
+async def comprobar_dependencias():
+    # Igual que en app.py: BBDD y Groq, con el último resultado reutilizado READY_CACHE segundos
+    if _sondas["resultado"] is not None and time.monotonic() - _sondas["instante"] < READY_CACHE:
+        return _sondas["resultado"]
+    if pool_db is None:
+        resultado = {"bd": {"ok": False, "error": "pool sin crear", "ms": 0.0}}
+    else:
+        resultado = {"bd": await _sonda(pool_db.fetchval("SELECT 1", timeout=READY_TIMEOUT))}
+    if READY_COMPROBAR_LLM:
+        resultado["llm"] = await _sonda(llm.cliente.models.list(timeout=READY_TIMEOUT))
+    _sondas.update(instante=time.monotonic(), resultado=resultado)
+    return resultado
+
+# ======================
+# LÓGICA
+# ======================
+async def una_vez(tipo, clave, fabrica):
+    # Misma deduplicación que app.py, entre las corrutinas de este proceso
+    return await vuelos.ejecutar_async(tipo, clave, fabrica) if VUELO_UNICO else await fabrica()
+
+# Los pasos de CPU (BM25 del esquema, sqlglot, derivación, gráficos, resumen de datos) son
+# síncronos y van con asyncio.to_thread para no parar el event loop; to_thread copia el
+# contexto, así que sus tiempos siguen contando en la petición
+def esquema_para(natural_query):
+    return texto_esquema(indice_esquema, natural_query)
+
+def contexto_intencion(historial=None):
+    return huella_intencion(indice_esquema, historial)
+
+def validar(sql_query):
+    """Devuelve None si el SQL se puede ejecutar o {"error"} con el motivo del rechazo."""
+    try:
+        comprobar_sql(indice_esquema, sql_query)
+    except SQLRechazado as e:
+        send_to_qradar("WARNING", "SQL rechazado", {"sql": sql_query, "motivo": str(e)})
+        return {"error": f"Seguridad: {e}"}
+    return None
+
+def sql_a_ejecutar(sql_query):
+    return reescribir_rollup(rutas_rollup, sql_query)
+
+def sesion_pedida(data, cabecera=None):
+    # Igual que en app.py: {"sesion": "<id>"} o X-Kairo-Sesion continúa, {"sesion": true} empieza
+    valor = (data or {}).get("sesion") or cabecera
+    if not valor or SESIONES_MAX <= 0:
+        return None
+    return sesiones.obtener(valor if isinstance(valor, str) else None)
+
+def cerrar_turno(sesion, pregunta, analisis, resultado):
+    if sesion is None:
+        return None
+    sesiones.registrar(sesion, pregunta, analisis, resultado)
+    return {"id": sesion.id, "turno": len(sesion.turnos), "derivado": bool(resultado.get("derivado"))}
+
+async def analizar_intencion(natural_query, prioridad=INTERACTIVA, sesion=None):
+    with etapa("intencion"):
+        historial = esquema = None
+        if sesion is not None:
+            historial = sesion.historial()
+            sesion.esquema, sesion.tablas = await asyncio.to_thread(
+                esquema_sesion, indice_esquema, natural_query, sesion.esquema, sesion.tablas
+            )
+            esquema = sesion.esquema
+        return await _analizar_intencion(natural_query, prioridad, historial, esquema)
+
+async def _analizar_intencion(natural_query, prioridad=INTERACTIVA, historial=None, esquema=None):
+    contexto = contexto_intencion(historial)
+    cacheado, nivel = cache_intencion.obtener(natural_query, contexto)
+    anotar("intencion_cache", nivel or "fallo")
+    if cacheado is not None:
+        print(f"⚡ Caché de intención ({nivel})")
+        return cacheado
+
+    return await una_vez("intencion", (contexto, normalizar_prompt(natural_query)),
+                         lambda: _pedir_intencion(natural_query, contexto, prioridad, historial, esquema))
+
+async def _pedir_intencion(natural_query, contexto, prioridad=INTERACTIVA, historial=None, esquema=None):
+    if esquema is None:
+        esquema = await asyncio.to_thread(esquema_para, natural_query)
+    try:
+        completion = await llm.crear_async(
+            "intencion", prioridad,
+            messages=mensajes_intencion(natural_query, historial, esquema),
+            temperature=0, stream=False, response_format={"type": "json_object"}
+        )
+        registrar_tokens("intencion", completion.usage)
+        analisis = json.loads(completion.choices[0].message.content)
+    except Exception as e:
+        print(f"❌ ERROR GROQ: {e}")
+        return None
+
+    if isinstance(analisis, dict) and analisis.get("sql") and completion.model == modelo_groq:
+        cache_intencion.guardar(natural_query, contexto, analisis)
+    return analisis
+
+async def execute_query(sql_query, offset=0):
+    rechazo = await asyncio.to_thread(validar, sql_query)
+    if rechazo:
+        return rechazo
+
+    # Misma caché de resultados que app.py
+    usar_cache = CACHE_RESULTADOS_MAX_BYTES > 0
+    clave = cache_resultados.clave(sql_query, offset, RESULTADO_MAX_FILAS, RESULTADO_MAX_BYTES)
+    if usar_cache:
+        cacheado, edad = cache_resultados.obtener(clave)
+        if cacheado is not None:
+            return {**cacheado, "cache": {"hit": True, "edad_s": round(edad, 3)}}
+
+    async def consultar():
+        resultado = await _consultar_bd(sql_query, offset)
+        if usar_cache and "error" not in resultado:
+            cache_resultados.guardar(clave, resultado)
+        return resultado
+
+    resultado = await una_vez("sql", clave, consultar)
+    if "error" not in resultado:
+        resultado = {**resultado, "cache": {"hit": False, "edad_s": 0.0}}
+    return resultado
+
+async def consultar_en_sesion(sesion, sql_query):
+    # Igual que en app.py: los seguimientos que se pueden derivar del resultado anterior no van a la BBDD
+    anterior = sesion.ultimo() if sesion is not None else None
+    if anterior is not None and anterior.resultado is not None:
+        with etapa("sesion_derivacion"):
+            derivado = await asyncio.to_thread(derivar, anterior.sql, sql_query, anterior.resultado)
+        if derivado is not None and await asyncio.to_thread(validar, sql_query) is None:
+            anotar("sesion_derivado", True)
+            send_to_qradar("INFO", "SQL derivado del turno anterior", {"sql": sql_query, "sesion": sesion.id})
+            return {**derivado, "cache": {"hit": False, "edad_s": 0.0},
+                    "rollup": anterior.resultado.get("rollup"), "derivado": True}
+    return await execute_query(sql_query)
+
+async def _consultar_bd(sql_query, offset=0):
+    send_to_qradar("INFO", "Ejecutando SQL", {"sql": sql_query, "offset": offset})
+    try:
+        inicio = time.perf_counter()
+        async with conexion_bd() as conn:
+            medir("bd_conexion", time.perf_counter() - inicio)
+            return await _ejecutar_sql(conn, sql_query, offset)
+    except SQLRechazado as e:
+        send_to_qradar("WARNING", "SQL rechazado por coste", {"sql": sql_query, "motivo": str(e)})
+        return {"error": f"Coste: {e}"}
+    except Exception as e:
+        print(f"❌ ERROR BBDD: {e}")
+        return {"error": str(e)}
+
+async def _ejecutar_sql(conn, sql_query, offset=0):
+    # Los cursores de asyncpg necesitan transacción; traen las filas por lotes
+    sql_ejecutar, rollup = await asyncio.to_thread(sql_a_ejecutar, sql_query)
+    async with conn.transaction(readonly=True):
+        sql_limitado = limitar_sql(sql_ejecutar, RESULTADO_MAX_FILAS, offset)
+        await conn.execute(f"SET LOCAL statement_timeout = {int(SQL_TIMEOUT_MS)}")
+        if SQL_MAX_COSTE or SQL_MAX_FILAS_ESTIMADAS:
+            with etapa("bd_plan"):
+                plan = json.loads(await conn.fetchval("EXPLAIN (FORMAT JSON) " + sql_limitado))
+                coste, _ = comprobar_plan(plan, SQL_MAX_COSTE, SQL_MAX_FILAS_ESTIMADAS)
+            anotar("bd_coste_estimado", coste)
+
+        presupuesto = Presupuesto(RESULTADO_MAX_FILAS, RESULTADO_MAX_BYTES)
+        with etapa("bd_ejecucion"):
+            stmt = await conn.prepare(sql_limitado)
+        columns = [attr.name for attr in stmt.get_attributes()]
+        rows, truncated = [], False
+        with etapa("bd_lectura"):
+            async for record in stmt.cursor(prefetch=DB_TAMANO_LOTE):
+                row = tuple(record.values())
+                if not presupuesto.admite(row):
+                    truncated = True
+                    break
+                rows.append(row)
+    registrar_filas(len(rows))
+    return {
+        "columns": columns,
+        "rows": rows,
+        "truncated": truncated,
+        "next_offset": offset + len(rows) if truncated else None,
+        "rollup": rollup,
+    }
+
+async def execute_queries(sqls):
+    # Igual que en app.py: SQL distintos, caché y una sola conexión para los que faltan
+    claves, resueltas, pendientes = await asyncio.to_thread(preparar_lote, sqls, cache_resultados, validar)
+    if pendientes:
+        resueltas.update(await _consultar_bd_lote(pendientes))
+    return {sql: resueltas[clave] for sql, clave in claves.items()}
+
+async def _consultar_bd_lote(pendientes):
+    resultados = {}
+    try:
+        inicio = time.perf_counter()
+        async with conexion_bd() as conn:
+            medir("bd_conexion", time.perf_counter() - inicio)
+            for clave, sql_query in pendientes.items():
+                send_to_qradar("INFO", "Ejecutando SQL (lote)", {"sql": sql_query})
+                try:
+                    # Cada consulta en su transacción: si una falla, las demás siguen
+                    resultado = await _ejecutar_sql(conn, sql_query)
+                except SQLRechazado as e:
+                    send_to_qradar("WARNING", "SQL rechazado por coste", {"sql": sql_query, "motivo": str(e)})
+                    resultados[clave] = {"error": f"Coste: {e}"}
+                    continue
+                except asyncpg.PostgresError as e:
+                    print(f"❌ ERROR BBDD (lote): {e}")
+                    resultados[clave] = {"error": str(e)}
+                    continue
+                if CACHE_RESULTADOS_MAX_BYTES > 0:
+                    cache_resultados.guardar(clave, resultado)
+                resultados[clave] = {**resultado, "cache": {"hit": False, "edad_s": 0.0}}
+    except Exception as e:
+        print(f"❌ ERROR BBDD (lote): {e}")
+        for clave in pendientes:
+            resultados.setdefault(clave, {"error": str(e)})
+    return resultados
+
+async def generar_respuesta_natural(pregunta_usuario, resultados_db, prioridad=INTERACTIVA):
+    clave = (normalizar_prompt(pregunta_usuario), huella_contexto(resultados_db))
+    return await una_vez("respuesta", clave, lambda: _pedir_respuesta(pregunta_usuario, resultados_db, prioridad))
+
+async def _pedir_respuesta(pregunta_usuario, resultados_db, prioridad=INTERACTIVA):
+    try:
+        completion = await llm.crear_async(
+            "respuesta", prioridad,
+            messages=mensajes_respuesta(pregunta_usuario, resultados_db),
+            temperature=0.2,
+        )
+        registrar_tokens("respuesta", completion.usage)
+        return completion.choices[0].message.content
+    except Exception:
+        return "Tengo los datos pero hubo un error al resumirlos."
+
+async def generar_respuesta(pregunta_usuario, resultado, estrategia, prioridad=INTERACTIVA):
+    inicio = time.perf_counter()
+    with etapa("respuesta"):
+        texto, usada = respuesta_local(resultado, estrategia, PLANTILLA_MAX_FILAS)
+        if usada == "llm":
+            resumen = await asyncio.to_thread(resumen_para_llm, resultado)
+            texto = await generar_respuesta_natural(pregunta_usuario, resumen, prioridad)
+    segundos = time.perf_counter() - inicio
+    latencia_estrategias.registrar(usada, segundos)
+    return texto, {"estrategia": usada, "ms": round(1000 * segundos, 3)}
+
+def responder(envelope, resultado, data=None):
+    formato = elegir_formato((data or {}).get("format"), request.headers.get("Accept"))
+    tiempos = tiempos_actuales()
+    detalle = tiempos is not None and (
+        bool((data or {}).get("timings")) or request.headers.get("X-Kairo-Timings") == "1"
+    )
+    if detalle:
+        envelope["metadata"] = {**envelope.get("metadata", {}), "timings": tiempos.resumen()}
+    with etapa("serializacion"):
+        cuerpo, mimetype = codificar(envelope, resultado, formato)
+    respuesta = Response(cuerpo, mimetype=mimetype)
+    if tiempos is not None:
+        medir("total", time.perf_counter() - tiempos.inicio)
+        if detalle:
+            respuesta.headers["Server-Timing"] = tiempos.server_timing()
+    return respuesta
+
+# ======================
+# ENDPOINTS
+# ======================
+
+@app.route('/', methods=['GET'])
+async def home():
+    return "API Kairo (async) 🚀"
+
+@app.route('/health', methods=['GET'])
+async def health():
+    return jsonify({"estado": "ok", "pid": os.getpid()})
+
+@app.route('/ready', methods=['GET'])
+async def ready():
+    comprobaciones = await comprobar_dependencias()
+    listo = all(c["ok"] for c in comprobaciones.values())
+    return jsonify({"listo": listo, **comprobaciones}), 200 if listo else 503
+
+@app.route('/metrics', methods=['GET'])
+async def metrics_prometheus():
+    cuerpo, content_type = exportar()
+    return Response(cuerpo, content_type=content_type)
+
+@app.route('/consulta', methods=['POST'])
+async def process_request():
+    iniciar_peticion()
+    fijar_plazo(LLM_PLAZO)
+    data = await request.get_json()
+    pregunta = data.get('prompt')
+    sesion = sesion_pedida(data, request.headers.get("X-Kairo-Sesion"))
+
+    # 1. Analizar
+    analisis = await analizar_intencion(pregunta, sesion=sesion)
+    if not analisis or "sql" not in analisis:
+        return jsonify({"error": "Fallo en Groq al generar SQL"}), 500
+
+    # 2. Consultar
+    resultado = await consultar_en_sesion(sesion, analisis["sql"])
+    if "error" in resultado:
+        print(f"⚠️ Devolviendo Error 500 por fallo SQL: {resultado['error']}")
+        return jsonify({"respuesta": "Error Técnico", "detalle": resultado}), 500
+    info_sesion = cerrar_turno(sesion, pregunta, analisis, resultado)
+
+    # 3. Responder
+    respuesta, info_respuesta = await generar_respuesta(pregunta, resultado, estrategia_pedida(data))
+    grafico = await asyncio.to_thread(bloque_grafico, analisis, resultado)
+
+    return responder({
+        "metadata": {"prompt": pregunta, "cache": resultado["cache"], "rollup": resultado.get("rollup"),
+                     "respuesta": info_respuesta, "sesion": info_sesion},
+        "sql": analisis["sql"],
+        "type": analisis.get("type", "data"),
+        "chart_type": analisis.get("chart_type"),
+        "grafico": grafico,
+        **info_paginacion(analisis["sql"], resultado),
+        "respuesta_bot": respuesta
+    }, datos_a_enviar(resultado, grafico, data), data)
+
+async def item_lote(pregunta, analisis, resultado, estrategia):
+    if not isinstance(analisis, dict) or not analisis.get("sql"):
+        return {"prompt": pregunta, "ok": False, "error": "Fallo en Groq al generar SQL"}
+    if "error" in resultado:
+        return {"prompt": pregunta, "ok": False, "sql": analisis["sql"],
+                "error": "Error Técnico", "detalle": resultado}
+    respuesta, info_respuesta = await generar_respuesta(pregunta, resultado, estrategia, LOTE)
+    grafico = await asyncio.to_thread(bloque_grafico, analisis, resultado)
+    return {
+        "prompt": pregunta,
+        "ok": True,
+        "metadata": {"cache": resultado["cache"], "rollup": resultado.get("rollup"), "respuesta": info_respuesta},
+        "sql": analisis["sql"],
+        "type": analisis.get("type", "data"),
+        "chart_type": analisis.get("chart_type"),
+        "grafico": grafico,
+        "data": columnar(resultado),
+        **info_paginacion(analisis["sql"], resultado),
+        "respuesta_bot": respuesta,
+    }
+
+@app.route('/consulta/lote', methods=['POST'])
+async def process_batch():
+    tiempos = iniciar_peticion()
+    data = (await request.get_json()) or {}
+    preguntas, error = leer_lote(data)
+    if error:
+        return jsonify({"error": error}), 400
+    estrategia = estrategia_pedida(data)
+    limite = asyncio.Semaphore(max(1, LOTE_CONCURRENCIA))
+
+    async def acotado(corrutina):
+        async with limite:
+            return await corrutina
+
+    async def analizar(pregunta):
+        if not isinstance(pregunta, str) or not pregunta.strip():
+            return None
+        return await acotado(analizar_intencion(pregunta, LOTE))
+
+    with etapa("lote_intencion"):
+        analisis = await asyncio.gather(*(analizar(p) for p in preguntas))
+
+    sqls = [a["sql"] if isinstance(a, dict) and a.get("sql") else None for a in analisis]
+    with etapa("lote_bd"):
+        resultados = await execute_queries([sql for sql in sqls if sql])
+
+    with etapa("lote_respuesta"):
+        items = await asyncio.gather(*(
+            acotado(item_lote(p, a, resultados.get(sql), estrategia))
+            for p, a, sql in zip(preguntas, analisis, sqls)
+        ))
+
+    send_to_qradar("INFO", "Lote procesado", {"preguntas": len(preguntas), "sql_distintos": len(resultados)})
+    con_tiempos = bool(data.get("timings")) or request.headers.get("X-Kairo-Timings") == "1"
+    return Response(cuerpo_lote(list(items), tiempos.resumen() if con_tiempos else None), mimetype=MIME_JSON)
+
+@app.route('/consulta/pagina', methods=['POST'])
+async def process_page():
+    iniciar_peticion()
+    data = (await request.get_json()) or {}
+    token = data.get('token')
+    if not token:
+        return jsonify({"error": "Falta el token de página"}), 400
+    try:
+        sql_query, offset = leer_token(PAGINACION_SECRETO, token, ttl=PAGINACION_TTL)
+    except TokenInvalido as e:
+        return jsonify({"error": f"Token de página no válido: {e}"}), 400
+
+    resultado = await execute_query(sql_query, offset=offset)
+    if "error" in resultado:
+        return jsonify({"respuesta": "Error Técnico", "detalle": resultado}), 500
+
+    return responder({
+        "metadata": {"cache": resultado["cache"], "rollup": resultado.get("rollup")},
+        "sql": sql_query,
+        "offset": offset,
+        **info_paginacion(sql_query, resultado),
+    }, resultado, data)
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=5001)
@@ -0,0 +1,297 @@
+"""
+Caché de resultados de BBDD indexada por el SQL normalizado.
+
+La invalidación es por tabla: desde el endpoint de administración o escuchando un
+canal LISTEN/NOTIFY de PostgreSQL. Ejemplo de trigger que avisa al cambiar datos:
+
+    CREATE OR REPLACE FUNCTION kairo_notificar() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('kairo_invalidar', TG_TABLE_NAME);
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER kairo_invalidar AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE
+        ON transacciones FOR EACH STATEMENT EXECUTE FUNCTION kairo_notificar();
+"""
+import re
+import select
+import threading
+import time
+from collections import OrderedDict
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
+
+from paginacion import tamano_fila
+
+# Tokens SQL: comentarios, literales de texto (también $$...$$ y $etiqueta$...$etiqueta$),
+# identificadores entre comillas, números, palabras y símbolos
+_TOKEN = re.compile(
+    r"(?P<comentario>--[^\n]*|/\*.*?\*/)"
+    r"|(?P<texto>'(?:[^']|'')*')"
+    r"|(?P<dolar>\$(?P<etiqueta>(?:[A-Za-z_][A-Za-z0-9_]*)?)\$.*?\$(?P=etiqueta)\$)"
+    r"|(?P<ident>\"(?:[^\"]|\"\")*\")"
+    r"|(?P<numero>\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)"
+    r"|(?P<palabra>[A-Za-z_][A-Za-z0-9_$]*)"
+    r"|(?P<espacio>\s+)"
+    r"|(?P<simbolo>::|<=|>=|<>|!=|\|\||.)",
+    re.S,
+)
+
+
+# Palabras que pueden seguir a una tabla y no son su alias
+_FIN_TABLA = {"where", "join", "inner", "left", "right", "full", "cross", "natural", "on", "using",
+              "group", "order", "limit", "offset", "having", "union", "except", "intersect", "window"}
+
+
+def _tokens(sql):
+    for m in _TOKEN.finditer(sql):
+        tipo = m.lastgroup
+        if tipo in ("comentario", "espacio"):
+            continue
+        valor = m.group()
+        if tipo == "dolar":
+            # Literal de texto como los de comillas: no se toca
+            tipo = "texto"
+        # PostgreSQL pasa a minúsculas las palabras sin comillas: da igual SELECT que select
+        if tipo == "palabra":
+            valor = valor.lower()
+        yield tipo, valor
+
+
+def _ordenar_listas_in(tokens):
+    # IN ('b', 'a') y IN ('a', 'b') son la misma consulta
+    salida, i = [], 0
+    while i < len(tokens):
+        salida.append(tokens[i])
+        if tokens[i] == ("palabra", "in") and i + 1 < len(tokens) and tokens[i + 1][1] == "(":
+            j, literales, ok = i + 2, [], True
+            while j < len(tokens) and tokens[j][1] != ")":
+                if tokens[j][0] in ("texto", "numero"):
+                    literales.append(tokens[j])
+                elif tokens[j][1] != ",":
+                    ok = False
+                    break
+                j += 1
+            if ok and literales and j < len(tokens):
+                salida.append(("simbolo", "("))
+                for k, lit in enumerate(sorted(set(literales))):
+                    if k:
+                        salida.append(("simbolo", ","))
+                    salida.append(lit)
+                salida.append(("simbolo", ")"))
+                i = j + 1
+                continue
+        i += 1
+    return salida
+
+
+def normalizar_sql(sql):
+    """Forma canónica del SQL: sin comentarios, espacios uniformes, minúsculas y listas IN ordenadas."""
+    tokens = [t for t in _tokens(sql)]
+    while tokens and tokens[-1][1] == ";":
+        tokens.pop()
+    tokens = _ordenar_listas_in(tokens)
+    # Espacio solo entre tokens que lo necesitan; los literales no se tocan
+    partes, anterior = [], None
+    for tipo, valor in tokens:
+        if anterior is not None and valor not in "(),." and anterior not in "(,.":
+            partes.append(" ")
+        partes.append(valor)
+        anterior = valor
+    return "".join(partes)
+
+
+def tablas_sql(sql):
+    """Tablas que lee la consulta (sin esquema). Sirve para invalidar por tabla."""
+    try:
+        sentencias = [a for a in sqlglot.parse(sql, read="postgres") if a is not None]
+    except SqlglotError:
+        return _tablas_por_tokens(sql)
+    tablas = set()
+    for arbol in sentencias:
+        # Los nombres de los CTE también salen como tablas, pero no lo son
+        ctes = {c.alias_or_name.lower() for c in arbol.find_all(exp.CTE)}
+        for tabla in arbol.find_all(exp.Table):
+            nombre = tabla.name.lower()
+            if nombre and (tabla.db or nombre not in ctes):
+                tablas.add(nombre)
+    return tablas
+
+
+def _tablas_por_tokens(sql):
+    # Si sqlglot no lo entiende: nombres tras FROM / JOIN y las listas "FROM a x, b y"
+    tokens = [t for t in _tokens(sql)]
+    tablas = set()
+    for i, (tipo, valor) in enumerate(tokens):
+        if not (tipo == "palabra" and valor in ("from", "join")):
+            continue
+        j = i + 1
+        while j < len(tokens):
+            nombre = None
+            # esquema.tabla -> tabla
+            while j < len(tokens) and tokens[j][0] in ("palabra", "ident"):
+                nombre = tokens[j][1].strip('"').lower()
+                if j + 1 < len(tokens) and tokens[j + 1][1] == ".":
+                    j += 2
+                else:
+                    j += 1
+                    break
+            if not nombre or nombre in ("select", "lateral"):
+                break
+            tablas.add(nombre)
+            # Alias opcional y, si sigue una coma, otra tabla de la lista
+            if j < len(tokens) and tokens[j] == ("palabra", "as"):
+                j += 1
+            if j < len(tokens) and tokens[j][0] in ("palabra", "ident") and tokens[j][1] not in _FIN_TABLA:
+                j += 1
+            if j < len(tokens) and tokens[j][1] == ",":
+                j += 1
+            else:
+                break
+    return tablas
+
+
+def tamano_resultado(resultado):
+    return sum(tamano_fila(row) for row in resultado.get("rows", [])) + 200
+
+
+class _Entrada:
+    __slots__ = ("valor", "tablas", "creada", "expira", "tamano")
+
+    def __init__(self, valor, tablas, ttl):
+        self.valor = valor
+        self.tablas = tablas
+        self.creada = time.time()
+        self.expira = self.creada + ttl if ttl else None
+        self.tamano = tamano_resultado(valor)
+
+
+class CacheResultados:
+    """
+    Resultados de execute_query por SQL normalizado, con TTL por entrada y
+    un presupuesto de memoria (`max_bytes`) que expulsa las menos usadas (LRU).
+    """
+
+    def __init__(self, max_bytes=50_000_000, ttl=300):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entradas = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self._aciertos = 0
+        self._fallos = 0
+        self._evictions = 0
+        self._invalidadas = 0
+
+    @staticmethod
+    def clave(sql, *extra):
+        return (normalizar_sql(sql),) + extra
+
+    def _quitar(self, clave):
+        entrada = self._entradas.pop(clave, None)
+        if entrada is not None:
+            self._bytes -= entrada.tamano
+        return entrada
+
+    def obtener(self, clave):
+        """Devuelve (resultado, edad_en_segundos) o (None, None)."""
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None and entrada.expira is not None and time.time() > entrada.expira:
+                self._quitar(clave)
+                entrada = None
+            if entrada is None:
+                self._fallos += 1
+                return None, None
+            self._entradas.move_to_end(clave)
+            self._aciertos += 1
+            return entrada.valor, time.time() - entrada.creada
+
+    def guardar(self, clave, valor, ttl=None):
+        entrada = _Entrada(valor, tablas_sql(clave[0]), self.ttl if ttl is None else ttl)
+        if self.max_bytes and entrada.tamano > self.max_bytes:
+            return
+        with self._lock:
+            self._quitar(clave)
+            self._entradas[clave] = entrada
+            self._bytes += entrada.tamano
+            while self.max_bytes and self._bytes > self.max_bytes:
+                vieja = next(iter(self._entradas))
+                self._quitar(vieja)
+                self._evictions += 1
+
+    def invalidar(self, tablas=None):
+        """Borra las entradas que leen de alguna de `tablas` (todas si no se indica). Devuelve cuántas."""
+        with self._lock:
+            if not tablas:
+                n = len(self._entradas)
+                self._entradas.clear()
+                self._bytes = 0
+            else:
+                tablas = {t.lower() for t in tablas}
+                claves = [k for k, e in self._entradas.items() if e.tablas & tablas]
+                for k in claves:
+                    self._quitar(k)
+                n = len(claves)
+            self._invalidadas += n
+            return n
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "entradas": len(self._entradas),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "aciertos": self._aciertos,
+                "fallos": self._fallos,
+                "evictions": self._evictions,
+                "invalidadas": self._invalidadas,
+            }
+
+
+class EscuchaInvalidaciones:
+    """
+    Hilo que hace LISTEN sobre un canal de PostgreSQL e invalida la caché con cada NOTIFY.
+    El payload es el nombre de la tabla modificada ("*" o vacío = todo).
+    """
+
+    def __init__(self, dsn, canal, cache, reintento=5.0):
+        self.dsn = dsn
+        self.canal = canal
+        self.cache = cache
+        self.reintento = reintento
+        self._hilo = None
+
+    def iniciar(self):
+        if self._hilo is None or not self._hilo.is_alive():
+            self._hilo = threading.Thread(target=self._bucle, name="kairo-listen", daemon=True)
+            self._hilo.start()
+
+    def _bucle(self):
+        import psycopg2
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    cur.execute(f'LISTEN "{self.canal}"')
+                # Al (re)conectar no sabemos qué nos perdimos: vaciamos
+                self.cache.invalidar()
+                while True:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        aviso = conn.notifies.pop(0)
+                        tabla = (aviso.payload or "").strip()
+                        self.cache.invalidar(None if tabla in ("", "*") else [tabla])
+            except Exception as e:
+                print(f"⚠️ LISTEN {self.canal}: {e}. Reintentando en {self.reintento}s")
+            finally:
+                if conn is not None:
+                    conn.close()
+            time.sleep(self.reintento)
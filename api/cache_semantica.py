@@ -0,0 +1,233 @@
+import hashlib
+import json
+import math
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+
+
+def normalizar_prompt(texto):
+    """Minúsculas, sin tildes, sin signos de puntuación y con espacios colapsados."""
+    texto = unicodedata.normalize("NFKD", texto or "")
+    texto = "".join(c for c in texto if not unicodedata.combining(c)).lower()
+    texto = re.sub(r"[^\w\s]", " ", texto)
+    return re.sub(r"\s+", " ", texto).strip()
+
+
+def huella_contexto(*partes):
+    """Hash del contexto que invalida la caché (esquema, modelo...)."""
+    return hashlib.sha256("\x1f".join(str(p) for p in partes).encode()).hexdigest()[:16]
+
+
+def _vector_ngramas(texto, n=3):
+    # N-gramas de caracteres por palabra, con bordes marcados
+    vector = Counter()
+    for palabra in texto.split():
+        palabra = f" {palabra} "
+        if len(palabra) <= n:
+            vector[palabra] += 1
+            continue
+        for i in range(len(palabra) - n + 1):
+            vector[palabra[i:i + n]] += 1
+    return vector
+
+
+def _norma(vector):
+    return math.sqrt(sum(v * v for v in vector.values()))
+
+
+def _coseno(a, norma_a, b, norma_b):
+    if not norma_a or not norma_b:
+        return 0.0
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(k, 0) for k, v in a.items()) / (norma_a * norma_b)
+
+
+# Palabras que no cambian el SQL. Las negaciones ("no", "sin", "excepto"...), las
+# conjunciones ("y", "o") y los números NO están aquí: cambian la pregunta
+_VACIAS = frozenset(
+    "el la los las lo un una unos unas de del al a en que cual cuales "
+    "dame dime muestrame ensename quiero saber ver me favor hola".split()
+)
+
+
+def _palabras_clave(texto):
+    # "ventas de 2023" y "ventas de 2024", o "compraron" y "no compraron", se parecen
+    # mucho pero NO son la misma pregunta: el orden también cuenta ("de mayor a menor")
+    return tuple(p for p in texto.split() if p not in _VACIAS)
+
+
+class _Entrada:
+    __slots__ = ("contexto", "prompt", "valor", "creada", "vector", "norma", "palabras")
+
+    def __init__(self, contexto, prompt, valor, creada):
+        self.contexto = contexto
+        self.prompt = prompt
+        self.valor = valor
+        self.creada = creada
+        self.vector = _vector_ngramas(prompt)
+        self.norma = _norma(self.vector)
+        self.palabras = _palabras_clave(prompt)
+
+
+class CacheIntencion:
+    """
+    Caché en dos niveles para el resultado de `analizar_intencion`.
+
+    1. Exacto: prompt normalizado + huella del contexto (esquema y modelo).
+    2. Similitud (solo si `umbral` < 1): coseno entre vectores de n-gramas de caracteres,
+       y únicamente entre preguntas con las mismas palabras de contenido en el mismo orden
+       (incluidos números y negaciones). Solo absorbe diferencias de artículos y muletillas
+       ("dame las ventas por país" / "ventas por pais"): el coseno por sí solo da 0.95 entre
+       "clientes que compraron" y "clientes que no compraron". Por defecto desactivado.
+
+    Eviction LRU (`max_entradas`) y TTL (`ttl` segundos). Si se indica `ruta_disco`
+    las entradas se persisten en SQLite y sobreviven a reinicios.
+    """
+
+    def __init__(self, max_entradas=1000, ttl=86400, umbral=1, ruta_disco=None):
+        self.max_entradas = max(1, max_entradas)
+        self.ttl = ttl
+        self.umbral = umbral
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+
+        self._aciertos_exactos = 0
+        self._aciertos_similares = 0
+        self._fallos = 0
+        self._evictions = 0
+
+        self.ruta_disco = ruta_disco
+        if ruta_disco:
+            self._abrir_disco(ruta_disco)
+
+    # ----------------------
+    # Persistencia opcional
+    # ----------------------
+    def _abrir_disco(self, ruta):
+        try:
+            self._db = sqlite3.connect(ruta, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS intenciones ("
+                "clave TEXT PRIMARY KEY, contexto TEXT, prompt TEXT, valor TEXT, creada REAL)"
+            )
+            self._db.commit()
+            filas = self._db.execute(
+                "SELECT clave, contexto, prompt, valor, creada FROM intenciones ORDER BY creada"
+            ).fetchall()
+        except Exception as e:
+            print(f"⚠️ Caché de intención: disco no disponible ({e})")
+            self._db = None
+            return
+
+        ahora = time.time()
+        for clave, contexto, prompt, valor, creada in filas:
+            if self.ttl and ahora - creada > self.ttl:
+                continue
+            self._entradas[clave] = _Entrada(contexto, prompt, json.loads(valor), creada)
+        while len(self._entradas) > self.max_entradas:
+            self._entradas.popitem(last=False)
+
+    def tras_fork(self):
+        # Una conexión SQLite no se puede usar en el hijo de un fork: se abre otra
+        if self.ruta_disco:
+            self._db = None
+            self._abrir_disco(self.ruta_disco)
+
+    def _disco(self, sql, params):
+        if self._db is None:
+            return
+        try:
+            self._db.execute(sql, params)
+            self._db.commit()
+        except Exception as e:
+            print(f"⚠️ Caché de intención: error en disco ({e})")
+
+    # ----------------------
+    # API
+    # ----------------------
+    @staticmethod
+    def _clave(contexto, prompt):
+        return f"{contexto}:{prompt}"
+
+    def _caducada(self, entrada, ahora):
+        return bool(self.ttl) and ahora - entrada.creada > self.ttl
+
+    def _borrar(self, clave):
+        self._entradas.pop(clave, None)
+        self._disco("DELETE FROM intenciones WHERE clave = ?", (clave,))
+
+    def obtener(self, prompt, contexto):
+        """Devuelve (valor, nivel) con nivel "exacta" o "similar", o (None, None)."""
+        prompt = normalizar_prompt(prompt)
+        clave = self._clave(contexto, prompt)
+        ahora = time.time()
+
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None:
+                if self._caducada(entrada, ahora):
+                    self._borrar(clave)
+                else:
+                    self._entradas.move_to_end(clave)
+                    self._aciertos_exactos += 1
+                    return json.loads(json.dumps(entrada.valor)), "exacta"
+
+            if self.umbral and self.umbral < 1:
+                buscada = _Entrada(contexto, prompt, None, ahora)
+                mejor, mejor_sim = None, 0.0
+                for k, e in list(self._entradas.items()):
+                    if e.contexto != contexto or e.palabras != buscada.palabras:
+                        continue
+                    if self._caducada(e, ahora):
+                        self._borrar(k)
+                        continue
+                    sim = _coseno(buscada.vector, buscada.norma, e.vector, e.norma)
+                    if sim > mejor_sim:
+                        mejor, mejor_sim = k, sim
+                if mejor is not None and mejor_sim >= self.umbral:
+                    self._entradas.move_to_end(mejor)
+                    self._aciertos_similares += 1
+                    return json.loads(json.dumps(self._entradas[mejor].valor)), "similar"
+
+            self._fallos += 1
+            return None, None
+
+    def guardar(self, prompt, contexto, valor):
+        prompt = normalizar_prompt(prompt)
+        clave = self._clave(contexto, prompt)
+        ahora = time.time()
+        with self._lock:
+            self._entradas[clave] = _Entrada(contexto, prompt, valor, ahora)
+            self._entradas.move_to_end(clave)
+            self._disco(
+                "INSERT OR REPLACE INTO intenciones VALUES (?, ?, ?, ?, ?)",
+                (clave, contexto, prompt, json.dumps(valor), ahora),
+            )
+            while len(self._entradas) > self.max_entradas:
+                vieja, _ = self._entradas.popitem(last=False)
+                self._disco("DELETE FROM intenciones WHERE clave = ?", (vieja,))
+                self._evictions += 1
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+            self._disco("DELETE FROM intenciones", ())
+
+    def estadisticas(self):
+        with self._lock:
+            consultas = self._aciertos_exactos + self._aciertos_similares + self._fallos
+            return {
+                "entradas": len(self._entradas),
+                "aciertos_exactos": self._aciertos_exactos,
+                "aciertos_similares": self._aciertos_similares,
+                "fallos": self._fallos,
+                "evictions": self._evictions,
+                "ratio_aciertos": round((consultas - self._fallos) / consultas, 4) if consultas else 0.0,
+                "disco": self._db is not None,
+            }
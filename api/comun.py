@@ -0,0 +1,445 @@
+"""
+Configuración, prompts y funciones puras que comparten app.py (Flask) y app_async.py
+(Quart). Importarlo no abre conexiones ni arranca hilos: cada servidor crea sus propios
+componentes con las funciones crear_* y los arranca cuando le toca.
+"""
+import json
+import os
+import re
+import uuid
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+
+from cache_resultados import CacheResultados, EscuchaInvalidaciones
+from cache_semantica import CacheIntencion, huella_contexto
+from esquema import IndiceEsquema
+from formatos import a_json
+from graficos import preparar_grafico
+from log_shipper import EnviadorSyslog
+from metricas import anotar, etapa
+from paginacion import crear_token
+from respuestas import elegir_estrategia
+from resumen_datos import estimar_tokens, resumir_resultado
+from rollups import RefrescoRollups, RutaRollups
+from sesiones import AlmacenSesiones
+from validacion_sql import SQLRechazado, validar_sql
+from vuelo_unico import VueloUnico
+
+# Intentamos cargar .env (busca en la carpeta actual o superior)
+load_dotenv()
+
+# ======================
+# CONFIGURACIÓN
+# ======================
+DB_URI = os.environ.get("DATABASE_URL")
+GROQ_API_KEY = os.environ.get("GROQ_API_KEY")
+QRADAR_HOST = os.environ.get("QRADAR_HOST", "127.0.0.1")
+QRADAR_PORT = int(os.environ.get("QRADAR_PORT", 1514))
+QRADAR_PROTOCOLO = os.environ.get("QRADAR_PROTOCOLO", "tcp")            # tcp | udp
+QRADAR_COLA_MAX = int(os.environ.get("QRADAR_COLA_MAX", 10000))          # mensajes en memoria
+QRADAR_LOTE = int(os.environ.get("QRADAR_LOTE", 100))                    # mensajes por escritura
+QRADAR_COLA_LLENA = os.environ.get("QRADAR_COLA_LLENA", "descartar")     # descartar | disco
+QRADAR_RUTA_DISCO = os.environ.get("QRADAR_RUTA_DISCO")                  # fichero para "disco"
+
+# POOL DE CONEXIONES BBDD (reutilizamos conexiones en vez de abrir una por petición)
+DB_POOL_MIN = int(os.environ.get("DB_POOL_MIN", 1))
+DB_POOL_MAX = int(os.environ.get("DB_POOL_MAX", 10))
+DB_POOL_MAX_USOS = int(os.environ.get("DB_POOL_MAX_USOS", 1000))      # reciclar tras N usos
+DB_POOL_MAX_EDAD = float(os.environ.get("DB_POOL_MAX_EDAD", 1800))    # reciclar tras T segundos
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 10))        # espera máxima por conexión libre
+DB_POOL_PING = os.environ.get("DB_POOL_PING", "1") == "1"             # health check al sacar conexión
+
+# CACHÉ NL->SQL (evita llamar a Groq con preguntas repetidas o casi iguales)
+CACHE_INTENCION_MAX = int(os.environ.get("CACHE_INTENCION_MAX", 1000))
+CACHE_INTENCION_TTL = float(os.environ.get("CACHE_INTENCION_TTL", 86400))
+CACHE_INTENCION_UMBRAL = float(os.environ.get("CACHE_INTENCION_UMBRAL", 1))  # 1 = solo coincidencia exacta; <1 = mismas palabras
+CACHE_INTENCION_RUTA = os.environ.get("CACHE_INTENCION_RUTA")                   # p.ej. /data/intenciones.db
+
+# LÍMITES DE RESULTADO (un SELECT * sin filtro no puede cargar la tabla entera en memoria)
+RESULTADO_MAX_FILAS = int(os.environ.get("RESULTADO_MAX_FILAS", 1000))        # filas por página
+RESULTADO_MAX_BYTES = int(os.environ.get("RESULTADO_MAX_BYTES", 2_000_000))   # tamaño aprox. por página
+DB_TAMANO_LOTE = int(os.environ.get("DB_TAMANO_LOTE", 500))                   # filas por fetch del cursor
+PAGINACION_TTL = float(os.environ.get("PAGINACION_TTL", 3600))                # validez del token de página
+# Secreto para firmar los tokens de página. Si no se define, se genera uno por proceso
+# (los tokens no valdrán entre workers ni tras reiniciar).
+PAGINACION_SECRETO = (os.environ.get("PAGINACION_SECRETO") or uuid.uuid4().hex).encode()
+
+# CACHÉ DE RESULTADOS (mismo SQL normalizado = mismo resultado mientras no cambien las tablas)
+CACHE_RESULTADOS_TTL = float(os.environ.get("CACHE_RESULTADOS_TTL", 300))               # 0 = sin caducidad
+CACHE_RESULTADOS_MAX_BYTES = int(os.environ.get("CACHE_RESULTADOS_MAX_BYTES", 50_000_000))  # 0 = desactivada
+CACHE_RESULTADOS_CANAL = os.environ.get("CACHE_RESULTADOS_CANAL")  # canal LISTEN/NOTIFY, p.ej. kairo_invalidar
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")                        # sin token, los endpoints /admin están cerrados
+
+# ESTRATEGIA DE RESPUESTA TEXTUAL: auto | llm | plantilla | ninguna (ver respuestas.py)
+ESTRATEGIA_RESPUESTA = os.environ.get("ESTRATEGIA_RESPUESTA", "auto")
+PLANTILLA_MAX_FILAS = int(os.environ.get("PLANTILLA_MAX_FILAS", 10))  # hasta aquí se responde sin LLM
+RESPUESTA_MAX_TOKENS_DATOS = int(os.environ.get("RESPUESTA_MAX_TOKENS_DATOS", 800))  # datos en el prompt de respuesta
+
+# GRÁFICOS (type "chart": ejes elegidos y puntos reducidos en el servidor, ver graficos.py)
+GRAFICO_MAX_PUNTOS = int(os.environ.get("GRAFICO_MAX_PUNTOS", 500))          # puntos de "line" (LTTB)
+GRAFICO_MAX_CATEGORIAS = int(os.environ.get("GRAFICO_MAX_CATEGORIAS", 12))   # barras/porciones, incluida "Otros"
+GRAFICO_MAX_SERIES = int(os.environ.get("GRAFICO_MAX_SERIES", 8))            # líneas/colores, incluida "Otros"
+
+# ESQUEMA DINÁMICO (se introspecciona la BBDD y se mandan solo las tablas relevantes)
+ESQUEMA_DINAMICO = os.environ.get("ESQUEMA_DINAMICO", "1") == "1"
+ESQUEMA_NOMBRES = os.environ.get("ESQUEMA_NOMBRES", "public").split(",")   # esquemas de PostgreSQL a indexar
+ESQUEMA_TOP_K = int(os.environ.get("ESQUEMA_TOP_K", 4))                    # tablas por pregunta
+ESQUEMA_MAX_COLUMNAS = int(os.environ.get("ESQUEMA_MAX_COLUMNAS", 25))     # columnas por tabla
+ESQUEMA_REFRESCO = float(os.environ.get("ESQUEMA_REFRESCO", 300))          # segundos entre refrescos
+
+# VALIDACIÓN Y LÍMITE DE COSTE DEL SQL GENERADO
+SQL_VALIDAR = os.environ.get("SQL_VALIDAR", "1") == "1"                           # parser + listas permitidas
+SQL_MAX_COSTE = float(os.environ.get("SQL_MAX_COSTE", 5_000_000))                 # coste de EXPLAIN; 0 = sin límite
+SQL_MAX_FILAS_ESTIMADAS = int(os.environ.get("SQL_MAX_FILAS_ESTIMADAS", 0))       # filas en algún nodo; 0 = sin límite
+SQL_TIMEOUT_MS = int(os.environ.get("SQL_TIMEOUT_MS", 15000))                     # statement_timeout por consulta
+
+# ROLLUPS (agregados precalculados en vistas materializadas, ver rollups.py)
+ROLLUPS_ACTIVOS = os.environ.get("ROLLUPS", "1") == "1"                          # reescribir el SQL hacia los rollups
+ROLLUPS_MAX_ANTIGUEDAD = float(os.environ.get("ROLLUPS_MAX_ANTIGUEDAD", 3600))   # más antiguo = tabla original; 0 = sin límite
+ROLLUPS_INTERVALO_ESTADO = float(os.environ.get("ROLLUPS_INTERVALO_ESTADO", 30)) # cada cuánto se relee su fecha de refresco
+ROLLUPS_DSN = os.environ.get("ROLLUPS_DSN")                                      # usuario con permiso de REFRESH
+ROLLUPS_REFRESCO = float(os.environ.get("ROLLUPS_REFRESCO", 0))                  # segundos entre refrescos; 0 = cron externo
+
+# PETICIONES IDÉNTICAS EN CURSO (la misma pregunta o el mismo SQL se calcula una sola vez)
+VUELO_UNICO = os.environ.get("VUELO_UNICO", "1") == "1"
+VUELO_UNICO_ESPERA = float(os.environ.get("VUELO_UNICO_ESPERA", 30))   # espera máxima al que calcula
+VUELO_UNICO_RUTA = os.environ.get("VUELO_UNICO_RUTA")                  # SQLite local para compartir entre workers
+
+# LOTES DE PREGUNTAS (/consulta/lote)
+LOTE_MAX_PREGUNTAS = int(os.environ.get("LOTE_MAX_PREGUNTAS", 50))
+LOTE_CONCURRENCIA = int(os.environ.get("LOTE_CONCURRENCIA", 4))   # llamadas a Groq a la vez por lote
+
+# SESIONES DE CONVERSACIÓN (preguntas de seguimiento, ver sesiones.py)
+SESIONES_MAX = int(os.environ.get("SESIONES_MAX", 1000))                # sesiones en memoria por proceso; 0 = sin sesiones
+SESIONES_TTL = float(os.environ.get("SESIONES_TTL", 1800))             # segundos sin uso hasta caducar
+SESIONES_MAX_TURNOS = int(os.environ.get("SESIONES_MAX_TURNOS", 6))    # turnos anteriores que van en el prompt
+SESIONES_MAX_FILAS = int(os.environ.get("SESIONES_MAX_FILAS", 2000))   # resultado guardado para derivar el siguiente
+
+# LLAMADAS A GROQ (cola con prioridad, cupo según cabeceras x-ratelimit-*, reintentos y respaldo)
+LLM_MODELO_RESPALDO = os.environ.get("LLM_MODELO_RESPALDO", "llama-3.1-8b-instant")  # vacío = sin respaldo
+LLM_CONCURRENCIA = int(os.environ.get("LLM_CONCURRENCIA", 8))            # llamadas a la vez por proceso
+LLM_REINTENTOS = int(os.environ.get("LLM_REINTENTOS", 3))
+LLM_PLAZO = float(os.environ.get("LLM_PLAZO", 30))                       # segundos para las llamadas de una petición
+LLM_UMBRAL_RESPALDO = float(os.environ.get("LLM_UMBRAL_RESPALDO", 2))    # espera a partir de la que se usa el respaldo
+LLM_KEEPALIVE = float(os.environ.get("LLM_KEEPALIVE", 60))               # segundos que se reutiliza una conexión ociosa
+
+# ARRANQUE EN FRÍO (groq y psycopg2 se cargan con el primer uso; ver calentar)
+CALENTAR = os.environ.get("CALENTAR", "0") == "1"    # al arrancar: pool, conexión con Groq y módulos diferidos
+
+# SONDAS /health y /ready (orquestador / balanceador)
+READY_TIMEOUT = float(os.environ.get("READY_TIMEOUT", 2))        # segundos por comprobación (BBDD y Groq)
+READY_CACHE = float(os.environ.get("READY_CACHE", 5))            # reutilizar el último resultado durante T segundos
+READY_COMPROBAR_LLM = os.environ.get("READY_COMPROBAR_LLM", "1") == "1"
+
+# MODELO GROQ (el cliente lo crea cada servidor: síncrono en app.py, asíncrono en app_async.py)
+modelo_groq = "llama-3.3-70b-versatile"
+
+# ESQUEMA DB
+DB_SCHEMA = """
+Tabla 1: clientes (columnas: id_cliente,nombre,apellidos,email,pais,ciudad,edad,genero)
+Tabla 2: transacciones (columnas: id_transaccion,id_cliente,fecha_compra,producto,categoria_producto,precio_unitario,cantidad,importe_total,metodo_pago,coste_envio,coste_fabricacion)
+Relación: clientes.id_cliente = transacciones.id_cliente
+"""
+
+def _esquema_estatico():
+    # {tabla: {columnas}} a partir del texto de DB_SCHEMA
+    return {
+        tabla.lower(): {c.strip().lower() for c in columnas.split(",")}
+        for tabla, columnas in re.findall(r"(\w+) \(columnas: ([^)]*)\)", DB_SCHEMA)
+    }
+
+ESQUEMA_ESTATICO = _esquema_estatico()
+
+# ======================
+# COMPONENTES (cada servidor crea los suyos)
+# ======================
+def crear_cache_intencion():
+    # La huella de contexto cambia si cambia el esquema o el modelo
+    return CacheIntencion(
+        max_entradas=CACHE_INTENCION_MAX,
+        ttl=CACHE_INTENCION_TTL,
+        umbral=CACHE_INTENCION_UMBRAL,
+        ruta_disco=CACHE_INTENCION_RUTA,
+    )
+
+def crear_cache_resultados():
+    return CacheResultados(max_bytes=CACHE_RESULTADOS_MAX_BYTES, ttl=CACHE_RESULTADOS_TTL)
+
+def crear_escucha_invalidaciones(cache):
+    # Invalidación por NOTIFY (opcional); sin arrancar
+    if CACHE_RESULTADOS_CANAL and DB_URI:
+        return EscuchaInvalidaciones(DB_URI, CACHE_RESULTADOS_CANAL, cache)
+    return None
+
+def crear_indice_esquema(pool):
+    # Mientras no se haya cargado, o si está desactivado, se usa DB_SCHEMA
+    return IndiceEsquema(
+        pool,
+        esquemas=[e.strip() for e in ESQUEMA_NOMBRES if e.strip()],
+        top_k=ESQUEMA_TOP_K,
+        max_columnas=ESQUEMA_MAX_COLUMNAS,
+        intervalo=ESQUEMA_REFRESCO,
+    )
+
+def crear_rutas_rollup(pool, cache=None):
+    # Los resultados cacheados que salieron de un rollup quedan viejos cuando este se refresca
+    def al_refrescar(nombres):
+        cache.invalidar({"transacciones"})
+    return RutaRollups(
+        pool, max_antiguedad=ROLLUPS_MAX_ANTIGUEDAD, intervalo=ROLLUPS_INTERVALO_ESTADO,
+        al_refrescar=al_refrescar if cache is not None else None,
+    )
+
+def crear_refresco_rollups():
+    # Refresco periódico de los rollups (opcional); sin arrancar
+    if ROLLUPS_DSN and ROLLUPS_REFRESCO > 0:
+        return RefrescoRollups(ROLLUPS_DSN, ROLLUPS_REFRESCO)
+    return None
+
+def crear_vuelos():
+    return VueloUnico(espera_max=VUELO_UNICO_ESPERA, ruta_compartida=VUELO_UNICO_RUTA)
+
+def crear_sesiones():
+    return AlmacenSesiones(
+        max_sesiones=SESIONES_MAX,
+        max_turnos=SESIONES_MAX_TURNOS,
+        ttl=SESIONES_TTL,
+        max_filas_resultado=SESIONES_MAX_FILAS,
+    )
+
+def crear_enviador_logs():
+    # Los logs salen desde un hilo en segundo plano: la petición nunca espera a QRadar
+    return EnviadorSyslog(
+        QRADAR_HOST, QRADAR_PORT,
+        protocolo=QRADAR_PROTOCOLO,
+        max_cola=QRADAR_COLA_MAX,
+        tamano_lote=QRADAR_LOTE,
+        cola_llena=QRADAR_COLA_LLENA,
+        ruta_disco=QRADAR_RUTA_DISCO,
+    )
+
+# ======================
+# FUNCIÓN LOGS (Silenciosa en Local)
+# ======================
+def formatear_syslog(level, message, extra=None):
+    # <--- CAMBIO 2: Arreglado el warning de datetime
+    timestamp = datetime.now(timezone.utc).isoformat()
+    
+    hostname = "bi-api"
+    appname = "flask-groq"
+    payload = {
+        "level": level,
+        "message": message,
+        "extra": extra or {},
+        "timestamp": timestamp
+    }
+    return f"<134>{timestamp} {hostname} {appname}: {json.dumps(payload)}\n"
+
+# ======================
+# LÓGICA (sin estado propio: los componentes se pasan como argumento)
+# ======================
+def texto_esquema(indice, natural_query):
+    # Solo las tablas relevantes para la pregunta; DB_SCHEMA como respaldo
+    if ESQUEMA_DINAMICO and DB_URI:
+        with etapa("esquema"):
+            texto = indice.texto_prompt(natural_query)
+        if texto:
+            return texto
+    return DB_SCHEMA
+
+def esquema_sesion(indice, natural_query, esquema=None, tablas=None):
+    """
+    (esquema del prompt de una sesión, oids de sus tablas) tras esta pregunta. El texto de
+    los turnos anteriores se conserva y al final se añaden las tablas nuevas que pida la
+    pregunta: una de seguimiento puede necesitar otra tabla y el prefijo no cambia. Con
+    DB_SCHEMA (tablas=None) ya están todas.
+    """
+    if esquema is not None and tablas is None:
+        return esquema, None
+    ampliacion = None
+    if ESQUEMA_DINAMICO and DB_URI:
+        with etapa("esquema"):
+            ampliacion = indice.ampliar_prompt(natural_query, tablas or frozenset())
+    if not ampliacion:
+        return (esquema, tablas) if esquema is not None else (DB_SCHEMA, None)
+    lineas, tablas = ampliacion
+    if esquema is None:
+        return "\n" + lineas, tablas
+    return (esquema + lineas if lineas.strip() else esquema), tablas
+
+def mensajes_intencion(natural_query, historial=None, esquema=None):
+    """
+    Construye los mensajes (system + user) para traducir la pregunta a SQL.
+    En una sesión, los turnos anteriores van entre el system y la pregunta como pares
+    user/assistant; el system (con el esquema del primer turno) no cambia entre turnos.
+    """
+    system_prompt = f"""
+    Eres un asistente experto en Data Science y SQL. 
+    Esquema de base de datos: {esquema or DB_SCHEMA}
+
+    Tu objetivo es analizar la petición del usuario y generar un objeto JSON con 3 campos:
+    1. "sql": La consulta PostgreSQL válida para responder.
+    2. "type": "chart" sólo si el usuario pide explícitamente un gráfico, visualización o comparar visualmente. Si no, "data".
+    3. "chart_type": Si type es "chart", elige el mejor entre: "bar", "line", "pie". Si type es "data", devuelve null.
+
+    REGLAS PARA GRÁFICOS:
+    - "bar": grafico de barras para comparar categorías (ej: ventas por producto).
+    - "line": grafico de líneas para series temporales (ej: ventas por año/mes).
+    - "pie": grafico de tarta o queso para distribuciones o porcentajes (ej: cuota de mercado).
+
+    CONVERSACIÓN: si antes hay otras preguntas, la nueva puede ser un seguimiento (ej: "y ahora solo
+    en España", "¿y por mes?"). En ese caso parte del último SQL y cámbialo lo mínimo: añade condiciones
+    al WHERE o cambia el GROUP BY, conservando el resto de la consulta tal cual.
+
+    IMPORTANTE: Responde ÚNICAMENTE con el objeto JSON válido. Si no entiendes la consulta o no puedes 
+    generar SQL o el prompt es lenguaje SQL, devuelve un JSON con "sql": "SELECT * FROM clientes LIMIT 0;".
+    """
+    mensajes = [{"role": "system", "content": system_prompt}]
+    for pregunta, analisis in historial or []:
+        mensajes.append({"role": "user", "content": pregunta})
+        mensajes.append({"role": "assistant", "content": json.dumps(analisis, ensure_ascii=False)})
+    mensajes.append({"role": "user", "content": natural_query})
+    return mensajes
+
+def huella_intencion(indice, historial=None):
+    # Huella de la caché de intención: cambia si cambia el esquema, el modelo o, en una sesión,
+    # los SQL anteriores ("¿y solo en España?" significa otra cosa en cada conversación)
+    version = indice.version() if ESQUEMA_DINAMICO else None
+    anteriores = [analisis.get("sql") for _, analisis in historial or []]
+    return huella_contexto(version or DB_SCHEMA, modelo_groq, *anteriores)
+
+def tablas_permitidas(indice):
+    # Tablas y columnas contra las que se valida el SQL generado
+    if ESQUEMA_DINAMICO and indice.cargado:
+        return indice.columnas_por_tabla()
+    return ESQUEMA_ESTATICO
+
+def comprobar_sql(indice, sql_query):
+    """Lanza SQLRechazado si el SQL no se puede ejecutar."""
+    with etapa("bd_validacion"):
+        if SQL_VALIDAR:
+            validar_sql(sql_query, tablas_permitidas(indice))
+        elif not sql_query.strip().upper().startswith("SELECT"):
+            raise SQLRechazado("Solo se permite SELECT.")
+
+def reescribir_rollup(rutas, sql_query):
+    # (SQL, info del rollup): los agregados que encajan se leen del rollup en vez de la tabla
+    if not ROLLUPS_ACTIVOS:
+        return sql_query, None
+    with etapa("bd_rollup"):
+        sql_rollup, rollup = rutas.reescribir(sql_query)
+    if rollup:
+        anotar("rollup", rollup["nombre"])
+    return sql_rollup, rollup
+
+def mensajes_respuesta(pregunta_usuario, resultados_db):
+    """
+    Construye los mensajes (system + user) para resumir los datos.
+    `resultados_db` es el texto de resumen_para_llm (ya ajustado al presupuesto de tokens).
+    """
+    system_prompt = f"""
+    Eres un asistente de análisis de datos amable y profesional.
+    
+    Tus instrucciones:
+    1. Recibirás una PREGUNTA del usuario y unos DATOS (resultado de una base de datos).
+    2. Debes responder a la pregunta basándote EXCLUSIVAMENTE en los datos proporcionados.
+    3. Si los datos están vacíos, di amablemente que no encontraste información.
+    4. No menciones "SQL" ni "Query" a menos que sea necesario. Habla en lenguaje natural.
+    5. Si hay muchos datos, resume los hallazgos principales. Si solo recibes estadísticas y una
+    muestra de filas, usa las estadísticas para totales, medias y extremos.
+    6. Si te piden una visualización o gráfico, ignora esa parte y céntrate en dar una respuesta textual clara. 
+    No menciones la petición ni nada relaccionado con graficos.
+    """
+    
+    user_message = f"""
+    PREGUNTA: {pregunta_usuario}
+    DATOS OBTENIDOS:
+{resultados_db}
+    """
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_message}
+    ]
+
+def resumen_para_llm(resultado):
+    # Datos para el prompt de respuesta: CSV completo si cabe; si no, estadísticas y muestra
+    with etapa("resumen_datos"):
+        texto = resumir_resultado(resultado, RESPUESTA_MAX_TOKENS_DATOS)
+    anotar("respuesta_tokens_datos", estimar_tokens(texto))
+    return texto
+
+def info_paginacion(sql_query, resultado):
+    # Bloque común de las respuestas: si falta algo, el token permite pedir la página siguiente
+    next_token = None
+    if resultado["truncated"]:
+        next_token = crear_token(PAGINACION_SECRETO, sql_query, resultado["next_offset"])
+    return {"truncated": resultado["truncated"], "next_token": next_token}
+
+def estrategia_pedida(data):
+    # "solo_datos": true equivale a no querer respuesta textual (datos o gráfico)
+    pedida = data.get("respuesta") or ("ninguna" if data.get("solo_datos") else None)
+    return elegir_estrategia(pedida, ESTRATEGIA_RESPUESTA)
+
+def bloque_grafico(analisis, resultado):
+    # Datos listos para pintar si la pregunta pide un gráfico; None si no lo pide o no se puede
+    if analisis.get("type") != "chart":
+        return None
+    # Un fallo aquí solo quita el gráfico: los datos y la respuesta salen igual
+    try:
+        with etapa("grafico"):
+            return preparar_grafico(
+                resultado, analisis.get("chart_type"),
+                max_puntos=GRAFICO_MAX_PUNTOS, max_categorias=GRAFICO_MAX_CATEGORIAS, max_series=GRAFICO_MAX_SERIES,
+            )
+    except Exception as e:
+        print(f"⚠️ No se pudo preparar el gráfico: {type(e).__name__}: {e}")
+        anotar("grafico_error", type(e).__name__)
+        return None
+
+def datos_a_enviar(resultado, grafico, data):
+    # Con {"solo_grafico": true} y gráfico disponible, las filas originales no viajan
+    if grafico is not None and (data or {}).get("solo_grafico"):
+        return {**resultado, "rows": []}
+    return resultado
+
+def preparar_lote(sqls, cache, validar):
+    """
+    Primera fase de execute_queries: valida (`validar` devuelve None o {"error"}), quita las
+    repetidas por SQL normalizado y mira la caché.
+    Devuelve (claves {sql: clave}, resueltas {clave: resultado}, pendientes {clave: sql}).
+    """
+    claves = {sql: cache.clave(sql, 0, RESULTADO_MAX_FILAS, RESULTADO_MAX_BYTES) for sql in sqls}
+    resueltas, pendientes = {}, {}
+    for sql, clave in claves.items():
+        if clave in resueltas or clave in pendientes:
+            continue
+        rechazo = validar(sql)
+        if rechazo:
+            resueltas[clave] = rechazo
+            continue
+        if CACHE_RESULTADOS_MAX_BYTES > 0:
+            cacheado, edad = cache.obtener(clave)
+            if cacheado is not None:
+                resueltas[clave] = {**cacheado, "cache": {"hit": True, "edad_s": round(edad, 3)}}
+                continue
+        pendientes[clave] = sql
+    anotar("lote_sql_distintos", len(resueltas) + len(pendientes))
+    return claves, resueltas, pendientes
+
+def leer_lote(data):
+    # Devuelve (preguntas, None) o (None, mensaje de error)
+    preguntas = data.get("prompts")
+    if not isinstance(preguntas, list) or not preguntas:
+        return None, "Falta la lista de preguntas (prompts)"
+    if len(preguntas) > LOTE_MAX_PREGUNTAS:
+        return None, f"Como máximo {LOTE_MAX_PREGUNTAS} preguntas por lote"
+    return preguntas, None
+
+def cuerpo_lote(items, timings=None):
+    # JSON de /consulta/lote: recuento de aciertos/fallos y un elemento por pregunta
+    ok = sum(1 for item in items if item["ok"])
+    metadata = {"total": len(items), "ok": ok, "fallidas": len(items) - ok}
+    if timings is not None:
+        metadata["timings"] = timings
+    return a_json({"metadata": metadata, "resultados": items})
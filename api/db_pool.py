@@ -0,0 +1,225 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class PoolAgotado(Exception):
+    """No se ha podido obtener una conexión libre dentro del timeout."""
+
+
+class _Conexion:
+    # Envoltorio con los datos que necesitamos para reciclar la conexión
+    __slots__ = ("conn", "creada", "usos")
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.creada = time.monotonic()
+        self.usos = 0
+
+
+class PoolConexiones:
+    """
+    Pool de conexiones PostgreSQL reutilizables y seguro entre hilos.
+
+    - Entre `minimo` y `maximo` conexiones abiertas.
+    - Comprobación de salud al sacar una conexión del pool (opcional con `ping`).
+    - Reciclado tras `max_usos` usos o `max_edad` segundos de vida.
+    - La sesión de solo lectura se configura una única vez al crear la conexión.
+    """
+
+    def __init__(self, dsn, minimo=1, maximo=10, max_usos=1000, max_edad=1800,
+                 timeout=10.0, ping=True, readonly=True):
+        self.dsn = dsn
+        self.minimo = max(0, minimo)
+        self.maximo = max(1, maximo, self.minimo)
+        self.max_usos = max_usos
+        self.max_edad = max_edad
+        self.timeout = timeout
+        self.ping = ping
+        self.readonly = readonly
+
+        self._libres = deque()
+        self._total = 0
+        self._abierto = False
+        self._cond = threading.Condition()
+        self._heredadas = []   # conexiones del proceso padre tras un fork (ver tras_fork)
+
+        # Métricas
+        self._en_uso = 0
+        self._checkouts = 0
+        self._espera_total = 0.0
+        self._espera_max = 0.0
+        self._timeouts = 0
+        self._creadas = 0
+        self._recicladas = 0
+        self._descartadas = 0
+
+    # ----------------------
+    # Ciclo de vida de conexiones
+    # ----------------------
+    def _crear(self):
+        # psycopg2 (y libpq) se cargan con la primera conexión, no al importar el módulo
+        import psycopg2
+        conn = psycopg2.connect(self.dsn)
+        # Solo una vez por conexión, no en cada petición
+        conn.set_session(readonly=self.readonly)
+        self._creadas += 1
+        return _Conexion(conn)
+
+    def _cerrar(self, entrada):
+        try:
+            entrada.conn.close()
+        except Exception:
+            pass
+
+    def _caducada(self, entrada):
+        if self.max_usos and entrada.usos >= self.max_usos:
+            return True
+        if self.max_edad and time.monotonic() - entrada.creada >= self.max_edad:
+            return True
+        return False
+
+    def _sana(self, entrada):
+        if entrada.conn.closed:
+            return False
+        if not self.ping:
+            return True
+        try:
+            with entrada.conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            entrada.conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def abrir(self):
+        """Precalienta el pool hasta `minimo` conexiones. Los fallos no son fatales."""
+        with self._cond:
+            self._abierto = True
+            while self._total < self.minimo:
+                try:
+                    self._libres.append(self._crear())
+                    self._total += 1
+                except Exception as e:
+                    print(f"⚠️ Pool BBDD: no se pudo precalentar ({e})")
+                    break
+
+    def cerrar(self):
+        with self._cond:
+            while self._libres:
+                self._cerrar(self._libres.popleft())
+                self._total -= 1
+            self._abierto = False
+
+    def tras_fork(self):
+        """
+        Deja el pool vacío en un proceso hijo (gunicorn con preload_app).
+        Las conexiones heredadas comparten socket con el padre: no se cierran (el mensaje
+        de cierre le cortaría la suya), solo se apartan para que nadie las use.
+        """
+        self._heredadas.extend(entrada.conn for entrada in self._libres)
+        self._libres = deque()
+        self._total = 0
+        self._en_uso = 0
+        self._abierto = False
+        # El lock pudo copiarse tomado por otro hilo del padre
+        self._cond = threading.Condition()
+
+    # ----------------------
+    # Checkout / devolución
+    # ----------------------
+    def _obtener(self):
+        inicio = time.monotonic()
+        limite = inicio + self.timeout
+        with self._cond:
+            if not self._abierto:
+                # Primer uso: precalentamos (el lock es reentrante)
+                self.abrir()
+
+            while True:
+                if self._libres:
+                    entrada = self._libres.pop()
+                    break
+                if self._total < self.maximo:
+                    # Reservamos el hueco y conectamos fuera del lock
+                    self._total += 1
+                    entrada = None
+                    break
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    self._timeouts += 1
+                    raise PoolAgotado(f"Sin conexiones libres tras {self.timeout}s")
+                self._cond.wait(restante)
+
+        try:
+            if entrada is not None and (self._caducada(entrada) or not self._sana(entrada)):
+                if self._caducada(entrada):
+                    self._recicladas += 1
+                else:
+                    self._descartadas += 1
+                self._cerrar(entrada)
+                entrada = None
+            if entrada is None:
+                entrada = self._crear()
+        except Exception:
+            with self._cond:
+                self._total -= 1
+                self._cond.notify()
+            raise
+
+        espera = time.monotonic() - inicio
+        with self._cond:
+            self._en_uso += 1
+            self._checkouts += 1
+            self._espera_total += espera
+            self._espera_max = max(self._espera_max, espera)
+        entrada.usos += 1
+        return entrada
+
+    def _devolver(self, entrada, roto=False):
+        if not roto and not entrada.conn.closed:
+            try:
+                # Cerramos la transacción abierta para dejar la conexión limpia
+                entrada.conn.rollback()
+            except Exception:
+                roto = True
+        with self._cond:
+            self._en_uso -= 1
+            if roto or entrada.conn.closed:
+                self._descartadas += 1
+                self._total -= 1
+                self._cerrar(entrada)
+            else:
+                self._libres.append(entrada)
+            self._cond.notify()
+
+    @contextmanager
+    def conexion(self):
+        entrada = self._obtener()
+        roto = False
+        try:
+            yield entrada.conn
+        except Exception as e:
+            import psycopg2
+            roto = isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+            raise
+        finally:
+            self._devolver(entrada, roto)
+
+    def estadisticas(self):
+        with self._cond:
+            return {
+                "min": self.minimo,
+                "max": self.maximo,
+                "total": self._total,
+                "libres": len(self._libres),
+                "en_uso": self._en_uso,
+                "checkouts": self._checkouts,
+                "espera_media_ms": round(1000 * self._espera_total / self._checkouts, 3) if self._checkouts else 0.0,
+                "espera_max_ms": round(1000 * self._espera_max, 3),
+                "timeouts": self._timeouts,
+                "creadas": self._creadas,
+                "recicladas": self._recicladas,
+                "descartadas": self._descartadas,
+            }
@@ -0,0 +1,468 @@
+"""
+Respuestas de seguimiento calculadas a partir del resultado del turno anterior.
+
+Si la pregunta de seguimiento ("¿y solo en España?", "¿y en total por categoría?")
+produce un SQL que es el anterior con más condiciones en el WHERE y/o agrupado por
+un subconjunto de sus columnas, el resultado se obtiene filtrando o reagregando en
+memoria las filas ya calculadas, sin ir a la BBDD.
+
+Solo se deriva cuando el resultado es exacto; en cualquier otro caso derivar devuelve
+None y se consulta la BBDD como siempre:
+- El resultado anterior está completo y su SQL no tenía LIMIT/OFFSET ni DISTINCT.
+- Mismo FROM/JOIN, y el WHERE anterior está entero en el nuevo.
+- Las condiciones nuevas solo usan columnas de salida del resultado anterior que eran
+  de agrupación (o cualquiera si la consulta anterior no agregaba), con comparaciones,
+  IN, BETWEEN, LIKE, IS NULL, AND/OR/NOT. Los <, > sobre texto no se derivan porque
+  dependen de la collation de la BBDD.
+- La reagregación solo usa SUM, COUNT, MIN y MAX de agregados que ya estaban.
+"""
+import re
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
+
+_AGREGADOS = (exp.Sum, exp.Count, exp.Min, exp.Max)
+_COMPARACIONES = {
+    exp.EQ: lambda a, b: a == b,
+    exp.NEQ: lambda a, b: a != b,
+    exp.GT: lambda a, b: a > b,
+    exp.GTE: lambda a, b: a >= b,
+    exp.LT: lambda a, b: a < b,
+    exp.LTE: lambda a, b: a <= b,
+}
+
+
+class _NoDerivable(Exception):
+    pass
+
+
+def _sql(e):
+    return e.sql(dialect="postgres") if e is not None else None
+
+
+def _consulta(sql_texto):
+    arbol = sqlglot.parse_one(sql_texto, read="postgres")
+    if not isinstance(arbol, exp.Select):
+        raise _NoDerivable("no es un SELECT simple")
+    for clave in ("with", "distinct", "offset", "qualify", "windows"):
+        if arbol.args.get(clave):
+            raise _NoDerivable(clave)
+    # Subconsultas, ventanas o SELECT * no se derivan
+    if any(arbol.find_all(exp.Window)) or any(s is not arbol for s in arbol.find_all(exp.Select)):
+        raise _NoDerivable("consulta compuesta")
+    if any(e.is_star for e in arbol.expressions):
+        raise _NoDerivable("SELECT *")
+    return arbol
+
+
+def _fuente(arbol):
+    return _sql(arbol.find(exp.From)), tuple(_sql(j) for j in arbol.args.get("joins") or [])
+
+
+def _condicion(arbol):
+    where = arbol.args.get("where")
+    return where.this if where is not None else None
+
+
+def _conjunciones(condicion):
+    if condicion is None:
+        return []
+    if isinstance(condicion, exp.Paren):
+        return _conjunciones(condicion.this)
+    if isinstance(condicion, exp.And):
+        return _conjunciones(condicion.this) + _conjunciones(condicion.expression)
+    return [condicion]
+
+
+def _entero(e):
+    if e is None:
+        return None
+    valor = e.args.get("expression") if isinstance(e, (exp.Limit, exp.Offset)) else e
+    if not isinstance(valor, exp.Literal) or valor.is_string:
+        raise _NoDerivable("LIMIT no literal")
+    return int(valor.this)
+
+
+def _es_agregado(e):
+    return any(e.find_all(exp.AggFunc))
+
+
+# ======================
+# SALIDA ANTERIOR
+# ======================
+class _Salida:
+    """Columnas del resultado anterior: nombre, expresión y si eran de agrupación."""
+
+    def __init__(self, arbol, columnas):
+        if len(arbol.expressions) != len(columnas):
+            raise _NoDerivable("columnas distintas")
+        self.columnas = list(columnas)
+        self.originales = [e.unalias() for e in arbol.expressions]
+        self.expresiones = [_sql(e) for e in self.originales]
+        self.agregado = [_es_agregado(e) for e in self.originales]
+        self.nombres_por_defecto = [None if isinstance(e, exp.Alias) else c for e, c in zip(arbol.expressions, columnas)]
+        self.agrupa = bool(arbol.args.get("group")) or any(self.agregado)
+
+        self.claves = set()
+        for g in (arbol.args.get("group").expressions if arbol.args.get("group") else []):
+            i = self.indice(g, alias=True, ordinales=True)
+            if i is None or self.agregado[i]:
+                raise _NoDerivable("clave de agrupación fuera de la salida")
+            self.claves.add(i)
+
+    def indice(self, e, alias=False, ordinales=False):
+        """
+        Columna de salida que corresponde a la expresión. Los alias y ordinales solo valen
+        donde PostgreSQL los admite (GROUP BY, ORDER BY), no en el WHERE.
+        """
+        if ordinales and isinstance(e, exp.Literal) and not e.is_string:
+            i = int(e.this) - 1
+            return i if 0 <= i < len(self.columnas) else None
+        texto = _sql(e)
+        if texto in self.expresiones:
+            return self.expresiones.index(texto)
+        if isinstance(e, exp.Column):
+            # pais y c.pais son la misma columna: si no lo fueran, PostgreSQL la rechazaría por ambigua
+            for i, original in enumerate(self.originales):
+                if (isinstance(original, exp.Column) and original.name == e.name
+                        and (not original.table or not e.table or original.table == e.table)):
+                    return i
+            if alias and not e.table and e.name in self.columnas:
+                return self.columnas.index(e.name)
+        return None
+
+
+# ======================
+# FILTROS
+# ======================
+def _literal(e):
+    if isinstance(e, exp.Literal):
+        if e.is_string:
+            return e.this
+        try:
+            return Decimal(e.this)
+        except InvalidOperation:
+            raise _NoDerivable("número no válido")
+    if isinstance(e, exp.Null):
+        return None
+    if isinstance(e, exp.Boolean):
+        return e.this
+    if isinstance(e, exp.Neg):
+        valor = _literal(e.this)
+        if not isinstance(valor, Decimal):
+            raise _NoDerivable("negación")
+        return -valor
+    if isinstance(e, exp.Cast):
+        valor = _literal(e.this)
+        tipo = e.to.this
+        if valor is None:
+            return None
+        if tipo == exp.DataType.Type.DATE:
+            return date.fromisoformat(str(valor))
+        if tipo in exp.DataType.TEMPORAL_TYPES:
+            return datetime.fromisoformat(str(valor))
+        if tipo in exp.DataType.NUMERIC_TYPES:
+            return Decimal(str(valor))
+        if tipo in exp.DataType.TEXT_TYPES:
+            return str(valor)
+    raise _NoDerivable(f"literal no soportado: {type(e).__name__}")
+
+
+def _alinear(valor, literal):
+    """Convierte el literal al tipo de la columna, como haría PostgreSQL."""
+    if valor is None or literal is None:
+        return literal
+    if isinstance(literal, str):
+        if isinstance(valor, datetime):
+            return datetime.fromisoformat(literal)
+        if isinstance(valor, date):
+            return date.fromisoformat(literal)
+        if isinstance(valor, bool):
+            raise _NoDerivable("texto comparado con booleano")
+        if isinstance(valor, (int, float, Decimal)):
+            return Decimal(literal)
+    if isinstance(valor, datetime) and type(literal) is date:
+        return datetime(literal.year, literal.month, literal.day, tzinfo=valor.tzinfo)
+    return literal
+
+
+def _patron(patron, ignorar_mayusculas):
+    regex = "".join(".*" if c == "%" else "." if c == "_" else re.escape(c) for c in patron)
+    return re.compile(f"^{regex}$", re.DOTALL | (re.IGNORECASE if ignorar_mayusculas else 0))
+
+
+class _Filtro:
+    """Predicado de SQL sobre las filas del resultado anterior, con lógica de tres valores."""
+
+    def __init__(self, condiciones, salida):
+        self.salida = salida
+        self.condiciones = condiciones
+        for condicion in condiciones:
+            if _es_agregado(condicion) or any(condicion.find_all(exp.Select)):
+                raise _NoDerivable("condición con agregados o subconsultas")
+            self._comprobar(condicion)
+        self._patrones = {}
+
+    def _columna(self, e):
+        # Índice de la salida anterior si la expresión es una de sus columnas
+        if isinstance(e, (exp.Literal, exp.Null, exp.Boolean)):
+            return None
+        return self.salida.indice(e)
+
+    def _comprobar(self, e):
+        # Cada columna usada debe estar en la salida anterior (p.ej. date_trunc(...) entera)
+        i = self._columna(e)
+        if i is not None:
+            if self.salida.agregado[i] or (self.salida.agrupa and i not in self.salida.claves):
+                raise _NoDerivable(f"columna no disponible: {_sql(e)}")
+            return
+        if isinstance(e, exp.Column):
+            raise _NoDerivable(f"columna no disponible: {_sql(e)}")
+        for hijo in e.iter_expressions():
+            self._comprobar(hijo)
+
+    def __call__(self, fila):
+        return all(self._evaluar(c, fila) is True for c in self.condiciones)
+
+    def _valor(self, e, fila):
+        if isinstance(e, exp.Paren):
+            return self._valor(e.this, fila)
+        i = self._columna(e)
+        return fila[i] if i is not None else _literal(e)
+
+    def _comparar(self, operacion, a, b):
+        if a is None or b is None:
+            return None
+        b = _alinear(a, b)
+        if isinstance(a, str) and operacion not in (exp.EQ, exp.NEQ):
+            raise _NoDerivable("orden de texto depende de la collation")
+        try:
+            return _COMPARACIONES[operacion](a, b)
+        except TypeError:
+            raise _NoDerivable("tipos no comparables")
+
+    def _evaluar(self, e, fila):
+        if isinstance(e, exp.Paren):
+            return self._evaluar(e.this, fila)
+        if isinstance(e, exp.And):
+            a, b = self._evaluar(e.this, fila), self._evaluar(e.expression, fila)
+            return False if False in (a, b) else None if None in (a, b) else True
+        if isinstance(e, exp.Or):
+            a, b = self._evaluar(e.this, fila), self._evaluar(e.expression, fila)
+            return True if True in (a, b) else None if None in (a, b) else False
+        if isinstance(e, exp.Not):
+            valor = self._evaluar(e.this, fila)
+            return None if valor is None else not valor
+        if type(e) in _COMPARACIONES:
+            return self._comparar(type(e), self._valor(e.this, fila), self._valor(e.expression, fila))
+        if isinstance(e, exp.Is):
+            valor = self._valor(e.this, fila)
+            objetivo = _literal(e.expression)
+            return valor is None if objetivo is None else valor is objetivo
+        if isinstance(e, exp.In):
+            if e.args.get("query") or e.args.get("unnest"):
+                raise _NoDerivable("IN con subconsulta")
+            valor = self._valor(e.this, fila)
+            resultados = [self._comparar(exp.EQ, valor, _literal(x)) for x in e.expressions]
+            return True if True in resultados else None if None in resultados else False
+        if isinstance(e, exp.Between):
+            valor = self._valor(e.this, fila)
+            desde = self._comparar(exp.GTE, valor, _literal(e.args["low"]))
+            hasta = self._comparar(exp.LTE, valor, _literal(e.args["high"]))
+            return False if False in (desde, hasta) else None if None in (desde, hasta) else True
+        if isinstance(e, (exp.Like, exp.ILike)):
+            valor, patron = self._valor(e.this, fila), _literal(e.expression)
+            if valor is None or patron is None:
+                return None
+            if not isinstance(valor, str) or not isinstance(patron, str):
+                raise _NoDerivable("LIKE sobre algo que no es texto")
+            clave = (patron, isinstance(e, exp.ILike))
+            if clave not in self._patrones:
+                self._patrones[clave] = _patron(*clave)
+            return bool(self._patrones[clave].match(valor))
+        if isinstance(e, exp.Boolean):
+            return e.this
+        raise _NoDerivable(f"condición no soportada: {type(e).__name__}")
+
+
+# ======================
+# PROYECCIÓN Y REAGREGACIÓN
+# ======================
+def _sumar(valores):
+    valores = [v for v in valores if v is not None]
+    return sum(valores[1:], valores[0]) if valores else None
+
+
+def _contar(valores):
+    return sum(v for v in valores if v is not None)
+
+
+def _minimo(valores):
+    valores = [v for v in valores if v is not None]
+    return min(valores) if valores else None
+
+
+def _maximo(valores):
+    valores = [v for v in valores if v is not None]
+    return max(valores) if valores else None
+
+
+_COMBINAR = {exp.Sum: _sumar, exp.Count: _contar, exp.Min: _minimo, exp.Max: _maximo}
+
+
+def _columnas_nuevas(arbol, salida, reagrega):
+    """[(nombre, índice en la salida anterior, función de combinación o None)] del SELECT nuevo."""
+    columnas = []
+    for e in arbol.expressions:
+        expresion = e.unalias()
+        i = salida.indice(expresion)
+        if i is None:
+            raise _NoDerivable(f"columna nueva: {_sql(expresion)}")
+        combinar = None
+        if reagrega and salida.agregado[i]:
+            if not isinstance(expresion, _AGREGADOS) or isinstance(expresion.this, exp.Distinct):
+                raise _NoDerivable("agregado no reagregable")
+            combinar = _COMBINAR[type(expresion)]
+        elif reagrega and i not in salida.claves:
+            raise _NoDerivable("columna sin agrupar")
+        if isinstance(e, exp.Alias):
+            nombre = e.alias
+        elif isinstance(expresion, exp.Column):
+            nombre = expresion.name
+        elif isinstance(expresion, _AGREGADOS) and salida.columnas[i] != salida.nombres_por_defecto[i]:
+            # Sin alias PostgreSQL llama a la columna como la función (sum, count...)
+            nombre = type(expresion).__name__.lower()
+        else:
+            nombre = salida.columnas[i]
+        columnas.append((nombre, i, combinar))
+    return columnas
+
+
+def _reagregar(filas, columnas, claves):
+    grupos = {}
+    for fila in filas:
+        grupos.setdefault(tuple(fila[i] for i in claves), []).append(fila)
+    if not claves and not grupos:
+        grupos[()] = []    # un agregado sin GROUP BY siempre devuelve una fila
+    resultado = []
+    for grupo in grupos.values():
+        fila = []
+        for _, i, combinar in columnas:
+            fila.append(combinar([f[i] for f in grupo]) if combinar else grupo[0][i])
+        resultado.append(tuple(fila))
+    return resultado
+
+
+def _ordenar(filas, arbol, nombres, expresiones):
+    orden = arbol.args.get("order")
+    if not orden:
+        return filas
+    # Ordenaciones estables de la última clave a la primera
+    for ordenado in reversed(orden.expressions):
+        e = ordenado.this
+        if isinstance(e, exp.Literal) and not e.is_string:
+            i = int(e.this) - 1
+        elif _sql(e) in expresiones:
+            i = expresiones.index(_sql(e))
+        elif isinstance(e, exp.Column) and not e.table and e.name in nombres:
+            i = nombres.index(e.name)
+        else:
+            raise _NoDerivable("ORDER BY fuera de la salida")
+        if not 0 <= i < len(nombres):
+            raise _NoDerivable("ordinal fuera de rango")
+        if any(isinstance(f[i], str) for f in filas):
+            raise _NoDerivable("orden de texto depende de la collation")
+        descendente = bool(ordenado.args.get("desc"))
+        nulos_primero = ordenado.args.get("nulls_first")
+        if nulos_primero is None:
+            nulos_primero = descendente     # por defecto en PostgreSQL: NULL es el mayor
+        presentes = [f for f in filas if f[i] is not None]
+        nulos = [f for f in filas if f[i] is None]
+        presentes.sort(key=lambda f: f[i], reverse=descendente)
+        filas = nulos + presentes if nulos_primero else presentes + nulos
+    return filas
+
+
+# ======================
+# DERIVACIÓN
+# ======================
+def _en_select(e, arbol):
+    """Expresión a la que se refiere un GROUP BY por ordinal o por alias del SELECT."""
+    if isinstance(e, exp.Literal) and not e.is_string:
+        posicion = int(e.this) - 1
+        if not 0 <= posicion < len(arbol.expressions):
+            raise _NoDerivable("ordinal fuera de rango")
+        return arbol.expressions[posicion].unalias()
+    if isinstance(e, exp.Column) and not e.table:
+        for item in arbol.expressions:
+            if isinstance(item, exp.Alias) and item.alias == e.name:
+                return item.unalias()
+    return e
+
+
+def _derivar(sql_anterior, sql_nuevo, resultado):
+    if resultado.get("truncated") or "columns" not in resultado:
+        raise _NoDerivable("resultado anterior incompleto")
+    anterior, nuevo = _consulta(sql_anterior), _consulta(sql_nuevo)
+    if anterior.args.get("limit"):
+        raise _NoDerivable("el anterior tenía LIMIT")
+    if _fuente(anterior) != _fuente(nuevo):
+        raise _NoDerivable("FROM distinto")
+    if _sql(anterior.args.get("having")) != _sql(nuevo.args.get("having")):
+        raise _NoDerivable("HAVING distinto")
+
+    condiciones_anteriores = {_sql(c) for c in _conjunciones(_condicion(anterior))}
+    condiciones_nuevas = _conjunciones(_condicion(nuevo))
+    if not condiciones_anteriores <= {_sql(c) for c in condiciones_nuevas}:
+        raise _NoDerivable("falta alguna condición anterior")
+    extra = [c for c in condiciones_nuevas if _sql(c) not in condiciones_anteriores]
+
+    salida = _Salida(anterior, resultado["columns"])
+    grupo_nuevo = nuevo.args.get("group").expressions if nuevo.args.get("group") else []
+    claves_nuevas = []
+    for g in grupo_nuevo:
+        i = salida.indice(_en_select(g, nuevo))
+        if i is None or i not in salida.claves:
+            raise _NoDerivable("agrupación nueva fuera de la anterior")
+        claves_nuevas.append(i)
+
+    nuevo_agrega = bool(grupo_nuevo) or any(_es_agregado(e) for e in nuevo.expressions)
+    if nuevo_agrega != salida.agrupa:
+        raise _NoDerivable("una agrega y la otra no")
+    reagrega = salida.agrupa and set(claves_nuevas) != salida.claves
+    if reagrega and anterior.args.get("having"):
+        raise _NoDerivable("HAVING antes de reagregar")
+
+    filtro = _Filtro(extra, salida)
+    columnas = _columnas_nuevas(nuevo, salida, reagrega)
+
+    filas = [f for f in resultado["rows"] if filtro(f)] if extra else list(resultado["rows"])
+    if reagrega:
+        filas = _reagregar(filas, columnas, claves_nuevas)
+    else:
+        filas = [tuple(f[i] for _, i, _ in columnas) for f in filas]
+
+    nombres = [nombre for nombre, _, _ in columnas]
+    expresiones = [_sql(e.unalias()) for e in nuevo.expressions]
+    filas = _ordenar(filas, nuevo, nombres, expresiones)
+    limite = _entero(nuevo.args.get("limit"))
+    if limite is not None:
+        filas = filas[:limite]
+
+    return {"columns": nombres, "rows": filas, "truncated": False, "next_offset": None}
+
+
+def derivar(sql_anterior, sql_nuevo, resultado):
+    """
+    Resultado de sql_nuevo calculado desde el resultado de sql_anterior, o None si no se
+    puede obtener exactamente así (ver el docstring del módulo).
+    """
+    if not sql_anterior or not sql_nuevo or not resultado:
+        return None
+    try:
+        return _derivar(sql_anterior, sql_nuevo, resultado)
+    except (_NoDerivable, SqlglotError, ValueError, InvalidOperation):
+        return None
@@ -0,0 +1,353 @@
+"""
+Índice del esquema de la BBDD para construir el prompt de analizar_intencion.
+
+En lugar de pegar un esquema fijo en cada prompt, se introspecciona PostgreSQL
+(information_schema + pg_catalog), se refresca de forma incremental y para cada
+pregunta solo se incluyen las `top_k` tablas más relevantes (BM25 sobre nombres,
+comentarios y valores de ejemplo) más las tablas relacionadas por clave foránea.
+El tamaño del prompt queda acotado aunque el esquema crezca.
+
+Los valores de ejemplo salen de pg_stats (most_common_vals), así que no se escanean
+tablas; basta con que PostgreSQL haya hecho ANALYZE. Para mejorar la búsqueda se
+pueden documentar las tablas: COMMENT ON TABLE transacciones IS 'ventas, compras'.
+"""
+import hashlib
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+
+_SQL_TABLAS = """
+    SELECT c.oid, n.nspname, c.relname, obj_description(c.oid, 'pg_class'),
+           md5(string_agg(a.attname || ':' || format_type(a.atttypid, a.atttypmod), ',' ORDER BY a.attnum))
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+    WHERE c.relkind IN ('r', 'v', 'm', 'p') AND n.nspname = ANY(%s)
+    GROUP BY c.oid, n.nspname, c.relname
+"""
+
+_SQL_COLUMNAS = """
+    SELECT c.oid, col.column_name, col.data_type,
+           col_description(c.oid, col.ordinal_position::int)
+    FROM information_schema.columns col
+    JOIN pg_namespace n ON n.nspname = col.table_schema
+    JOIN pg_class c ON c.relnamespace = n.oid AND c.relname = col.table_name
+    WHERE c.oid = ANY(%s)
+    ORDER BY c.oid, col.ordinal_position
+"""
+
+_SQL_CLAVES = """
+    SELECT con.contype, con.conrelid, a.attname, con.confrelid, af.attname
+    FROM pg_constraint con
+    CROSS JOIN LATERAL unnest(con.conkey, con.confkey) AS k(col, fcol)
+    JOIN pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = k.col
+    LEFT JOIN pg_attribute af ON af.attrelid = con.confrelid AND af.attnum = k.fcol
+    WHERE con.contype IN ('p', 'f') AND con.connamespace IN (
+        SELECT oid FROM pg_namespace WHERE nspname = ANY(%s))
+"""
+
+_SQL_VALORES = """
+    SELECT schemaname, tablename, attname, most_common_vals::text::text[], n_distinct
+    FROM pg_stats
+    WHERE schemaname = ANY(%s) AND most_common_vals IS NOT NULL
+"""
+
+_TIPOS_TEXTO = ("text", "character varying", "character", "USER-DEFINED")
+
+
+def _normalizar(texto):
+    texto = unicodedata.normalize("NFKD", texto or "")
+    return "".join(c for c in texto if not unicodedata.combining(c)).lower()
+
+
+def terminos(texto):
+    """Palabras normalizadas, partiendo nombres_con_guiones y recortando plurales simples."""
+    salida = []
+    for palabra in re.findall(r"[a-z0-9]+", _normalizar(texto).replace("_", " ")):
+        if len(palabra) > 4 and palabra.endswith("es"):
+            palabra = palabra[:-2]
+        elif len(palabra) > 3 and palabra.endswith("s"):
+            palabra = palabra[:-1]
+        salida.append(palabra)
+        # Prefijo para que "categoria" y "categorias" o "venta" y "ventas" coincidan también
+        if len(palabra) > 6:
+            salida.append(palabra[:6] + "*")
+    return salida
+
+
+class Tabla:
+    __slots__ = ("oid", "esquema", "nombre", "comentario", "firma", "columnas", "pk")
+
+    def __init__(self, oid, esquema, nombre, comentario, firma):
+        self.oid = oid
+        self.esquema = esquema
+        self.nombre = nombre
+        self.comentario = comentario
+        self.firma = firma
+        self.columnas = []   # [{"nombre", "tipo", "comentario", "valores"}]
+        self.pk = []
+
+    @property
+    def nombre_sql(self):
+        return self.nombre if self.esquema == "public" else f"{self.esquema}.{self.nombre}"
+
+
+class IndiceEsquema:
+    def __init__(self, pool, esquemas=("public",), top_k=4, max_columnas=25, max_valores=8,
+                 max_distintos=50, intervalo=300):
+        self.pool = pool
+        self.esquemas = list(esquemas)
+        self.top_k = top_k
+        self.max_columnas = max_columnas
+        self.max_valores = max_valores
+        self.max_distintos = max_distintos
+        self.intervalo = intervalo
+
+        self._tablas = {}        # oid -> Tabla
+        self._relaciones = []    # (oid_origen, columna, oid_destino, columna_destino)
+        self._docs = {}          # oid -> Counter de términos
+        self._df = Counter()
+        self._version = None
+        self._lock = threading.Lock()
+        self._hilo = None
+        self._pid = None
+        self._ultimo_refresco = 0.0
+        self._errores = 0
+
+    # ----------------------
+    # Introspección
+    # ----------------------
+    def refrescar(self):
+        """Relee solo las tablas nuevas o cuya firma (columnas y tipos) ha cambiado."""
+        with self.pool.conexion() as conn:
+            with conn.cursor() as cur:
+                cur.execute(_SQL_TABLAS, (self.esquemas,))
+                actuales = {fila[0]: Tabla(*fila) for fila in cur.fetchall()}
+
+                cambiadas = [oid for oid, t in actuales.items()
+                             if oid not in self._tablas or self._tablas[oid].firma != t.firma]
+                if cambiadas:
+                    cur.execute(_SQL_COLUMNAS, (cambiadas,))
+                    for oid, nombre, tipo, comentario in cur.fetchall():
+                        actuales[oid].columnas.append(
+                            {"nombre": nombre, "tipo": tipo, "comentario": comentario, "valores": []}
+                        )
+                # Las que no han cambiado conservan lo que ya sabíamos
+                for oid, tabla in actuales.items():
+                    if oid not in cambiadas:
+                        tabla.columnas = self._tablas[oid].columnas
+
+                # Claves y valores de ejemplo son consultas baratas: se releen siempre
+                cur.execute(_SQL_CLAVES, (self.esquemas,))
+                claves = cur.fetchall()
+                cur.execute(_SQL_VALORES, (self.esquemas,))
+                valores = cur.fetchall()
+
+        relaciones = []
+        for tabla in actuales.values():
+            tabla.pk = []
+        for tipo, oid, columna, oid_destino, columna_destino in claves:
+            if oid not in actuales:
+                continue
+            if tipo == "p":
+                actuales[oid].pk.append(columna)
+            elif oid_destino in actuales:
+                relaciones.append((oid, columna, oid_destino, columna_destino))
+        relaciones += self._relaciones_implicitas(actuales, relaciones)
+
+        por_nombre = {(t.esquema, t.nombre): t for t in actuales.values()}
+        for esquema, tabla, columna, comunes, n_distinct in valores:
+            t = por_nombre.get((esquema, tabla))
+            if t is None or not comunes:
+                continue
+            # Solo columnas de texto con pocos valores distintos (categorías, países...)
+            if n_distinct is None or n_distinct < 0 or n_distinct > self.max_distintos:
+                continue
+            for col in t.columnas:
+                if col["nombre"] == columna and col["tipo"] in _TIPOS_TEXTO:
+                    col["valores"] = list(comunes[:self.max_valores])
+
+        self._publicar(actuales, relaciones)
+        return len(cambiadas)
+
+    @staticmethod
+    def _relaciones_implicitas(tablas, declaradas):
+        # Si no hay FK declarada, unimos columnas id_* que son la PK de otra tabla
+        ya = {(o, c) for o, c, _, _ in declaradas}
+        pks = {t.pk[0]: oid for oid, t in tablas.items() if len(t.pk) == 1}
+        implicitas = []
+        for oid, tabla in tablas.items():
+            for col in tabla.columnas:
+                destino = pks.get(col["nombre"])
+                if destino and destino != oid and (oid, col["nombre"]) not in ya:
+                    implicitas.append((oid, col["nombre"], destino, col["nombre"]))
+        return implicitas
+
+    def _publicar(self, tablas, relaciones):
+        docs = {}
+        for oid, tabla in tablas.items():
+            texto = [tabla.nombre, tabla.comentario or ""]
+            for col in tabla.columnas:
+                texto += [col["nombre"], col["comentario"] or ""] + [str(v) for v in col["valores"]]
+            docs[oid] = Counter(terminos(" ".join(texto)))
+        df = Counter()
+        for doc in docs.values():
+            df.update(doc.keys())
+        version = hashlib.sha256(
+            "|".join(sorted(f"{t.esquema}.{t.nombre}:{t.firma}" for t in tablas.values())).encode()
+        ).hexdigest()[:16]
+
+        with self._lock:
+            self._tablas, self._relaciones = tablas, relaciones
+            self._docs, self._df, self._version = docs, df, version
+            self._ultimo_refresco = time.time()
+
+    # ----------------------
+    # Refresco en segundo plano
+    # ----------------------
+    def iniciar(self):
+        """Arranca (una vez por proceso) el hilo que carga el esquema y lo refresca cada `intervalo`."""
+        if self._pid == os.getpid() and self._hilo is not None:
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._hilo is not None:
+                return
+            self._pid = os.getpid()
+            self._hilo = threading.Thread(target=self._bucle, name="kairo-esquema", daemon=True)
+            self._hilo.start()
+
+    def _bucle(self):
+        while True:
+            try:
+                cambiadas = self.refrescar()
+                if cambiadas:
+                    print(f"🗂️ Esquema: {cambiadas} tablas (re)indexadas, {len(self._tablas)} en total")
+                espera = self.intervalo
+            except Exception as e:
+                self._errores += 1
+                print(f"⚠️ Esquema: no se pudo introspeccionar ({e})")
+                espera = min(self.intervalo, 30)
+            time.sleep(espera)
+
+    # ----------------------
+    # Recuperación
+    # ----------------------
+    @property
+    def cargado(self):
+        return self._version is not None
+
+    def version(self):
+        return self._version
+
+    def buscar(self, pregunta, k=None):
+        """Tablas más relevantes para la pregunta (BM25) más sus vecinas por FK."""
+        k = k or self.top_k
+        with self._lock:
+            tablas, docs, df, relaciones = self._tablas, self._docs, self._df, self._relaciones
+        if not tablas:
+            return [], {}
+        if len(tablas) <= k:
+            elegidas = list(tablas)
+        else:
+            consulta = terminos(pregunta)
+            n = len(docs)
+            media = sum(sum(d.values()) for d in docs.values()) / n
+            puntuacion = {}
+            for oid, doc in docs.items():
+                largo = sum(doc.values())
+                total = 0.0
+                for termino in consulta:
+                    tf = doc.get(termino, 0)
+                    if not tf:
+                        continue
+                    idf = math.log(1 + (n - df[termino] + 0.5) / (df[termino] + 0.5))
+                    total += idf * tf * 2.2 / (tf + 1.2 * (0.25 + 0.75 * largo / media))
+                puntuacion[oid] = total
+            elegidas = [oid for oid in sorted(puntuacion, key=puntuacion.get, reverse=True)[:k]
+                        if puntuacion[oid] > 0]
+            # Para joins hacen falta las tablas relacionadas con las elegidas
+            for origen, _, destino, _ in relaciones:
+                if origen in elegidas and destino not in elegidas:
+                    elegidas.append(destino)
+                elif destino in elegidas and origen not in elegidas and len(elegidas) < 2 * k:
+                    elegidas.append(origen)
+            if not elegidas:
+                elegidas = sorted(tablas, key=lambda o: -sum(docs[o].values()))[:k]
+        return [tablas[oid] for oid in elegidas], tablas
+
+    def _columnas(self, tabla, consulta, claves):
+        if len(tabla.columnas) <= self.max_columnas:
+            return tabla.columnas
+        # Tabla ancha: claves + las columnas que más se parecen a la pregunta
+        def puntos(col):
+            if col["nombre"] in claves:
+                return 1000
+            return len(set(terminos(col["nombre"] + " " + (col["comentario"] or ""))) & consulta)
+        mejores = sorted(tabla.columnas, key=puntos, reverse=True)[:self.max_columnas]
+        return [c for c in tabla.columnas if c in mejores]
+
+    def texto_prompt(self, pregunta):
+        """Fragmento de esquema para el prompt (None si el índice aún no está cargado)."""
+        ampliacion = self.ampliar_prompt(pregunta)
+        return "\n" + ampliacion[0] if ampliacion else None
+
+    def ampliar_prompt(self, pregunta, previas=frozenset()):
+        """
+        Para un prompt que ya lleva las tablas `previas` (oids): (líneas de las tablas que
+        añade esta pregunta y de sus relaciones, numeradas a continuación; oids de todas las
+        tablas incluidas). None si el índice aún no está cargado.
+        """
+        self.iniciar()
+        if not self.cargado:
+            return None
+        elegidas, todas = self.buscar(pregunta)
+        nuevas = [t for t in elegidas if t.oid not in previas]
+        nuevos = {t.oid for t in nuevas}
+        oids = set(previas) | nuevos
+        consulta = set(terminos(pregunta))
+        with self._lock:
+            relaciones = [r for r in self._relaciones
+                          if r[0] in oids and r[2] in oids and (r[0] in nuevos or r[2] in nuevos)]
+        claves = {c for r in relaciones for c in (r[1], r[3])}
+
+        lineas = []
+        for i, tabla in enumerate(nuevas, len(previas) + 1):
+            columnas = []
+            for col in self._columnas(tabla, consulta, claves | set(tabla.pk)):
+                texto = f"{col['nombre']} {col['tipo']}"
+                if col["valores"]:
+                    texto += " [valores: " + ", ".join(repr(v) for v in col["valores"]) + "]"
+                columnas.append(texto)
+            descripcion = f" -- {tabla.comentario}" if tabla.comentario else ""
+            lineas.append(f"Tabla {i}: {tabla.nombre_sql} (columnas: {', '.join(columnas)}){descripcion}")
+        for origen, columna, destino, columna_destino in relaciones:
+            lineas.append(
+                f"Relación: {todas[origen].nombre_sql}.{columna} = {todas[destino].nombre_sql}.{columna_destino}"
+            )
+        return "\n".join(lineas) + "\n", frozenset(oids)
+
+    def columnas_por_tabla(self):
+        """{tabla: {columnas}} de todo el esquema indexado (lista permitida para validar SQL)."""
+        with self._lock:
+            tablas = list(self._tablas.values())
+        salida = {}
+        for tabla in tablas:
+            columnas = {c["nombre"].lower() for c in tabla.columnas}
+            salida[f"{tabla.esquema}.{tabla.nombre}".lower()] = columnas
+            if tabla.esquema == "public":
+                salida[tabla.nombre.lower()] = columnas
+        return salida
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "tablas": len(self._tablas),
+                "relaciones": len(self._relaciones),
+                "version": self._version,
+                "ultimo_refresco": self._ultimo_refresco,
+                "errores": self._errores,
+            }
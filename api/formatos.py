@@ -0,0 +1,134 @@
+import datetime
+import decimal
+import importlib.util
+import io
+import json
+import uuid
+
+# pyarrow es opcional: sin él solo se sirve JSON columnar. Es de los imports más pesados,
+# así que solo se comprueba que está y se carga con la primera respuesta Arrow/Parquet
+PYARROW_DISPONIBLE = importlib.util.find_spec("pyarrow") is not None
+
+
+def _pyarrow():
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+    return pyarrow
+
+MIME_JSON = "application/json"
+MIME_ARROW = "application/vnd.apache.arrow.stream"
+MIME_PARQUET = "application/vnd.apache.parquet"
+
+FORMATOS = {"json": MIME_JSON, "arrow": MIME_ARROW, "parquet": MIME_PARQUET}
+
+# Clave de los metadatos del esquema Arrow/Parquet donde viaja el resto de la respuesta
+CLAVE_METADATOS = b"kairo"
+
+
+def elegir_formato(pedido=None, accept=None):
+    """
+    Formato de la respuesta: el campo "format" del body manda sobre la cabecera Accept.
+    Si se pide Arrow/Parquet pero pyarrow no está instalado se responde JSON.
+    """
+    formato = (pedido or "").lower()
+    if formato not in FORMATOS:
+        accept = accept or ""
+        if MIME_ARROW in accept:
+            formato = "arrow"
+        elif MIME_PARQUET in accept or "application/x-parquet" in accept:
+            formato = "parquet"
+        else:
+            formato = "json"
+    if formato != "json" and not PYARROW_DISPONIBLE:
+        formato = "json"
+    return formato
+
+
+def valor_json(v):
+    # Solo se llama para lo que json no sabe serializar
+    if isinstance(v, decimal.Decimal):
+        return int(v) if v == v.to_integral_value() and v.as_tuple().exponent >= 0 else float(v)
+    if isinstance(v, (datetime.datetime, datetime.date, datetime.time)):
+        return v.isoformat()
+    if isinstance(v, datetime.timedelta):
+        return v.total_seconds()
+    if isinstance(v, uuid.UUID):
+        return str(v)
+    if isinstance(v, (bytes, bytearray, memoryview)):
+        return bytes(v).hex()
+    return str(v)
+
+
+def _tipo(v):
+    if isinstance(v, bool):
+        return "bool"
+    if isinstance(v, (int, float, decimal.Decimal)):
+        return "number"
+    if isinstance(v, datetime.datetime):
+        return "datetime"
+    if isinstance(v, datetime.date):
+        return "date"
+    return "text"
+
+
+def tipos_columnas(resultado):
+    """Tipo lógico de cada columna según su primer valor no nulo."""
+    tipos = []
+    for i in range(len(resultado["columns"])):
+        valor = next((row[i] for row in resultado["rows"] if row[i] is not None), None)
+        tipos.append(_tipo(valor) if valor is not None else "text")
+    return tipos
+
+
+def columnar(resultado):
+    """{"columns": [...], "types": [...], "data": [[...], ...]}: los nombres de columna van una sola vez."""
+    return {
+        "columns": resultado["columns"],
+        "types": tipos_columnas(resultado),
+        "data": resultado["rows"],
+    }
+
+
+def a_json(datos):
+    return json.dumps(datos, default=valor_json, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def _tabla_arrow(resultado, envelope):
+    pa = _pyarrow()
+    columnas = resultado["columns"]
+    filas = resultado["rows"]
+    arrays = []
+    for i, nombre in enumerate(columnas):
+        valores = [row[i] for row in filas]
+        try:
+            arrays.append(pa.array(valores))
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # Tipos mezclados: lo mandamos como texto
+            arrays.append(pa.array([None if v is None else str(valor_json(v)) for v in valores], pa.string()))
+    tabla = pa.Table.from_arrays(arrays, names=columnas)
+    return tabla.replace_schema_metadata({CLAVE_METADATOS: a_json(envelope)})
+
+
+def codificar(envelope, resultado, formato):
+    """
+    Serializa la respuesta. Devuelve (bytes, mimetype).
+
+    - json: el envelope con "data" en formato columnar.
+    - arrow / parquet: los datos como tabla y el resto del envelope en los metadatos del esquema.
+    """
+    if formato == "arrow":
+        pa = _pyarrow()
+        tabla = _tabla_arrow(resultado, envelope)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, tabla.schema) as writer:
+            writer.write_table(tabla)
+        return sink.getvalue().to_pybytes(), MIME_ARROW
+
+    if formato == "parquet":
+        tabla = _tabla_arrow(resultado, envelope)
+        buffer = io.BytesIO()
+        _pyarrow().parquet.write_table(tabla, buffer)
+        return buffer.getvalue(), MIME_PARQUET
+
+    return a_json({**envelope, "data": columnar(resultado)}), MIME_JSON
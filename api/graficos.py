@@ -0,0 +1,214 @@
+"""
+Datos listos para pintar cuando la pregunta pide un gráfico.
+
+En vez de que el cliente reciba todas las filas y adivine los ejes, la API elige los
+roles a partir del tipo de cada columna y reduce los puntos a lo que un gráfico puede
+mostrar:
+
+- Eje X: en "line" la primera columna de fecha; en "bar" y "pie" la primera de texto.
+  Si no hay del tipo preferido, la primera columna.
+- Eje Y: las columnas numéricas que no son el eje X (solo una en "pie").
+- Serie: en "line" y "bar", una columna de texto que no es el eje X (una línea o un
+  color por valor). Como mucho `max_series`; el resto se suma en "Otros".
+- Filas repetidas para el mismo (x, serie) se suman: la serie sale preagregada.
+- "line" (y "bar" sobre fechas o números): orden por X y, si hay más de `max_puntos`,
+  reducción con LTTB (Largest-Triangle-Three-Buckets), que conserva picos y valles.
+  Con un X de texto en "line" (meses por nombre, "2024-T1"...) se respeta el orden del
+  resultado y LTTB usa la posición de cada fila.
+- "bar" y "pie" sobre categorías: las `max_categorias - 1` mayores y el resto en "Otros".
+"""
+import datetime
+import decimal
+
+from formatos import tipos_columnas
+
+OTROS = "Otros"
+TIPOS_GRAFICO = ("bar", "line", "pie")
+_ORDENABLES = ("date", "datetime", "number")
+
+
+def _numero(v):
+    if v is None or isinstance(v, bool):
+        return None
+    if isinstance(v, decimal.Decimal):
+        return float(v)
+    return v if isinstance(v, (int, float)) else None
+
+
+def _posicion(v):
+    # Coordenada numérica del eje X para LTTB
+    if isinstance(v, datetime.datetime):
+        return v.timestamp()
+    if isinstance(v, datetime.date):
+        return float(v.toordinal())
+    return float(v)
+
+
+def lttb(xs, ys, umbral):
+    """
+    Índices de los puntos que conserva Largest-Triangle-Three-Buckets.
+    xs ordenados y ys sin None; siempre se quedan el primero y el último.
+    """
+    n = len(xs)
+    if umbral >= n or umbral < 3:
+        return list(range(n))
+    indices = [0]
+    cubo = (n - 2) / (umbral - 2)
+    a = 0
+    for i in range(umbral - 2):
+        inicio = int(i * cubo) + 1
+        fin = int((i + 1) * cubo) + 1
+        # Vértice C del triángulo: la media del cubo siguiente (o el último punto)
+        sig_fin = min(int((i + 2) * cubo) + 1, n)
+        siguiente = range(fin, sig_fin) if sig_fin > fin else range(n - 1, n)
+        media_x = sum(xs[j] for j in siguiente) / len(siguiente)
+        media_y = sum(ys[j] for j in siguiente) / len(siguiente)
+
+        mejor, area_max = inicio, -1.0
+        for j in range(inicio, fin):
+            area = abs((xs[a] - media_x) * (ys[j] - ys[a]) - (xs[a] - xs[j]) * (media_y - ys[a]))
+            if area > area_max:
+                mejor, area_max = j, area
+        indices.append(mejor)
+        a = mejor
+    indices.append(n - 1)
+    return indices
+
+
+def elegir_roles(columnas, tipos, chart_type):
+    """(x, [y...], serie) como índices de columna, o None si no hay nada que pintar."""
+    if len(columnas) < 2:
+        return None
+    preferidos = ("date", "datetime") if chart_type == "line" else ("text",)
+    x = next((i for i, t in enumerate(tipos) if t in preferidos), 0)
+    ys = [i for i, t in enumerate(tipos) if t == "number" and i != x]
+    if not ys:
+        return None
+    if chart_type == "pie":
+        return x, ys[:1], None
+    serie = next((i for i, t in enumerate(tipos) if t == "text" and i != x), None)
+    return x, ys, serie
+
+
+def _agregar(filas, x, ys, serie):
+    """{(x, serie): [suma de cada y]} en el orden de aparición; indica si había repetidos."""
+    grupos = {}
+    for fila in filas:
+        clave = (fila[x], fila[serie] if serie is not None else None)
+        valores = [_numero(fila[y]) for y in ys]
+        actual = grupos.get(clave)
+        if actual is None:
+            grupos[clave] = valores
+        else:
+            grupos[clave] = [v if a is None else a if v is None else a + v for a, v in zip(actual, valores)]
+    return grupos, len(grupos) < len(filas)
+
+
+def _total(valores):
+    return abs(valores[0]) if valores[0] is not None else 0.0
+
+
+def _agrupar_otros(grupos, limite, por):
+    """
+    Se queda con los `limite - 1` valores de `por` (0 = x, 1 = serie) de mayor total y
+    suma el resto en "Otros". Devuelve los grupos y si hubo que agrupar.
+    """
+    totales = {}
+    for clave, valores in grupos.items():
+        totales[clave[por]] = totales.get(clave[por], 0.0) + _total(valores)
+    if len(totales) <= limite:
+        return grupos, False
+    mayores = set(sorted(totales, key=totales.get, reverse=True)[:limite - 1])
+    resultado = {}
+    for clave, valores in grupos.items():
+        if clave[por] not in mayores:
+            clave = (OTROS, clave[1]) if por == 0 else (clave[0], OTROS)
+        actual = resultado.get(clave)
+        resultado[clave] = valores if actual is None else [
+            v if a is None else a if v is None else a + v for a, v in zip(actual, valores)
+        ]
+    return resultado, True
+
+
+def _reducir_lttb(grupos, max_puntos, ordenable=True):
+    """
+    Reduce cada serie con LTTB al reparto de max_puntos entre series. Si X es ordenable
+    se ordena por X; si no, se deja el orden del resultado y la posición es el índice.
+    """
+    series = {}
+    for clave, valores in grupos.items():
+        if clave[0] is not None:
+            series.setdefault(clave[1], []).append((clave[0], valores))
+    por_serie = max(3, max_puntos // max(1, len(series)))
+    resultado, reducido = {}, False
+    for serie, puntos in series.items():
+        if ordenable:
+            puntos.sort(key=lambda p: p[0])
+        con_valor = [p for p in puntos if p[1][0] is not None]
+        if len(con_valor) > por_serie:
+            xs = [_posicion(p[0]) for p in con_valor] if ordenable else list(range(len(con_valor)))
+            ys = [p[1][0] for p in con_valor]
+            puntos = [con_valor[i] for i in lttb(xs, ys, por_serie)]
+            reducido = True
+        for x, valores in puntos:
+            resultado[(x, serie)] = valores
+    return resultado, reducido
+
+
+def preparar_grafico(resultado, chart_type, max_puntos=500, max_categorias=12, max_series=8):
+    """
+    Bloque "grafico" de la respuesta, o None si el resultado no se puede pintar:
+    {"tipo", "x", "y", "serie", "datos": {"columns", "types", "data"}, "filas", "puntos",
+     "agregado", "reduccion"}. "datos" va en el mismo formato columnar que "data".
+    """
+    if chart_type not in TIPOS_GRAFICO or not resultado.get("rows"):
+        return None
+    columnas = resultado["columns"]
+    tipos = tipos_columnas(resultado)
+    roles = elegir_roles(columnas, tipos, chart_type)
+    if roles is None:
+        return None
+    x, ys, serie = roles
+
+    grupos, agregado = _agregar(resultado["rows"], x, ys, serie)
+    reduccion = []
+    if serie is not None:
+        grupos, con_otros = _agrupar_otros(grupos, max_series, por=1)
+        if con_otros:
+            reduccion.append("series_otros")
+
+    ordenable = tipos[x] in _ORDENABLES
+    if chart_type == "line" or (chart_type == "bar" and ordenable):
+        grupos, reducido = _reducir_lttb(grupos, max_puntos, ordenable)
+        if reducido:
+            reduccion.append("lttb")
+    else:
+        grupos, con_otros = _agrupar_otros(grupos, max_categorias, por=0)
+        if con_otros:
+            reduccion.append("otros")
+        # Categorías de mayor a menor, "Otros" al final
+        grupos = dict(sorted(grupos.items(), key=lambda g: (g[0][0] == OTROS, -_total(g[1]))))
+
+    if serie is not None:
+        nombres = [columnas[x], columnas[serie]] + [columnas[y] for y in ys]
+        filas = [[cx, cs] + valores for (cx, cs), valores in grupos.items()]
+    else:
+        nombres = [columnas[x]] + [columnas[y] for y in ys]
+        filas = [[cx] + valores for (cx, _), valores in grupos.items()]
+    tipo_x = "text" if "otros" in reduccion else tipos[x]
+
+    return {
+        "tipo": chart_type,
+        "x": columnas[x],
+        "y": [columnas[y] for y in ys],
+        "serie": columnas[serie] if serie is not None else None,
+        "datos": {
+            "columns": nombres,
+            "types": [tipo_x] + (["text"] if serie is not None else []) + ["number"] * len(ys),
+            "data": filas,
+        },
+        "filas": len(resultado["rows"]),
+        "puntos": len(filas),
+        "agregado": agregado,
+        "reduccion": reduccion or None,
+    }
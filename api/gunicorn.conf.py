@@ -0,0 +1,65 @@
+"""
+Perfil de producción de la API síncrona (app.py).
+
+    gunicorn -c gunicorn.conf.py app:app
+
+Cada petición pasa casi todo el tiempo esperando a Groq o a PostgreSQL, así que se usan
+workers con hilos (gthread): pocos procesos y varios hilos por proceso. Con preload_app
+el módulo se importa una sola vez en el maestro (clientes, prompts, índices) y los
+workers lo heredan; lo que no sobrevive al fork se rehace en post_fork (app.tras_fork).
+Los hilos en segundo plano (LISTEN de invalidaciones, refresco de rollups) solo arrancan
+en los workers (post_worker_init), nunca en el maestro.
+
+Recarga sin cortar peticiones: kill -HUP <pid del maestro>. Con preload_app el código
+nuevo no se carga con HUP; para desplegar código nuevo, USR2 + QUIT al maestro antiguo.
+"""
+import multiprocessing
+import os
+
+# ======================
+# CONFIGURACIÓN
+# ======================
+bind = os.environ.get("WEB_BIND", f"0.0.0.0:{os.environ.get('PORT', 5000)}")
+# Las sesiones de conversación viven en cada worker: con varios, el balanceador debe tener
+# afinidad por la cabecera X-Kairo-Sesion (o usar un solo worker con más hilos)
+workers = int(os.environ.get("WEB_WORKERS", min(4, multiprocessing.cpu_count())))
+worker_class = "gthread"
+threads = int(os.environ.get("WEB_THREADS", 8))                        # peticiones a la vez por worker
+preload_app = os.environ.get("WEB_PRELOAD", "1") == "1"
+
+# Las respuestas de Groq pueden tardar; el plazo de la petición lo pone LLM_PLAZO
+timeout = int(os.environ.get("WEB_TIMEOUT", 120))
+graceful_timeout = int(os.environ.get("WEB_GRACEFUL_TIMEOUT", 30))    # para terminar las peticiones en curso
+keepalive = int(os.environ.get("WEB_KEEPALIVE", 5))                    # algo más que el idle del balanceador
+
+# Reciclado de workers para acotar la memoria; el jitter evita que se reinicien todos a la vez
+max_requests = int(os.environ.get("WEB_MAX_REQUESTS", 0))              # 0 = nunca
+max_requests_jitter = int(os.environ.get("WEB_MAX_REQUESTS_JITTER", 100))
+
+accesslog = os.environ.get("WEB_ACCESSLOG")                            # "-" = stdout; sin definir = sin access log
+errorlog = "-"
+loglevel = os.environ.get("WEB_LOGLEVEL", "info")
+
+
+# ======================
+# HOOKS
+# ======================
+def post_fork(server, worker):
+    if preload_app:
+        import app
+        app.tras_fork()
+
+
+def post_worker_init(worker):
+    import app
+    app.iniciar_hilos()
+    # Con CALENTAR=1 cada worker abre el pool y la conexión con Groq antes de la primera petición
+    if app.CALENTAR:
+        app.calentar_en_segundo_plano()
+
+
+def child_exit(server, worker):
+    # Con varios workers, /metrics necesita PROMETHEUS_MULTIPROC_DIR (ver metricas.exportar)
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,246 @@
+import atexit
+import os
+import socket
+import threading
+import time
+from collections import deque
+
+
+class EnviadorSyslog:
+    """
+    Envía los mensajes syslog a QRadar desde un hilo en segundo plano.
+
+    La petición solo encola (nunca espera a la red ni al disco). El hilo mantiene una
+    conexión persistente que se reconecta sola, agrupa los mensajes en lotes y, si la
+    cola se llena, descarta los más antiguos o los vuelca a disco según `cola_llena`
+    ("descartar" o "disco"). En "disco" el desborde se apunta en memoria (como mucho
+    otros `max_cola` mensajes) y es el hilo quien escribe el fichero. Al salir del
+    proceso se vacía la cola.
+    """
+
+    def __init__(self, host, port, protocolo="tcp", max_cola=10000, tamano_lote=100,
+                 intervalo=0.5, timeout=0.5, cola_llena="descartar", ruta_disco=None):
+        self.host = host
+        self.port = port
+        self.protocolo = protocolo.lower()
+        self.max_cola = max(1, max_cola)
+        self.tamano_lote = max(1, tamano_lote)
+        self.intervalo = intervalo
+        self.timeout = timeout
+        self.cola_llena = cola_llena if ruta_disco else "descartar"
+        self.ruta_disco = ruta_disco
+
+        self._cola = deque()
+        self._desborde = []      # "disco": mensajes que el hilo tiene que escribir en el fichero
+        self._cond = threading.Condition()
+        self._hilo = None
+        self._pid = None
+        self._parar = False
+        self._sock = None
+        self._espera_reconexion = 0.0
+        self._proximo_intento = 0.0
+
+        # Contadores
+        self._encolados = 0
+        self._enviados = 0
+        self._descartados = 0
+        self._a_disco = 0
+        self._errores = 0
+        self._reconexiones = 0
+
+        atexit.register(self.parar)
+
+    # ----------------------
+    # Lado de la petición (no bloquea)
+    # ----------------------
+    def enviar(self, mensaje):
+        self._asegurar_hilo()
+        with self._cond:
+            if len(self._cola) >= self.max_cola:
+                if self.cola_llena == "disco":
+                    # El fichero lo escribe el hilo; si tampoco cabe en el desborde, se pierde
+                    if len(self._desborde) < self.max_cola:
+                        self._desborde.append(mensaje)
+                        self._cond.notify()
+                    else:
+                        self._descartados += 1
+                    return
+                self._cola.popleft()
+                self._descartados += 1
+            self._cola.append(mensaje)
+            self._encolados += 1
+            if len(self._cola) >= self.tamano_lote:
+                self._cond.notify()
+
+    def _asegurar_hilo(self):
+        # Tras un fork (gunicorn --preload) el hilo no existe en el hijo: lo arrancamos de nuevo
+        if self._pid == os.getpid() and self._hilo is not None:
+            return
+        with self._cond:
+            if self._pid == os.getpid() and self._hilo is not None:
+                return
+            self._pid = os.getpid()
+            self._parar = False
+            self._sock = None
+            self._hilo = threading.Thread(target=self._bucle, name="kairo-syslog", daemon=True)
+            self._hilo.start()
+
+    # ----------------------
+    # Hilo de envío
+    # ----------------------
+    def _bucle(self):
+        while True:
+            with self._cond:
+                if not self._cola and not self._desborde and not self._parar:
+                    self._cond.wait(self.intervalo)
+                desborde, self._desborde = self._desborde, []
+                parar = self._parar and not self._cola
+                lote = [self._cola.popleft() for _ in range(min(self.tamano_lote, len(self._cola)))]
+
+            # Fuera del lock: enviar() no espera mientras se escribe el fichero
+            if desborde:
+                self._volcar_a_disco(desborde)
+            if parar:
+                return
+
+            if lote and not self._enviar_lote(lote):
+                self._devolver(lote)
+                if self._parar:
+                    # Sin conexión al apagar: lo que quede va a disco si está configurado
+                    if self.cola_llena == "disco":
+                        with self._cond:
+                            restantes, self._cola = list(self._cola) + self._desborde, deque()
+                            self._desborde = []
+                        self._volcar_a_disco(restantes)
+                    return
+                time.sleep(min(self._espera_reconexion, self.intervalo))
+            elif not lote and self.cola_llena == "disco":
+                self._reenviar_disco()
+
+    def _conectar(self):
+        if self._sock is not None:
+            return self._sock
+        ahora = time.monotonic()
+        if ahora < self._proximo_intento:
+            return None
+        try:
+            if self.protocolo == "udp":
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.connect((self.host, self.port))
+            else:
+                sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            sock.settimeout(self.timeout)
+        except OSError:
+            # Backoff exponencial hasta 30s para no martillear a QRadar caído
+            self._espera_reconexion = min(30.0, max(0.5, self._espera_reconexion * 2))
+            self._proximo_intento = ahora + self._espera_reconexion
+            self._errores += 1
+            return None
+        self._reconexiones += 1
+        self._espera_reconexion = 0.0
+        self._sock = sock
+        return sock
+
+    def _cerrar_socket(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+            self._sock = None
+
+    def _enviar_lote(self, lote):
+        sock = self._conectar()
+        if sock is None:
+            return False
+        try:
+            if self.protocolo == "udp":
+                # En UDP un datagrama por mensaje
+                for mensaje in lote:
+                    sock.send(mensaje.encode())
+            else:
+                sock.sendall("".join(lote).encode())
+        except OSError:
+            self._errores += 1
+            self._cerrar_socket()
+            return False
+        with self._cond:
+            self._enviados += len(lote)
+        return True
+
+    def _devolver(self, lote):
+        # El lote no salió: vuelve al principio de la cola respetando el límite
+        with self._cond:
+            hueco = self.max_cola - len(self._cola)
+            sobran = lote[:max(0, len(lote) - hueco)]
+            self._cola.extendleft(reversed(lote[len(sobran):]))
+            if sobran and self.cola_llena != "disco":
+                self._descartados += len(sobran)
+        if sobran and self.cola_llena == "disco":
+            self._volcar_a_disco(sobran)
+
+    # ----------------------
+    # Desbordamiento a disco
+    # ----------------------
+    def _volcar_a_disco(self, mensajes):
+        # Solo desde el hilo de envío (o al parar), nunca desde enviar()
+        try:
+            with open(self.ruta_disco, "a", encoding="utf-8") as f:
+                f.writelines(m if m.endswith("\n") else m + "\n" for m in mensajes)
+            escritos = True
+        except OSError:
+            escritos = False
+        with self._cond:
+            if escritos:
+                self._a_disco += len(mensajes)
+            else:
+                self._descartados += len(mensajes)
+
+    def _reenviar_disco(self):
+        # Con la cola vacía y conexión disponible, recuperamos lo que se volcó a disco
+        if not self.ruta_disco or not os.path.exists(self.ruta_disco) or self._conectar() is None:
+            return
+        pendiente = self.ruta_disco + ".enviando"
+        try:
+            os.replace(self.ruta_disco, pendiente)
+            with open(pendiente, encoding="utf-8") as f:
+                mensajes = f.readlines()
+            os.remove(pendiente)
+        except OSError:
+            return
+        for i in range(0, len(mensajes), self.tamano_lote):
+            lote = mensajes[i:i + self.tamano_lote]
+            if not self._enviar_lote(lote):
+                self._volcar_a_disco(mensajes[i:])
+                return
+
+    # ----------------------
+    # Parada y métricas
+    # ----------------------
+    def parar(self, timeout=2.0):
+        """Vacía la cola (como mucho `timeout` segundos) y para el hilo."""
+        hilo = self._hilo
+        if hilo is None or self._pid != os.getpid():
+            return
+        with self._cond:
+            self._parar = True
+            self._cond.notify()
+        hilo.join(timeout)
+        self._cerrar_socket()
+        self._hilo = None
+
+    def estadisticas(self):
+        with self._cond:
+            return {
+                "protocolo": self.protocolo,
+                "en_cola": len(self._cola),
+                "desborde": len(self._desborde),
+                "max_cola": self.max_cola,
+                "encolados": self._encolados,
+                "enviados": self._enviados,
+                "descartados": self._descartados,
+                "a_disco": self._a_disco,
+                "errores": self._errores,
+                "reconexiones": self._reconexiones,
+                "conectado": self._sock is not None,
+            }
@@ -0,0 +1,185 @@
+"""
+Tiempos por etapa de cada petición y exportación a Prometheus.
+
+Uso:
+    tiempos = iniciar_peticion()
+    with etapa("intencion"):
+        ...
+    anotar("intencion_tokens_entrada", 1234)
+    tiempos.resumen()   # {"etapas_ms": {...}, "datos": {...}}
+"""
+import os
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+# Buckets pensados para latencias de LLM/BBDD (de 1ms a 30s)
+_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+ETAPA_SEGUNDOS = Histogram(
+    "kairo_etapa_segundos", "Duración de cada etapa de /consulta", ["etapa"], buckets=_BUCKETS,
+)
+TOKENS = Counter(
+    "kairo_llm_tokens", "Tokens consumidos en Groq", ["llamada", "tipo"],
+)
+FILAS = Histogram(
+    "kairo_filas_resultado", "Filas devueltas por consulta",
+    buckets=(0, 1, 10, 50, 100, 500, 1000, 5000, 10000),
+)
+
+_tiempos_actual = ContextVar("kairo_tiempos", default=None)
+
+
+class Tiempos:
+    """Tiempos y datos (tokens, filas...) acumulados durante una petición."""
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.etapas = {}
+        self.datos = {}
+
+    def sumar(self, nombre, segundos):
+        self.etapas[nombre] = self.etapas.get(nombre, 0.0) + segundos
+
+    def resumen(self):
+        return {
+            "total_ms": round(1000 * (time.perf_counter() - self.inicio), 3),
+            "etapas_ms": {k: round(1000 * v, 3) for k, v in self.etapas.items()},
+            "datos": dict(self.datos),
+        }
+
+    def server_timing(self):
+        # Cabecera estándar Server-Timing (la ven las devtools del navegador)
+        return ", ".join(f"{k};dur={1000 * v:.1f}" for k, v in self.etapas.items())
+
+
+def iniciar_peticion():
+    tiempos = Tiempos()
+    _tiempos_actual.set(tiempos)
+    return tiempos
+
+
+def tiempos_actuales():
+    return _tiempos_actual.get()
+
+
+@contextmanager
+def etapa(nombre):
+    """Mide un bloque: lo suma a la petición en curso y al histograma de Prometheus."""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        medir(nombre, time.perf_counter() - inicio)
+
+
+def medir(nombre, segundos):
+    """Igual que `etapa` pero con una duración ya medida."""
+    ETAPA_SEGUNDOS.labels(nombre).observe(segundos)
+    tiempos = _tiempos_actual.get()
+    if tiempos is not None:
+        tiempos.sumar(nombre, segundos)
+
+
+def anotar(clave, valor):
+    tiempos = _tiempos_actual.get()
+    if tiempos is not None:
+        tiempos.datos[clave] = valor
+
+
+def registrar_tokens(llamada, usage):
+    """Apunta los tokens de una respuesta de Groq (completion.usage)."""
+    if usage is None:
+        return
+    entrada = getattr(usage, "prompt_tokens", None) or 0
+    salida = getattr(usage, "completion_tokens", None) or 0
+    TOKENS.labels(llamada, "entrada").inc(entrada)
+    TOKENS.labels(llamada, "salida").inc(salida)
+    anotar(f"{llamada}_tokens_entrada", entrada)
+    anotar(f"{llamada}_tokens_salida", salida)
+
+
+def registrar_filas(n):
+    FILAS.observe(n)
+    anotar("filas", n)
+
+
+# Lo que no puede ir en un nombre de métrica de Prometheus
+_NO_VALIDO = re.compile(r"[^a-zA-Z0-9_:]")
+
+
+class _ColectorEstadisticas:
+    """
+    Publica como gauges los contadores que ya exponen los componentes (pool, cachés, logs...).
+    Cada fuente es una función que devuelve un dict de números (los dicts anidados se aplanan).
+    Las claves que no son fijas (modelo, rollup, prioridad...) no forman parte del nombre:
+    van en una etiqueta, ver `registrar_fuente`.
+    """
+
+    def __init__(self):
+        self.fuentes = {}
+
+    def collect(self):
+        for nombre, (fuente, etiquetas) in list(self.fuentes.items()):
+            # Toda la fuente o nada: una clave rara no tumba el resto de /metrics
+            try:
+                familias = {}
+                for clave, valor, etiqueta in _planos(fuente(), etiquetas):
+                    metrica = _NO_VALIDO.sub("_", "_".join(p for p in ("kairo", nombre, clave) if p))
+                    familia = familias.get(metrica)
+                    if familia is None:
+                        familia = familias[metrica] = GaugeMetricFamily(
+                            metrica, f"{nombre}: {clave}", labels=[e for e, _ in etiqueta],
+                        )
+                    familia.add_metric([v for _, v in etiqueta], float(valor))
+            except Exception:
+                continue
+            yield from familias.values()
+
+
+def _planos(datos, etiquetas, ruta=(), partes=(), valores=()):
+    # (nombre, número, ((etiqueta, valor), ...)) por cada número de `datos`
+    etiqueta = etiquetas.get(".".join(ruta))
+    for clave, valor in datos.items():
+        if etiqueta:
+            siguiente = (ruta + ("*",), partes, valores + ((etiqueta, str(clave)),))
+        else:
+            siguiente = (ruta + (str(clave),), partes + (str(clave),), valores)
+        if isinstance(valor, bool):
+            valor = int(valor)
+        if isinstance(valor, (int, float)):
+            yield "_".join(siguiente[1]), valor, siguiente[2]
+        elif isinstance(valor, dict):
+            yield from _planos(valor, etiquetas, *siguiente)
+
+
+_colector = _ColectorEstadisticas()
+REGISTRY.register(_colector)
+
+
+def registrar_fuente(nombre, fuente, etiquetas=None):
+    """
+    `etiquetas` = {ruta: etiqueta} para los dicts cuyas claves son datos y no nombres:
+    la ruta son las claves fijas hasta ese dict separadas por "." ("" = el dict de la
+    fuente; tras una clave ya convertida en etiqueta va "*"). Por ejemplo
+    {"cupo": "modelo"} publica kairo_llm_cupo_tokens{modelo="..."}.
+    """
+    _colector.fuentes[nombre] = (fuente, etiquetas or {})
+
+
+def exportar():
+    """Cuerpo y content-type para el endpoint /metrics."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        # Con varios workers de gunicorn cada proceso escribe en el directorio compartido
+        from prometheus_client import multiprocess
+        registro = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registro)
+        registro.register(_colector)
+        return generate_latest(registro), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,91 @@
+import base64
+import hashlib
+import hmac
+import json
+import re
+import time
+
+from validacion_sql import sql_ejecutable
+
+
+class TokenInvalido(Exception):
+    """Token de continuación manipulado, caducado o mal formado."""
+
+
+def limitar_sql(sql, limite, offset=0):
+    """
+    Envuelve el SQL generado para que PostgreSQL nunca devuelva más de `limite` filas.
+    Pedimos una fila de más para saber si el resultado queda truncado.
+
+    Se envuelve la sentencia regenerada por sqlglot: un "-- comentario" o un ";" al final
+    del SQL del LLM acabarían dentro del paréntesis. Las páginas siguientes repiten la
+    consulta con OFFSET: si el SQL no tiene ORDER BY, PostgreSQL no garantiza el mismo
+    orden entre ejecuciones y una página puede repetir o saltarse filas.
+    """
+    limpio = sql_ejecutable(sql)
+    if limpio is None:
+        limpio = re.sub(r"[\s;]+$", "", sql.strip())
+    # El salto de línea antes del ")" por si queda un comentario de línea al final
+    envuelto = f"SELECT * FROM ({limpio}\n) AS kairo_sub LIMIT {int(limite) + 1}"
+    if offset:
+        envuelto += f" OFFSET {int(offset)}"
+    return envuelto
+
+
+def tamano_fila(fila):
+    # Estimación barata del peso en JSON, sin serializar de verdad
+    return sum(len(str(v)) + 4 for v in fila) + 2
+
+
+class Presupuesto:
+    """Lleva la cuenta de filas y bytes acumulados frente a los límites."""
+
+    def __init__(self, max_filas, max_bytes):
+        self.max_filas = max_filas
+        self.max_bytes = max_bytes
+        self.filas = 0
+        self.bytes = 0
+
+    def admite(self, fila):
+        if self.filas >= self.max_filas:
+            return False
+        peso = tamano_fila(fila)
+        # Siempre dejamos pasar al menos una fila aunque sea enorme
+        if self.max_bytes and self.filas and self.bytes + peso > self.max_bytes:
+            return False
+        self.filas += 1
+        self.bytes += peso
+        return True
+
+
+def _b64(datos):
+    return base64.urlsafe_b64encode(datos).rstrip(b"=").decode()
+
+
+def _desb64(texto):
+    return base64.urlsafe_b64decode(texto + "=" * (-len(texto) % 4))
+
+
+def crear_token(secreto, sql, offset):
+    """Token firmado (HMAC) para pedir la siguiente página de un resultado."""
+    cuerpo = _b64(json.dumps({"sql": sql, "offset": offset, "ts": int(time.time())}).encode())
+    firma = _b64(hmac.new(secreto, cuerpo.encode(), hashlib.sha256).digest())
+    return f"{cuerpo}.{firma}"
+
+
+def leer_token(secreto, token, ttl=3600):
+    """Devuelve (sql, offset). Sin una firma válida nunca ejecutamos el SQL del token."""
+    try:
+        cuerpo, firma = token.split(".", 1)
+        esperada = _b64(hmac.new(secreto, cuerpo.encode(), hashlib.sha256).digest())
+        if not hmac.compare_digest(firma, esperada):
+            raise TokenInvalido("Firma no válida")
+        datos = json.loads(_desb64(cuerpo))
+    except TokenInvalido:
+        raise
+    except Exception:
+        raise TokenInvalido("Token mal formado")
+
+    if ttl and time.time() - datos.get("ts", 0) > ttl:
+        raise TokenInvalido("Token caducado")
+    return datos["sql"], int(datos["offset"])
@@ -0,0 +1,379 @@
+"""
+Planificador de llamadas a Groq.
+
+- Cupo por modelo (peticiones y tokens por minuto) leído de las cabeceras x-ratelimit-*
+  de cada respuesta: si no queda cupo se espera a que se reponga en vez de recibir un 429.
+- Cola con prioridad: las preguntas interactivas pasan antes que las de /consulta/lote.
+- Reintentos con espera exponencial aleatoria (respetando retry-after) dentro del plazo
+  de la petición, que se propaga a cada intento como timeout.
+- Si el modelo principal está saturado se usa un modelo de respaldo más pequeño.
+"""
+import asyncio
+import functools
+import heapq
+import itertools
+import random
+import re
+import threading
+import time
+from contextvars import ContextVar
+
+from metricas import anotar, medir
+
+INTERACTIVA = 0
+LOTE = 1
+_NOMBRES_PRIORIDAD = {INTERACTIVA: "interactiva", LOTE: "lote"}
+
+
+@functools.lru_cache(maxsize=None)
+def _reintentables():
+    # Errores que merece la pena reintentar (429, timeouts, red y 5xx). groq se importa
+    # aquí y no al cargar el módulo: solo hace falta cuando ya hay un cliente creado
+    import groq
+    return (groq.RateLimitError, groq.APITimeoutError, groq.APIConnectionError, groq.InternalServerError)
+
+
+_plazo_actual = ContextVar("kairo_plazo_llm", default=None)
+
+
+class PlazoAgotado(Exception):
+    """No ha dado tiempo a hacer la llamada antes del plazo de la petición."""
+
+
+def fijar_plazo(segundos):
+    """Plazo (en segundos desde ahora) para todas las llamadas a Groq de la petición en curso."""
+    _plazo_actual.set(time.monotonic() + segundos if segundos else None)
+
+
+def _duracion(texto):
+    # Formato de Groq para los reset: "2m59.56s", "7.66s", "120ms"
+    if not texto:
+        return None
+    try:
+        return float(texto)
+    except ValueError:
+        pass
+    unidades = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+    partes = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", texto)
+    return sum(float(n) * unidades[u] for n, u in partes) if partes else None
+
+
+def _estimar_tokens(mensajes, max_tokens=None):
+    # ~4 caracteres por token más lo que pueda ocupar la respuesta
+    return sum(len(m.get("content") or "") for m in mensajes) // 4 + (max_tokens or 512)
+
+
+class _Cupo:
+    """Peticiones y tokens restantes de un modelo hasta su próximo reset."""
+
+    def __init__(self):
+        self.peticiones = None     # None = desconocido (o ya repuesto)
+        self.tokens = None
+        self.reset_peticiones = 0.0
+        self.reset_tokens = 0.0
+        self.bloqueado_hasta = 0.0
+
+    def actualizar(self, cabeceras):
+        ahora = time.monotonic()
+        peticiones = cabeceras.get("x-ratelimit-remaining-requests")
+        tokens = cabeceras.get("x-ratelimit-remaining-tokens")
+        if peticiones is not None:
+            self.peticiones = int(float(peticiones))
+            self.reset_peticiones = ahora + (_duracion(cabeceras.get("x-ratelimit-reset-requests")) or 60)
+        if tokens is not None:
+            self.tokens = int(float(tokens))
+            self.reset_tokens = ahora + (_duracion(cabeceras.get("x-ratelimit-reset-tokens")) or 60)
+
+    def bloquear(self, segundos):
+        self.bloqueado_hasta = max(self.bloqueado_hasta, time.monotonic() + segundos)
+
+    def espera(self, tokens):
+        """Segundos hasta que haya cupo para una llamada de `tokens` tokens (0 = ya)."""
+        ahora = time.monotonic()
+        if self.peticiones is not None and ahora >= self.reset_peticiones:
+            self.peticiones = None
+        if self.tokens is not None and ahora >= self.reset_tokens:
+            self.tokens = None
+        espera = max(0.0, self.bloqueado_hasta - ahora)
+        if self.peticiones is not None and self.peticiones < 1:
+            espera = max(espera, self.reset_peticiones - ahora)
+        if self.tokens is not None and self.tokens < tokens:
+            espera = max(espera, self.reset_tokens - ahora)
+        return espera
+
+    def consumir(self, tokens):
+        if self.peticiones is not None:
+            self.peticiones -= 1
+        if self.tokens is not None:
+            self.tokens -= tokens
+
+
+class PlanificadorLLM:
+    """
+    Envuelve `client.chat.completions.create` (cliente Groq o AsyncGroq con max_retries=0).
+
+    - `modelo_respaldo`: modelo a usar si el principal tiene que esperar más de `umbral_respaldo` s.
+    - `max_concurrencia`: llamadas a la vez en este proceso.
+    - `reintentos`, `espera_base`, `espera_max`: reintentos con backoff exponencial aleatorio.
+    - `plazo`: segundos por defecto si la petición no fijó plazo con `fijar_plazo`.
+    - `crear_cliente`: si `cliente` es None, función que lo crea en la primera llamada
+      (el import de groq y su cliente HTTP no retrasan el arranque).
+    """
+
+    def __init__(self, cliente, modelo, modelo_respaldo=None, max_concurrencia=8, reintentos=3,
+                 espera_base=0.5, espera_max=8.0, umbral_respaldo=2.0, plazo=60.0, crear_cliente=None):
+        self._cliente = cliente
+        self._crear_cliente = crear_cliente
+        self.modelo = modelo
+        self.modelo_respaldo = modelo_respaldo
+        self.max_concurrencia = max(1, max_concurrencia)
+        self.reintentos = reintentos
+        self.espera_base = espera_base
+        self.espera_max = espera_max
+        self.umbral_respaldo = umbral_respaldo
+        self.plazo = plazo
+
+        self._cupos = {}
+        self._cola = []
+        self._turnos = itertools.count()
+        self._en_curso = 0
+        self._lock = threading.RLock()   # reentrante: las métricas se apuntan con la cola bloqueada
+        self._cond = threading.Condition(self._lock)
+        self._cond_async = None
+
+        self._llamadas = {}   # prioridad -> (llamadas, espera total, espera máx)
+        self._reintentos = 0
+        self._fallos = 0
+        self._respaldo = 0
+        self._plazos_agotados = 0
+
+    @property
+    def cliente(self):
+        if self._cliente is None and self._crear_cliente is not None:
+            with self._lock:
+                if self._cliente is None:
+                    self._cliente = self._crear_cliente()
+        return self._cliente
+
+    @cliente.setter
+    def cliente(self, cliente):
+        # None = se vuelve a crear en la próxima llamada (p.ej. tras un fork)
+        self._cliente = cliente
+
+    def _cupo(self, modelo):
+        cupo = self._cupos.get(modelo)
+        if cupo is None:
+            cupo = self._cupos[modelo] = _Cupo()
+        return cupo
+
+    # ----------------------
+    # Decisiones comunes
+    # ----------------------
+    def _elegir_modelo(self, tokens):
+        # Solo se cambia de modelo si el principal obliga a esperar y el respaldo tiene cupo
+        if not self.modelo_respaldo:
+            return self.modelo
+        with self._lock:
+            principal = self._cupo(self.modelo).espera(tokens)
+            respaldo = self._cupo(self.modelo_respaldo).espera(tokens)
+        if principal > self.umbral_respaldo and respaldo < principal:
+            return self.modelo_respaldo
+        return self.modelo
+
+    def _puede_entrar(self, turno, modelo, tokens):
+        """Con el lock cogido: None si entra ya; si no, segundos a esperar (0 = hasta aviso)."""
+        if self._cola[0] != turno or self._en_curso >= self.max_concurrencia:
+            return 0
+        espera = self._cupo(modelo).espera(tokens)
+        if espera > 0:
+            return espera
+        heapq.heappop(self._cola)
+        self._en_curso += 1
+        self._cupo(modelo).consumir(tokens)
+        return None
+
+    def _salir_de_cola(self, turno):
+        if turno in self._cola:
+            self._cola.remove(turno)
+            heapq.heapify(self._cola)
+
+    def _registrar_espera(self, prioridad, llamada, segundos):
+        with self._lock:
+            n, total, maximo = self._llamadas.get(prioridad, (0, 0.0, 0.0))
+            self._llamadas[prioridad] = (n + 1, total + segundos, max(maximo, segundos))
+        medir("llm_cola", segundos)
+        anotar(f"{llamada}_cola_ms", round(1000 * segundos, 3))
+
+    def _espera_reintento(self, intento, error):
+        espera = random.uniform(0, min(self.espera_max, self.espera_base * 2 ** intento))
+        respuesta = getattr(error, "response", None)
+        retry_after = _duracion(respuesta.headers.get("retry-after")) if respuesta is not None else None
+        return max(espera, retry_after or 0)
+
+    def _tras_error(self, modelo, error, intento, plazo):
+        """Decide si se reintenta. Devuelve (segundos a esperar, modelo siguiente) o lanza el error."""
+        if not isinstance(error, _reintentables()) or intento >= self.reintentos:
+            with self._lock:
+                self._fallos += 1
+            raise error
+        espera = self._espera_reintento(intento, error)
+        if isinstance(error, _reintentables()[0]):   # RateLimitError
+            with self._lock:
+                self._cupo(modelo).bloquear(espera)
+            # Con el principal saturado probamos directamente el respaldo
+            if self.modelo_respaldo and modelo == self.modelo:
+                modelo, espera = self.modelo_respaldo, 0
+        if time.monotonic() + espera >= plazo:
+            with self._lock:
+                self._fallos += 1
+            raise error
+        with self._lock:
+            self._reintentos += 1
+        return espera, modelo
+
+    def _preparar(self, kwargs):
+        plazo = _plazo_actual.get() or time.monotonic() + self.plazo
+        tokens = _estimar_tokens(kwargs.get("messages", []), kwargs.get("max_tokens"))
+        return plazo, tokens
+
+    def _anotar_final(self, llamada, modelo, intentos):
+        if modelo != self.modelo:
+            with self._lock:
+                self._respaldo += 1
+        anotar(f"{llamada}_modelo", modelo)
+        anotar(f"{llamada}_reintentos", intentos)
+
+    def _plazo_agotado(self):
+        with self._lock:
+            self._plazos_agotados += 1
+        return PlazoAgotado("Sin tiempo para llamar a Groq")
+
+    # ----------------------
+    # Versión síncrona (app.py)
+    # ----------------------
+    def _entrar(self, prioridad, modelo, tokens, plazo):
+        with self._cond:
+            turno = (prioridad, next(self._turnos))
+            heapq.heappush(self._cola, turno)
+            try:
+                while True:
+                    espera = self._puede_entrar(turno, modelo, tokens)
+                    if espera is None:
+                        return
+                    restante = plazo - time.monotonic()
+                    if restante <= 0:
+                        raise self._plazo_agotado()
+                    self._cond.wait(min(espera, restante) if espera else restante)
+            finally:
+                self._salir_de_cola(turno)
+                self._cond.notify_all()
+
+    def _salir(self):
+        with self._cond:
+            self._en_curso -= 1
+            self._cond.notify_all()
+
+    def crear(self, llamada, prioridad=INTERACTIVA, **kwargs):
+        """
+        Igual que `client.chat.completions.create(**kwargs)` (sin `model`, lo elige el planificador).
+        `llamada` ("intencion", "respuesta"...) es solo para métricas. Con stream=True el hueco
+        de concurrencia se libera al recibir las cabeceras, no al terminar el stream.
+        """
+        plazo, tokens = self._preparar(kwargs)
+        modelo = self._elegir_modelo(tokens)
+        intento = 0
+        while True:
+            inicio = time.monotonic()
+            self._entrar(prioridad, modelo, tokens, plazo)
+            self._registrar_espera(prioridad, llamada, time.monotonic() - inicio)
+            try:
+                timeout = max(0.1, plazo - time.monotonic())
+                crudo = self.cliente.chat.completions.with_raw_response.create(
+                    model=modelo, timeout=timeout, **kwargs
+                )
+                with self._lock:
+                    self._cupo(modelo).actualizar(crudo.headers)
+                self._anotar_final(llamada, modelo, intento)
+                return crudo.parse()
+            except Exception as e:
+                espera, modelo = self._tras_error(modelo, e, intento, plazo)
+            finally:
+                self._salir()
+            intento += 1
+            time.sleep(espera)
+
+    # ----------------------
+    # Versión asyncio (app_async.py)
+    # ----------------------
+    async def _entrar_async(self, prioridad, modelo, tokens, plazo):
+        if self._cond_async is None:
+            self._cond_async = asyncio.Condition()
+        async with self._cond_async:
+            turno = (prioridad, next(self._turnos))
+            heapq.heappush(self._cola, turno)
+            try:
+                while True:
+                    espera = self._puede_entrar(turno, modelo, tokens)
+                    if espera is None:
+                        return
+                    restante = plazo - time.monotonic()
+                    if restante <= 0:
+                        raise self._plazo_agotado()
+                    try:
+                        await asyncio.wait_for(self._cond_async.wait(), min(espera, restante) if espera else restante)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                self._salir_de_cola(turno)
+                self._cond_async.notify_all()
+
+    async def _salir_async(self):
+        async with self._cond_async:
+            self._en_curso -= 1
+            self._cond_async.notify_all()
+
+    async def crear_async(self, llamada, prioridad=INTERACTIVA, **kwargs):
+        plazo, tokens = self._preparar(kwargs)
+        modelo = self._elegir_modelo(tokens)
+        intento = 0
+        while True:
+            inicio = time.monotonic()
+            await self._entrar_async(prioridad, modelo, tokens, plazo)
+            self._registrar_espera(prioridad, llamada, time.monotonic() - inicio)
+            try:
+                timeout = max(0.1, plazo - time.monotonic())
+                crudo = await self.cliente.chat.completions.with_raw_response.create(
+                    model=modelo, timeout=timeout, **kwargs
+                )
+                self._cupo(modelo).actualizar(crudo.headers)
+                self._anotar_final(llamada, modelo, intento)
+                return await crudo.parse()
+            except Exception as e:
+                espera, modelo = self._tras_error(modelo, e, intento, plazo)
+            finally:
+                await self._salir_async()
+            intento += 1
+            await asyncio.sleep(espera)
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "en_curso": self._en_curso,
+                "en_cola": len(self._cola),
+                "reintentos": self._reintentos,
+                "fallos": self._fallos,
+                "respaldo": self._respaldo,
+                "plazos_agotados": self._plazos_agotados,
+                "cola": {
+                    _NOMBRES_PRIORIDAD.get(p, str(p)): {
+                        "llamadas": n,
+                        "espera_media_ms": round(1000 * total / n, 3),
+                        "espera_max_ms": round(1000 * maximo, 3),
+                    }
+                    for p, (n, total, maximo) in self._llamadas.items()
+                },
+                "cupo": {
+                    modelo: {"peticiones": c.peticiones, "tokens": c.tokens}
+                    for modelo, c in self._cupos.items()
+                },
+            }
@@ -0,0 +1,120 @@
+import decimal
+import math
+import threading
+
+from formatos import valor_json
+
+# Estrategias para la respuesta en lenguaje natural:
+# - "llm": siempre se resume con Groq (comportamiento original).
+# - "plantilla": frase generada en local; si no hay plantilla aplicable, frase genérica.
+# - "auto": plantilla para resultados vacíos, escalares o pequeños; Groq para el resto.
+# - "ninguna": el cliente solo quiere datos o gráfico, no hay segunda llamada.
+ESTRATEGIAS = ("auto", "llm", "plantilla", "ninguna")
+
+
+def _numero(v):
+    # Formato español: 1.234,5
+    if isinstance(v, bool):
+        return "sí" if v else "no"
+    if isinstance(v, decimal.Decimal):
+        v = float(v)
+    if isinstance(v, int):
+        return f"{v:,}".replace(",", ".")
+    if isinstance(v, float):
+        decimales = 2
+        if v == 0:
+            v = 0.0   # sin "-0"
+        elif abs(v) < 1:
+            # Tres cifras significativas: 0,004 y no 0
+            decimales = 2 - math.floor(math.log10(abs(v)))
+        texto = f"{v:,.{decimales}f}".rstrip("0").rstrip(".")
+        return texto.replace(",", "_").replace(".", ",").replace("_", ".")
+    return str(valor_json(v)) if v is not None else "sin dato"
+
+
+def _es_numero(v):
+    return isinstance(v, (int, float, decimal.Decimal)) and not isinstance(v, bool)
+
+
+def _legible(columna):
+    return columna.replace("_", " ")
+
+
+def respuesta_plantilla(resultado, max_filas=10):
+    """
+    Frase determinista para resultados simples. Devuelve None si no hay plantilla que encaje.
+    """
+    columnas = resultado["columns"]
+    filas = resultado["rows"]
+
+    if not filas:
+        return "No he encontrado información que responda a tu pregunta."
+
+    if len(filas) == 1 and len(columnas) == 1:
+        return f"El resultado es {_numero(filas[0][0])} ({_legible(columnas[0])})."
+
+    if len(filas) == 1:
+        partes = [f"{_legible(c)}: {_numero(v)}" for c, v in zip(columnas, filas[0])]
+        return "He encontrado un único resultado: " + ", ".join(partes) + "."
+
+    # Etiqueta + valor numérico (el típico "ventas por categoría")
+    if len(columnas) == 2 and len(filas) <= max_filas and all(_es_numero(f[1]) or f[1] is None for f in filas):
+        etiqueta, medida = columnas
+        partes = [f"{_numero(f[0])} ({_numero(f[1])})" for f in filas]
+        con_valor = [f for f in filas if f[1] is not None]
+        texto = f"{_legible(medida).capitalize()} por {_legible(etiqueta)}: " + "; ".join(partes) + "."
+        if con_valor:
+            mayor = max(con_valor, key=lambda f: f[1])
+            menor = min(con_valor, key=lambda f: f[1])
+            texto += f" El valor más alto es {_numero(mayor[0])} con {_numero(mayor[1])}"
+            texto += f" y el más bajo {_numero(menor[0])} con {_numero(menor[1])}."
+        return texto
+
+    return None
+
+
+def elegir_estrategia(pedida, por_defecto="auto"):
+    pedida = (pedida or por_defecto or "auto").lower()
+    return pedida if pedida in ESTRATEGIAS else "auto"
+
+
+class LatenciaEstrategias:
+    """Número de respuestas y latencia acumulada por estrategia usada."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._datos = {}
+
+    def registrar(self, estrategia, segundos):
+        with self._lock:
+            n, total, maximo = self._datos.get(estrategia, (0, 0.0, 0.0))
+            self._datos[estrategia] = (n + 1, total + segundos, max(maximo, segundos))
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                e: {"respuestas": n, "media_ms": round(1000 * total / n, 3), "max_ms": round(1000 * maximo, 3)}
+                for e, (n, total, maximo) in self._datos.items()
+            }
+
+
+
+def respuesta_local(resultado, estrategia, max_filas=10):
+    """
+    Resuelve la estrategia sin red. Devuelve (texto, estrategia_usada);
+    si la estrategia usada es "llm" el texto es None y hay que pedírselo a Groq.
+    """
+    if estrategia == "ninguna":
+        return None, "ninguna"
+    if estrategia == "llm":
+        return None, "llm"
+
+    texto = respuesta_plantilla(resultado, max_filas)
+    if texto is not None:
+        return texto, "plantilla"
+    if estrategia == "plantilla":
+        n = len(resultado["rows"])
+        parcial = " (resultado parcial)" if resultado.get("truncated") else ""
+        return f"He encontrado {_numero(n)} filas{parcial}. Puedes consultarlas en la tabla.", "plantilla"
+    # "auto" con un resultado grande: aquí el resumen del LLM sí aporta
+    return None, "llm"
@@ -0,0 +1,136 @@
+"""
+Resumen compacto de un resultado para el prompt de la respuesta en lenguaje natural.
+
+En vez de mandar el repr de la lista de dicts cortado a 2000 caracteres (filas partidas
+y los nombres de columna repetidos en cada fila), se construye un texto que cabe en un
+presupuesto de tokens:
+
+- Si todas las filas caben, van enteras en CSV.
+- Si no, estadísticas por columna (mín/máx/media/suma de los números, rango de fechas,
+  valores más frecuentes del texto) y tantas filas de muestra como quepan: las primeras
+  (respetan el ORDER BY) y las de los extremos de cada columna numérica.
+"""
+import csv
+import decimal
+import io
+import re
+from collections import Counter
+
+from formatos import tipos_columnas, valor_json
+
+# Aproximación local al tokenizador: palabras cortas ~1 token, largas ~1 token cada 4 caracteres
+_PIEZA = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+
+def estimar_tokens(texto):
+    return sum(max(1, (len(p) + 3) // 4) for p in _PIEZA.findall(texto))
+
+
+def _fmt(v, max_texto=60):
+    if v is None:
+        return ""
+    if isinstance(v, bool):
+        return "sí" if v else "no"
+    if isinstance(v, decimal.Decimal):
+        v = valor_json(v)
+    if isinstance(v, float):
+        # Sin notación científica para importes grandes; dos decimales bastan para resumir
+        return f"{v:.2f}".rstrip("0").rstrip(".") if abs(v) >= 1 else f"{v:.4g}"
+    if isinstance(v, int):
+        return str(v)
+    texto = v if isinstance(v, str) else str(valor_json(v))
+    return texto if len(texto) <= max_texto else texto[:max_texto - 1] + "…"
+
+
+def _csv(filas):
+    salida = io.StringIO()
+    escritor = csv.writer(salida, lineterminator="\n")
+    for fila in filas:
+        escritor.writerow(fila)
+    return salida.getvalue()
+
+
+def _numero(v):
+    return float(v) if isinstance(v, (int, float, decimal.Decimal)) and not isinstance(v, bool) else None
+
+
+def _estadistica(nombre, tipo, valores, top_k):
+    no_nulos = [v for v in valores if v is not None]
+    nulos = len(valores) - len(no_nulos)
+    extra = f"; nulos {nulos}" if nulos else ""
+    if not no_nulos:
+        return f"- {nombre}: sin valores"
+    if tipo == "number":
+        numeros = [_numero(v) for v in no_nulos]
+        media = sum(numeros) / len(numeros)
+        return (f"- {nombre}: mín {_fmt(min(numeros))}; máx {_fmt(max(numeros))}; "
+                f"media {_fmt(media)}; suma {_fmt(sum(numeros))}{extra}")
+    if tipo in ("date", "datetime"):
+        return f"- {nombre}: desde {_fmt(min(no_nulos))} hasta {_fmt(max(no_nulos))}{extra}"
+    frecuentes = Counter(_fmt(v) for v in no_nulos)
+    comunes = ", ".join(f"{v} ({n})" for v, n in frecuentes.most_common(top_k))
+    return f"- {nombre}: {len(frecuentes)} valores distintos; más frecuentes: {comunes}{extra}"
+
+
+def _indices_muestra(resultado, tipos):
+    """Orden de preferencia de las filas de muestra: primeras filas intercaladas con extremos."""
+    filas = resultado["rows"]
+    extremos = []
+    for i, tipo in enumerate(tipos):
+        if tipo != "number":
+            continue
+        con_valor = [(n, _numero(f[i])) for n, f in enumerate(filas) if _numero(f[i]) is not None]
+        if con_valor:
+            extremos.append(max(con_valor, key=lambda x: x[1])[0])
+            extremos.append(min(con_valor, key=lambda x: x[1])[0])
+    vistos = set()
+    for n in [j for par in zip(range(len(filas)), extremos) for j in par] + list(range(len(filas))):
+        if n not in vistos:
+            vistos.add(n)
+            yield n
+
+
+def resumir_resultado(resultado, max_tokens=800, top_k=5):
+    """Texto con los datos de `resultado` ({"columns", "rows", "truncated"}) en ~`max_tokens` tokens."""
+    columnas = resultado["columns"]
+    filas = resultado["rows"]
+    tipos = tipos_columnas(resultado)
+
+    parcial = " (resultado parcial: la consulta devuelve más filas)" if resultado.get("truncated") else ""
+    cabecera = (f"Filas: {len(filas)}{parcial}\n"
+                f"Columnas: " + ", ".join(f"{c} ({t})" for c, t in zip(columnas, tipos)) + "\n")
+    if not filas:
+        return cabecera + "Sin datos.\n"
+
+    filas_texto = [[_fmt(v) for v in fila] for fila in filas]
+    completo = cabecera + "Datos (CSV):\n" + _csv([columnas] + filas_texto)
+    if estimar_tokens(completo) <= max_tokens:
+        return completo
+
+    # No caben todas: estadísticas primero, luego muestra hasta agotar el presupuesto
+    partes = [cabecera, "Estadísticas de las filas obtenidas:\n"]
+    usados = estimar_tokens("".join(partes))
+    for i, (nombre, tipo) in enumerate(zip(columnas, tipos)):
+        linea = _estadistica(nombre, tipo, [f[i] for f in filas], top_k) + "\n"
+        coste = estimar_tokens(linea)
+        if usados + coste > max_tokens:
+            break
+        partes.append(linea)
+        usados += coste
+
+    titulo = "Filas de muestra (CSV, primeras y extremos):\n" + _csv([columnas])
+    usados += estimar_tokens(titulo) + estimar_tokens(f"({len(filas)} de {len(filas)} filas)\n")
+    muestra = []
+    for n in _indices_muestra(resultado, tipos):
+        linea = _csv([filas_texto[n]])
+        coste = estimar_tokens(linea)
+        if usados + coste > max_tokens:
+            break
+        muestra.append((n, linea))
+        usados += coste
+    if muestra:
+        partes.append(titulo)
+        # Se mantienen en el orden original del resultado
+        partes.extend(linea for _, linea in sorted(muestra))
+        partes.append(f"({len(muestra)} de {len(filas)} filas)\n")
+    return "".join(partes)
@@ -0,0 +1,578 @@
+"""
+Rollups: agregados precalculados de `transacciones` para las preguntas más habituales.
+
+Casi todas las preguntas son sumas, recuentos o medias de transacciones por categoría,
+producto, método de pago, mes o país/ciudad del cliente, y cada una recorre la tabla de
+hechos entera. Aquí se definen vistas materializadas con esos agregados (una fila por
+mes y combinación de dimensiones) y se reescribe el SQL generado para leerlas cuando la
+consulta se puede responder EXACTAMENTE con ellas:
+
+- Un único SELECT con agregados sobre `transacciones`, opcionalmente con JOIN a
+  `clientes` por id_cliente. Sin subconsultas, CTEs, DISTINCT, FILTER ni ventanas.
+- Agrupaciones y filtros sobre columnas de dimensión. La fecha, solo por mes, trimestre
+  o año (date_trunc / EXTRACT) o con rangos `>=` / `<` contra el día 1 de un mes (exactos
+  sea fecha_compra DATE o timestamp; `<=`, `>` y BETWEEN contra el último día no lo son).
+- COUNT(*), COUNT/SUM/AVG/MIN/MAX de las medidas y COUNT(DISTINCT dimensión).
+
+Si algo no encaja se ejecuta el SQL original. Las vistas viven en su propio esquema
+(fuera del índice del esquema: el LLM no las ve) y las refresca un usuario con permisos
+de escritura, desde cron o desde la propia API (ROLLUPS_REFRESCO en app.py):
+
+    ROLLUPS_DSN=postgresql://kairo_admin@host/db python rollups.py --crear --lector kairo
+    ROLLUPS_DSN=postgresql://kairo_admin@host/db python rollups.py --refrescar
+
+Cada refresco queda apuntado en kairo_rollups.estado; la API solo usa rollups con
+menos de `max_antiguedad` segundos y devuelve cuál respondió y de cuándo son sus datos.
+"""
+import argparse
+import functools
+import os
+import threading
+import time
+from datetime import date, datetime, timezone
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
+
+ESQUEMA = "kairo_rollups"
+
+# Medidas de transacciones. True = entera (SUM devuelve bigint y hay que conservarlo)
+MEDIDAS = {
+    "importe_total": False,
+    "cantidad": True,
+    "precio_unitario": False,
+    "coste_envio": False,
+    "coste_fabricacion": False,
+}
+
+# Columnas de dimensión del rollup y cómo se calculan (t = transacciones, c = clientes)
+DIMENSIONES = {
+    "mes_compra": "date_trunc('month', t.fecha_compra)::date",
+    "categoria_producto": "t.categoria_producto",
+    "producto": "t.producto",
+    "metodo_pago": "t.metodo_pago",
+    "pais": "c.pais",
+    "ciudad": "c.ciudad",
+    "con_cliente": "c.id_cliente IS NOT NULL",   # para responder a los JOIN (inner) con clientes
+}
+
+# Tabla de origen de cada columna que se puede reescribir
+_ORIGEN = {
+    "fecha_compra": "transacciones",
+    "categoria_producto": "transacciones",
+    "producto": "transacciones",
+    "metodo_pago": "transacciones",
+    "pais": "clientes",
+    "ciudad": "clientes",
+    **{m: "transacciones" for m in MEDIDAS},
+}
+_DIMENSIONES_DIRECTAS = {"categoria_producto", "producto", "metodo_pago", "pais", "ciudad"}
+_UNIDADES_MES = {"MONTH", "QUARTER", "YEAR"}
+
+_COLUMNAS_ROLLUP = set(DIMENSIONES) | {"n_filas"} | {
+    f"{prefijo}_{m}" for m in MEDIDAS for prefijo in ("suma", "n", "min", "max")
+}
+
+_MARCA = "kairo_rollup_destino"   # tabla provisional en el SQL reescrito
+_CANDADO = 72_551_309             # pg_advisory_lock: un solo refresco a la vez
+
+
+class Rollup:
+    def __init__(self, nombre, dimensiones):
+        self.nombre = nombre
+        self.dimensiones = tuple(dimensiones)
+        self.con_clientes = any(DIMENSIONES[d].startswith("c.") for d in self.dimensiones)
+
+    @property
+    def tabla(self):
+        return f"{ESQUEMA}.{self.nombre}"
+
+    def cubre(self, dimensiones):
+        return set(dimensiones) <= set(self.dimensiones)
+
+    def ddl(self):
+        dimensiones = ",\n    ".join(f"{DIMENSIONES[d]} AS {d}" for d in self.dimensiones)
+        medidas = ",\n    ".join(
+            f"SUM(t.{m}) AS suma_{m}, COUNT(t.{m}) AS n_{m}, MIN(t.{m}) AS min_{m}, MAX(t.{m}) AS max_{m}"
+            for m in MEDIDAS
+        )
+        # LEFT JOIN: las transacciones sin cliente también cuentan en las consultas sin JOIN
+        join = "\nLEFT JOIN clientes c ON c.id_cliente = t.id_cliente" if self.con_clientes else ""
+        grupos = ", ".join(str(i) for i in range(1, len(self.dimensiones) + 1))
+        return (
+            f"CREATE MATERIALIZED VIEW IF NOT EXISTS {self.tabla} AS\n"
+            f"SELECT {dimensiones},\n    COUNT(*) AS n_filas,\n    {medidas}\n"
+            f"FROM transacciones t{join}\nGROUP BY {grupos};\n"
+            # REFRESH ... CONCURRENTLY necesita un índice único sin expresiones
+            f"CREATE UNIQUE INDEX IF NOT EXISTS {self.nombre}_dimensiones "
+            f"ON {self.tabla} ({', '.join(self.dimensiones)});\n"
+        )
+
+
+# De menor a mayor: con el mismo estado se prefiere el primero que cubra la consulta
+ROLLUPS = [
+    Rollup("ventas_categoria_mes", ("mes_compra", "categoria_producto", "metodo_pago")),
+    Rollup("ventas_producto_mes", ("mes_compra", "categoria_producto", "producto", "metodo_pago")),
+    Rollup("ventas_cliente_mes", ("mes_compra", "pais", "ciudad", "categoria_producto", "metodo_pago",
+                                  "con_cliente")),
+]
+
+DDL_ESTADO = f"""
+CREATE SCHEMA IF NOT EXISTS {ESQUEMA};
+CREATE TABLE IF NOT EXISTS {ESQUEMA}.estado (
+    nombre text PRIMARY KEY,
+    actualizado timestamptz NOT NULL,
+    filas bigint NOT NULL,
+    segundos double precision NOT NULL
+);
+"""
+
+
+# ======================
+# Reescritura del SQL
+# ======================
+class _NoAplica(Exception):
+    pass
+
+
+def _sql(texto):
+    return sqlglot.parse_one(texto, read="postgres")
+
+
+def _fecha(nodo):
+    # '2024-01-01' o DATE '2024-01-01' -> date; cualquier otra cosa -> None
+    if isinstance(nodo, exp.Cast) and nodo.to.is_type("date"):
+        nodo = nodo.this
+    if isinstance(nodo, exp.Literal) and nodo.is_string:
+        try:
+            return date.fromisoformat(nodo.this)
+        except ValueError:
+            return None
+    return None
+
+
+def _primer_dia(d):
+    return d is not None and d.day == 1
+
+
+_GIRO = {exp.GT: exp.LT, exp.LT: exp.GT, exp.GTE: exp.LTE, exp.LTE: exp.GTE}
+
+
+def _fecha_por_meses(columna):
+    """¿Se puede sustituir fecha_compra por mes_compra en este punto sin cambiar el resultado?"""
+    padre = columna.parent
+    if isinstance(padre, (exp.DateTrunc, exp.TimestampTrunc)):
+        unidad = padre.args.get("unit")
+        return unidad is not None and unidad.name.upper() in _UNIDADES_MES
+    if isinstance(padre, exp.Extract):
+        return padre.this.name.upper() in _UNIDADES_MES
+    tipo = type(padre)
+    if tipo in _GIRO:
+        otro = padre.expression if padre.this is columna else padre.this
+        if padre.this is not columna:
+            tipo = _GIRO[tipo]
+        # Solo fecha >= día 1 / fecha < día 1: con "<= último día" o "> último día" (y
+        # BETWEEN) una fecha_compra timestamp dejaría fuera o dentro parte de ese día
+        return tipo in (exp.GTE, exp.LT) and _primer_dia(_fecha(otro))
+    return False
+
+
+class _Reescritura:
+    def __init__(self, arbol):
+        self.arbol = arbol
+        self.dimensiones = set()
+        self.alias = {}
+        self.salida = {e.alias.lower() for e in arbol.expressions if isinstance(e, exp.Alias)}
+        if self.salida & _COLUMNAS_ROLLUP:
+            # Un alias con el nombre de una columna del rollup cambiaría a qué se refiere GROUP BY
+            raise _NoAplica("alias")
+
+    def tablas(self):
+        for tabla in self.arbol.find_all(exp.Table):
+            if tabla.db.lower() not in ("", "public") or tabla.name.lower() not in ("transacciones", "clientes"):
+                raise _NoAplica("tabla")
+            self.alias[tabla.alias_or_name.lower()] = tabla.name.lower()
+        nombres = sorted(self.alias.values())
+        if nombres == ["transacciones"]:
+            return False
+        if nombres != ["clientes", "transacciones"]:
+            raise _NoAplica("tablas")
+
+        joins = self.arbol.args.get("joins") or []
+        if len(joins) != 1:
+            raise _NoAplica("join")
+        join = joins[0]
+        if join.args.get("side") or (join.args.get("kind") or "").upper() not in ("", "INNER"):
+            raise _NoAplica("tipo de join")
+        using = join.args.get("using")
+        condicion = join.args.get("on")
+        if using:
+            if [u.name.lower() for u in using] != ["id_cliente"]:
+                raise _NoAplica("using")
+        elif not (isinstance(condicion, exp.EQ)
+                  and all(isinstance(c, exp.Column) and c.name.lower() == "id_cliente"
+                          for c in (condicion.this, condicion.expression))
+                  and {self.alias.get(c.table.lower()) for c in (condicion.this, condicion.expression)}
+                  == {"clientes", "transacciones"}):
+            raise _NoAplica("condición de join")
+        return True
+
+    def _origen(self, columna):
+        nombre = columna.name.lower()
+        if columna.table:
+            tabla = self.alias.get(columna.table.lower())
+            if tabla is None or _ORIGEN.get(nombre) != tabla:
+                raise _NoAplica(f"columna {columna.sql()}")
+        elif nombre not in _ORIGEN:
+            raise _NoAplica(f"columna {nombre}")
+        return nombre
+
+    def _medida(self, nodo):
+        if not isinstance(nodo, exp.Column) or self._origen(nodo) not in MEDIDAS:
+            raise _NoAplica("argumento de agregado")
+        return nodo.name.lower()
+
+    def _dimension(self, nombre):
+        if _ORIGEN.get(nombre) == "clientes" and set(self.alias.values()) == {"transacciones"}:
+            raise _NoAplica("columna de clientes sin join")
+        self.dimensiones.add(nombre)
+        return exp.column(nombre)
+
+    def agregado(self, nodo):
+        reescrito = self._agregado(nodo)
+        # Sin alias, PostgreSQL llama a la columna como la función ("count", "avg"...);
+        # la reescritura (COALESCE, división) cambiaría ese nombre
+        if isinstance(nodo.parent, exp.Select) and nodo.arg_key == "expressions":
+            return exp.alias_(reescrito, nodo.key)
+        return reescrito
+
+    def _agregado(self, nodo):
+        arg = nodo.this
+        if isinstance(nodo, exp.Count):
+            if isinstance(arg, exp.Star):
+                return _sql("COALESCE(CAST(SUM(n_filas) AS BIGINT), 0)")
+            if isinstance(arg, exp.Distinct):
+                columnas = arg.expressions
+                if (len(columnas) == 1 and isinstance(columnas[0], exp.Column)
+                        and self._origen(columnas[0]) in _DIMENSIONES_DIRECTAS):
+                    return exp.Count(this=exp.Distinct(expressions=[self._dimension(columnas[0].name.lower())]))
+                raise _NoAplica("COUNT DISTINCT")
+            return _sql(f"COALESCE(CAST(SUM(n_{self._medida(arg)}) AS BIGINT), 0)")
+        if isinstance(nodo, exp.Sum):
+            medida = self._medida(arg)
+            return _sql(f"CAST(SUM(suma_{medida}) AS BIGINT)" if MEDIDAS[medida] else f"SUM(suma_{medida})")
+        if isinstance(nodo, exp.Avg):
+            medida = self._medida(arg)
+            return _sql(f"SUM(suma_{medida}) / NULLIF(SUM(n_{medida}), 0)")
+        if isinstance(nodo, (exp.Min, exp.Max)):
+            funcion = "MIN" if isinstance(nodo, exp.Min) else "MAX"
+            if isinstance(arg, exp.Column) and self._origen(arg) in _DIMENSIONES_DIRECTAS:
+                return exp.func(funcion, self._dimension(arg.name.lower()))
+            return _sql(f"{funcion}({funcion.lower()}_{self._medida(arg)})")
+        raise _NoAplica(f"agregado {nodo.key}")
+
+    def columna(self, nodo):
+        if isinstance(nodo.this, exp.Star):
+            raise _NoAplica("*")
+        nombre = nodo.name.lower()
+        # Alias de salida: en ORDER BY tienen prioridad; en GROUP BY solo si no es una columna
+        if not nodo.table and nombre in self.salida and (nodo.find_ancestor(exp.Order) or nombre not in _ORIGEN):
+            return nodo
+        nombre = self._origen(nodo)
+        if nombre == "fecha_compra":
+            if not _fecha_por_meses(nodo):
+                raise _NoAplica("fecha")
+            return self._dimension("mes_compra")
+        if nombre in _DIMENSIONES_DIRECTAS:
+            return self._dimension(nombre)
+        raise _NoAplica(f"medida {nombre} fuera de un agregado")
+
+    def nodo(self, nodo):
+        if isinstance(nodo, (exp.Filter, exp.Window)):
+            raise _NoAplica(nodo.key)
+        if isinstance(nodo, exp.AggFunc):
+            return self.agregado(nodo)
+        if isinstance(nodo, exp.Column):
+            return self.columna(nodo)
+        return nodo
+
+
+def _planificar(sql):
+    arbol = sqlglot.parse_one(sql, read="postgres")
+    if not isinstance(arbol, exp.Select):
+        raise _NoAplica("no es un SELECT simple")
+    if any(arbol.args.get(a) for a in ("with", "distinct", "into", "locks")):
+        raise _NoAplica("modificadores")
+    if any(s is not arbol for s in arbol.find_all(exp.Select)):
+        raise _NoAplica("subconsulta")
+    if any(isinstance(e, exp.Star) for e in arbol.expressions):
+        raise _NoAplica("*")
+    if not arbol.args.get("group") and arbol.find(exp.AggFunc) is None:
+        raise _NoAplica("sin agregados")
+
+    reescritura = _Reescritura(arbol)
+    con_join = reescritura.tablas()
+
+    # Se quita el JOIN y la tabla pasa a ser el rollup (el nombre definitivo se pone después)
+    arbol.set("joins", None)
+    arbol.find(exp.From).set("this", exp.to_table(_MARCA))
+    arbol = arbol.transform(reescritura.nodo, copy=False)
+    if con_join:
+        reescritura.dimensiones.add("con_cliente")
+        arbol = arbol.where("con_cliente", copy=False)
+    return arbol.sql(dialect="postgres"), frozenset(reescritura.dimensiones)
+
+
+@functools.lru_cache(maxsize=2048)
+def planificar(sql):
+    """(SQL reescrito con la tabla por poner, dimensiones que necesita) o None si no aplica."""
+    try:
+        return _planificar(sql)
+    except (_NoAplica, SqlglotError):
+        return None
+
+
+def reescribir_sql(sql, rollup):
+    """SQL equivalente sobre `rollup`, o None si ese rollup no puede responderlo."""
+    plan = planificar(sql)
+    if plan is None or not rollup.cubre(plan[1]):
+        return None
+    return plan[0].replace(_MARCA, rollup.tabla)
+
+
+# ======================
+# Rutas hacia los rollups (lado de la API)
+# ======================
+class RutaRollups:
+    """
+    Elige el rollup para cada SQL según lo que cubre y lo reciente que es. El estado
+    (fecha del último refresco y filas) se relee cada `intervalo` segundos en un hilo;
+    si algún rollup se ha refrescado desde la lectura anterior se llama a
+    `al_refrescar(nombres)` (p. ej. para invalidar la caché de resultados).
+    """
+
+    def __init__(self, pool, rollups=ROLLUPS, max_antiguedad=3600, intervalo=30, al_refrescar=None):
+        self.pool = pool
+        self.al_refrescar = al_refrescar
+        self.rollups = list(rollups)
+        self.max_antiguedad = max_antiguedad
+        self.intervalo = intervalo
+
+        self._estado = {}   # nombre -> (actualizado, filas)
+        self._lock = threading.Lock()
+        self._hilo = None
+        self._pid = None
+        self._reescritas = {r.nombre: 0 for r in self.rollups}
+        self._no_aplicables = 0
+        self._sin_rollup = 0
+        self._caducados = 0
+        self._errores = 0
+
+    def refrescar_estado(self):
+        with self.pool.conexion() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"SELECT nombre, actualizado, filas FROM {ESQUEMA}.estado")
+                estado = {nombre: (actualizado, filas) for nombre, actualizado, filas in cur.fetchall()}
+        with self._lock:
+            anterior, self._estado = self._estado, estado
+        refrescados = [n for n, (actualizado, _) in estado.items() if n in anterior and anterior[n][0] != actualizado]
+        if refrescados and self.al_refrescar is not None:
+            self.al_refrescar(refrescados)
+
+    def iniciar(self):
+        """Arranca (una vez por proceso) el hilo que relee el estado de los rollups."""
+        if self._pid == os.getpid() and self._hilo is not None:
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._hilo is not None:
+                return
+            self._pid = os.getpid()
+            self._hilo = threading.Thread(target=self._bucle, name="kairo-rollups", daemon=True)
+            self._hilo.start()
+
+    def _bucle(self):
+        while True:
+            try:
+                self.refrescar_estado()
+            except Exception as e:
+                self._errores += 1
+                # Sin esquema kairo_rollups (o sin permiso) simplemente no se reescribe nada
+                print(f"⚠️ Rollups: no se pudo leer el estado ({e})")
+                with self._lock:
+                    self._estado = {}
+            time.sleep(self.intervalo)
+
+    def reescribir(self, sql):
+        """(SQL a ejecutar, {"nombre", "actualizado", "antiguedad_s"} del rollup o None)."""
+        self.iniciar()
+        plan = planificar(sql)
+        if plan is None:
+            self._no_aplicables += 1
+            return sql, None
+        with self._lock:
+            estado = self._estado
+        ahora = datetime.now(timezone.utc)
+        candidatos = sorted(
+            (r for r in self.rollups if r.nombre in estado and r.cubre(plan[1])),
+            key=lambda r: estado[r.nombre][1],
+        )
+        for rollup in candidatos:
+            actualizado, _ = estado[rollup.nombre]
+            antiguedad = (ahora - actualizado).total_seconds()
+            if self.max_antiguedad and antiguedad > self.max_antiguedad:
+                self._caducados += 1
+                continue
+            self._reescritas[rollup.nombre] += 1
+            return plan[0].replace(_MARCA, rollup.tabla), {
+                "nombre": rollup.nombre,
+                "actualizado": actualizado.isoformat(),
+                "antiguedad_s": round(antiguedad, 1),
+            }
+        # Encaja, pero no hay ningún rollup cargado y reciente que lo cubra
+        self._sin_rollup += 1
+        return sql, None
+
+    def estadisticas(self):
+        with self._lock:
+            estado = dict(self._estado)
+        ahora = datetime.now(timezone.utc)
+        return {
+            "disponibles": {
+                nombre: {"filas": filas, "antiguedad_s": round((ahora - actualizado).total_seconds(), 1)}
+                for nombre, (actualizado, filas) in estado.items()
+            },
+            "reescritas": dict(self._reescritas),
+            "no_aplicables": self._no_aplicables,
+            "sin_rollup": self._sin_rollup,
+            "caducados": self._caducados,
+            "errores_estado": self._errores,
+        }
+
+
+# ======================
+# Creación y refresco (usuario con permisos de escritura)
+# ======================
+def crear(conn, rollups=ROLLUPS, lector=None):
+    """Crea el esquema, la tabla de estado y las vistas (vacías hasta el primer refresco)."""
+    with conn.cursor() as cur:
+        cur.execute(DDL_ESTADO)
+        for rollup in rollups:
+            # WITH NO DATA: crear es inmediato; el primer refresco (no concurrente) las llena
+            cur.execute(rollup.ddl().replace(";\n", " WITH NO DATA;\n", 1))
+        if lector:
+            cur.execute(f'GRANT USAGE ON SCHEMA {ESQUEMA} TO "{lector}"')
+            cur.execute(f'GRANT SELECT ON ALL TABLES IN SCHEMA {ESQUEMA} TO "{lector}"')
+    conn.commit()
+
+
+def refrescar(conn, rollups=ROLLUPS, min_antiguedad=0):
+    """
+    Refresca los rollups con más de `min_antiguedad` segundos y apunta la fecha en el estado.
+    REFRESH ... CONCURRENTLY no bloquea las lecturas. Con varios procesos refrescando, solo
+    uno trabaja a la vez (advisory lock); los demás vuelven sin hacer nada.
+    Devuelve {nombre: segundos} de los refrescados.
+    """
+    conn.autocommit = True
+    hechos = {}
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_try_advisory_lock(%s)", (_CANDADO,))
+        if not cur.fetchone()[0]:
+            return hechos
+        try:
+            cur.execute(f"SELECT nombre, now() - actualizado FROM {ESQUEMA}.estado")
+            edades = {nombre: edad.total_seconds() for nombre, edad in cur.fetchall()}
+            for rollup in rollups:
+                if min_antiguedad and edades.get(rollup.nombre, min_antiguedad) < min_antiguedad:
+                    continue
+                # Los datos del rollup son los del instante en que empieza el refresco
+                cur.execute("SELECT clock_timestamp()")
+                inicio = cur.fetchone()[0]
+                cur.execute("SELECT relispopulated FROM pg_class WHERE oid = %s::regclass", (rollup.tabla,))
+                concurrente = " CONCURRENTLY" if cur.fetchone()[0] else ""
+                cur.execute(f"REFRESH MATERIALIZED VIEW{concurrente} {rollup.tabla}")
+                cur.execute(f"SELECT count(*) FROM {rollup.tabla}")
+                filas = cur.fetchone()[0]
+                segundos = (datetime.now(timezone.utc) - inicio).total_seconds()
+                cur.execute(
+                    f"INSERT INTO {ESQUEMA}.estado (nombre, actualizado, filas, segundos) VALUES (%s, %s, %s, %s) "
+                    "ON CONFLICT (nombre) DO UPDATE SET actualizado = EXCLUDED.actualizado, "
+                    "filas = EXCLUDED.filas, segundos = EXCLUDED.segundos",
+                    (rollup.nombre, inicio, filas, segundos),
+                )
+                hechos[rollup.nombre] = round(segundos, 3)
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (_CANDADO,))
+    return hechos
+
+
+class RefrescoRollups:
+    """Hilo que refresca los rollups cada `intervalo` segundos desde la propia API."""
+
+    def __init__(self, dsn, intervalo, rollups=ROLLUPS):
+        self.dsn = dsn
+        self.intervalo = intervalo
+        self.rollups = rollups
+        self._hilo = None
+        self._pid = None
+
+    def iniciar(self):
+        if self._pid == os.getpid() and self._hilo is not None:
+            return
+        self._pid = os.getpid()
+        self._hilo = threading.Thread(target=self._bucle, name="kairo-rollups-refresco", daemon=True)
+        self._hilo.start()
+
+    def _bucle(self):
+        import psycopg2
+
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn)
+                # Con varios workers, el que llega tarde encuentra los rollups recientes y no repite
+                hechos = refrescar(conn, self.rollups, min_antiguedad=self.intervalo / 2)
+                if hechos:
+                    print(f"🧮 Rollups refrescados: {hechos}")
+            except Exception as e:
+                print(f"⚠️ Rollups: no se pudieron refrescar ({e})")
+            finally:
+                if conn is not None:
+                    conn.close()
+            time.sleep(self.intervalo)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", default=os.environ.get("ROLLUPS_DSN") or os.environ.get("DATABASE_URL"),
+                        help="Por defecto ROLLUPS_DSN o DATABASE_URL (necesita permisos de escritura)")
+    parser.add_argument("--crear", action="store_true", help="Crear esquema, estado y vistas")
+    parser.add_argument("--lector", help="Con --crear: rol de la API al que dar SELECT")
+    parser.add_argument("--refrescar", action="store_true", help="Refrescar todas las vistas")
+    parser.add_argument("--ddl", action="store_true", help="Solo imprimir el DDL")
+    args = parser.parse_args()
+
+    if args.ddl:
+        print(DDL_ESTADO + "\n".join(r.ddl() for r in ROLLUPS))
+        return
+    if not args.dsn:
+        parser.error("Falta --dsn, ROLLUPS_DSN o DATABASE_URL")
+    if not (args.crear or args.refrescar):
+        parser.error("Indica --crear y/o --refrescar")
+
+    import psycopg2
+
+    conn = psycopg2.connect(args.dsn)
+    try:
+        if args.crear:
+            crear(conn, lector=args.lector)
+            print(f"Rollups creados en el esquema {ESQUEMA}: {', '.join(r.nombre for r in ROLLUPS)}")
+        if args.refrescar:
+            for nombre, segundos in refrescar(conn).items():
+                print(f"{nombre}: {segundos}s")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
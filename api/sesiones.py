@@ -0,0 +1,127 @@
+"""
+Sesiones de conversación para las preguntas de seguimiento.
+
+Cada sesión guarda en memoria sus últimos `max_turnos` turnos (pregunta, SQL y tipo) y
+el resultado del último si es completo y pequeño. Con eso:
+
+- El prompt de intención lleva el historial como mensajes anteriores (user/assistant)
+  detrás de un system prompt con el esquema del primer turno; si una pregunta de
+  seguimiento necesita otras tablas, se añaden al final. El prefijo se repite de una
+  llamada a la siguiente y la caché de prompts del proveedor puede aprovecharlo.
+- Si el SQL nuevo es el anterior con más filtros o agrupado por menos columnas, se
+  responde desde el resultado guardado sin ir a la BBDD (ver derivacion.py).
+
+Las sesiones caducan tras `ttl` segundos sin uso y, si hay más de `max_sesiones`, se
+descartan las que llevan más tiempo sin usarse. Viven en la memoria de cada proceso:
+con varios workers el balanceador debe mandar cada sesión siempre al mismo.
+"""
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+_ID_VALIDO = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+
+class Turno:
+    __slots__ = ("pregunta", "sql", "tipo", "tipo_grafico", "resultado")
+
+    def __init__(self, pregunta, analisis, resultado=None):
+        self.pregunta = pregunta
+        self.sql = analisis.get("sql")
+        self.tipo = analisis.get("type", "data")
+        self.tipo_grafico = analisis.get("chart_type")
+        self.resultado = resultado
+
+
+class Sesion:
+    def __init__(self, sesion_id, max_turnos):
+        self.id = sesion_id
+        self.turnos = deque(maxlen=max_turnos)
+        self.esquema = None      # texto del esquema: el del primer turno + tablas añadidas (prefijo estable)
+        self.tablas = None       # oids de las tablas de ese texto (None: DB_SCHEMA, están todas)
+        self.usada = time.monotonic()
+
+    def historial(self):
+        """[(pregunta, {"sql", "type", "chart_type"}), ...] de los turnos guardados, del más antiguo al último."""
+        return [
+            (t.pregunta, {"sql": t.sql, "type": t.tipo, "chart_type": t.tipo_grafico})
+            for t in list(self.turnos)
+        ]
+
+    def ultimo(self):
+        turnos = list(self.turnos)
+        return turnos[-1] if turnos else None
+
+
+class AlmacenSesiones:
+    def __init__(self, max_sesiones=1000, max_turnos=6, ttl=1800, max_filas_resultado=2000):
+        self.max_sesiones = max_sesiones
+        self.max_turnos = max(1, max_turnos)
+        self.ttl = ttl
+        self.max_filas_resultado = max_filas_resultado
+
+        self._sesiones = OrderedDict()   # id -> Sesion, de la menos a la más reciente
+        self._lock = threading.Lock()
+        self._creadas = 0
+        self._caducadas = 0
+        self._descartadas = 0
+
+    def obtener(self, sesion_id=None):
+        """
+        La sesión con ese id, o una nueva si no existe, ha caducado o no se pasa id.
+        Un id desconocido pero válido se respeta (p.ej. otro worker o tras un reinicio).
+        """
+        ahora = time.monotonic()
+        with self._lock:
+            self._purgar(ahora)
+            if sesion_id and not _ID_VALIDO.match(sesion_id):
+                sesion_id = None
+            sesion = self._sesiones.get(sesion_id) if sesion_id else None
+            if sesion is None:
+                sesion = Sesion(sesion_id or uuid.uuid4().hex, self.max_turnos)
+                self._sesiones[sesion.id] = sesion
+                self._creadas += 1
+                while len(self._sesiones) > self.max_sesiones:
+                    self._sesiones.popitem(last=False)
+                    self._descartadas += 1
+            self._sesiones.move_to_end(sesion.id)
+            sesion.usada = ahora
+            return sesion
+
+    def _purgar(self, ahora):
+        # Las más antiguas están al principio: se para en la primera que sigue viva
+        while self._sesiones:
+            sesion = next(iter(self._sesiones.values()))
+            if not self.ttl or ahora - sesion.usada <= self.ttl:
+                break
+            self._sesiones.popitem(last=False)
+            self._caducadas += 1
+
+    def registrar(self, sesion, pregunta, analisis, resultado):
+        """Añade el turno. Solo el último conserva su resultado, y solo si está completo y cabe."""
+        guardar = (
+            isinstance(resultado, dict) and "error" not in resultado
+            and not resultado.get("truncated") and len(resultado.get("rows", ())) <= self.max_filas_resultado
+        )
+        datos = None
+        if guardar:
+            datos = {k: resultado[k] for k in ("columns", "rows", "truncated") if k in resultado}
+            datos["rollup"] = resultado.get("rollup")
+        with self._lock:
+            anterior = sesion.ultimo()
+            if anterior is not None:
+                anterior.resultado = None
+            sesion.turnos.append(Turno(pregunta, analisis, datos))
+            sesion.usada = time.monotonic()
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "activas": len(self._sesiones),
+                "turnos": sum(len(s.turnos) for s in self._sesiones.values()),
+                "creadas": self._creadas,
+                "caducadas": self._caducadas,
+                "descartadas": self._descartadas,
+            }
@@ -0,0 +1,183 @@
+"""
+Validación local del SQL generado por el LLM antes de ejecutarlo.
+
+- Se parsea con un parser SQL real (sqlglot, dialecto PostgreSQL).
+- Una única sentencia de lectura: nada de DML/DDL escondido en CTEs, SELECT INTO ni FOR UPDATE.
+- Tablas y columnas contra la lista permitida (el esquema conocido).
+- Sin productos cartesianos: todo JOIN necesita condición (ON/USING o igualdad en el WHERE).
+- Funciones peligrosas (pg_sleep, lectura de ficheros, dblink...) prohibidas.
+
+El coste se comprueba después, contra el plan de EXPLAIN (ver `comprobar_plan`).
+"""
+# sqlglot (~90 ms) se importa al cargar a propósito: todas las preguntas pasan por aquí,
+# así que diferirlo solo movería el coste a la primera, y con preload_app se paga una
+# vez en el maestro de gunicorn
+import functools
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import ParseError
+
+
+class SQLRechazado(Exception):
+    """El SQL no pasa la validación o su plan es demasiado caro."""
+
+
+_CONSULTAS = tuple(
+    t for t in (getattr(exp, n, None) for n in ("Query", "Select", "Union", "Intersect", "Except")) if t
+)
+_PROHIBIDOS = tuple(
+    t for t in (getattr(exp, n, None) for n in (
+        "Insert", "Update", "Delete", "Merge", "Create", "Drop", "Alter", "AlterTable",
+        "Command", "Into", "Lock", "Copy", "Grant", "Set", "TruncateTable",
+    )) if t
+)
+# Lo que sqlglot devuelve por un ";" final seguido de un comentario: no es otra sentencia
+_SIN_SENTENCIA = tuple(t for t in (getattr(exp, "Semicolon", None),) if t)
+_FUNCIONES_PROHIBIDAS = {
+    "pg_sleep", "pg_sleep_for", "pg_sleep_until", "pg_read_file", "pg_read_binary_file", "pg_ls_dir",
+    "pg_stat_file", "lo_import", "lo_export", "dblink", "dblink_exec", "set_config",
+    "pg_terminate_backend", "pg_cancel_backend", "pg_reload_conf", "pg_advisory_lock",
+    "query_to_xml", "txid_current", "nextval", "setval",
+}
+
+
+def _nombre_tabla(tabla):
+    return f"{tabla.db}.{tabla.name}".lower() if tabla.db else tabla.name.lower()
+
+
+def _condicion_en_where(select, alias):
+    # Join "a, b WHERE a.x = b.y": buscamos una igualdad entre columnas de tablas distintas
+    where = select.args.get("where")
+    if where is None:
+        return False
+    for igualdad in where.find_all(exp.EQ):
+        izq, der = igualdad.this, igualdad.expression
+        if isinstance(izq, exp.Column) and isinstance(der, exp.Column):
+            tablas = {izq.table.lower(), der.table.lower()}
+            if alias in tablas and len(tablas) == 2:
+                return True
+    return False
+
+
+def _comprobar_joins(arbol):
+    for select in arbol.find_all(exp.Select):
+        for join in select.args.get("joins") or []:
+            if join.args.get("on") is not None or join.args.get("using"):
+                continue
+            # LATERAL / funciones (unnest, generate_series...) no son tablas grandes
+            if not isinstance(join.this, exp.Table):
+                continue
+            alias = join.this.alias_or_name.lower()
+            if not _condicion_en_where(select, alias):
+                raise SQLRechazado(f"JOIN sin condición con {join.this.name} (producto cartesiano)")
+
+
+def _comprobar_columnas(arbol, esquema, reales):
+    """Columnas cualificadas (alias.col) contra las de su tabla; las sin cualificar, contra todas."""
+    alias_tabla = {}
+    for tabla in arbol.find_all(exp.Table):
+        nombre = _nombre_tabla(tabla)
+        if nombre in reales:
+            alias_tabla[tabla.alias_or_name.lower()] = nombre
+
+    # Con subconsultas en el FROM o CTEs las columnas sin cualificar pueden venir de ellas
+    derivadas = any(True for _ in arbol.find_all(exp.Subquery)) or any(True for _ in arbol.find_all(exp.CTE))
+    alias_salida = {a.alias.lower() for a in arbol.find_all(exp.Alias) if a.alias}
+    todas = set().union(*(esquema[t] for t in reales)) if reales else set()
+
+    for columna in arbol.find_all(exp.Column):
+        nombre = columna.name.lower()
+        if not nombre or isinstance(columna.this, exp.Star):
+            continue
+        calificador = columna.table.lower()
+        if calificador:
+            tabla = alias_tabla.get(calificador)
+            if tabla is not None and nombre not in esquema[tabla]:
+                raise SQLRechazado(f"La columna {calificador}.{nombre} no existe en {tabla}")
+        elif not derivadas and nombre not in todas and nombre not in alias_salida:
+            raise SQLRechazado(f"La columna {nombre} no existe en las tablas consultadas")
+
+
+@functools.lru_cache(maxsize=1024)
+def _sentencias(sql):
+    # Se parsea una vez por SQL para validar y para regenerarlo (sql_ejecutable)
+    return tuple(
+        s for s in sqlglot.parse(sql, read="postgres")
+        if s is not None and not isinstance(s, _SIN_SENTENCIA)
+    )
+
+
+def sql_ejecutable(sql):
+    """
+    La sentencia regenerada desde el árbol de sqlglot, sin comentarios ni ";" final, lista
+    para ir dentro de una subconsulta: se ejecuta exactamente lo que se ha validado. Si no
+    se puede parsear o no es una sola sentencia, None.
+    """
+    try:
+        sentencias = _sentencias(sql)
+    except ParseError:
+        return None
+    if len(sentencias) != 1:
+        return None
+    return sentencias[0].sql(dialect="postgres", comments=False)
+
+
+def validar_sql(sql, esquema=None):
+    """
+    Valida el SQL. `esquema` es {tabla: {columnas}} con las tablas permitidas
+    (None = no comprobar tablas ni columnas). Lanza SQLRechazado si algo no cuadra.
+    """
+    try:
+        sentencias = _sentencias(sql)
+    except ParseError as e:
+        raise SQLRechazado(f"SQL no válido: {str(e).splitlines()[0]}")
+    if len(sentencias) != 1:
+        raise SQLRechazado("Solo se permite una sentencia")
+
+    arbol = sentencias[0]
+    if not isinstance(arbol, _CONSULTAS):
+        raise SQLRechazado("Solo se permiten consultas de lectura (SELECT)")
+    prohibido = next(iter(arbol.find_all(*_PROHIBIDOS)), None) if _PROHIBIDOS else None
+    if prohibido is not None:
+        raise SQLRechazado(f"Operación no permitida: {prohibido.key.upper()}")
+
+    for funcion in arbol.find_all(exp.Anonymous):
+        if str(funcion.name).lower() in _FUNCIONES_PROHIBIDAS:
+            raise SQLRechazado(f"Función no permitida: {funcion.name}")
+
+    _comprobar_joins(arbol)
+
+    if esquema is not None:
+        ctes = {cte.alias.lower() for cte in arbol.find_all(exp.CTE)}
+        reales = set()
+        for tabla in arbol.find_all(exp.Table):
+            nombre = _nombre_tabla(tabla)
+            if not tabla.name or nombre in ctes:
+                continue
+            if nombre not in esquema:
+                raise SQLRechazado(f"Tabla no permitida: {nombre}")
+            reales.add(nombre)
+        _comprobar_columnas(arbol, esquema, reales)
+    return arbol
+
+
+def comprobar_plan(plan, max_coste=None, max_filas=None):
+    """
+    Revisa el plan de `EXPLAIN (FORMAT JSON)`. Rechaza si el coste total supera `max_coste`
+    o si algún nodo estima leer más de `max_filas` filas. Devuelve (coste, filas_estimadas).
+    """
+    raiz = plan[0]["Plan"] if isinstance(plan, list) else plan["Plan"]
+    coste = raiz.get("Total Cost", 0.0)
+    filas = 0
+    pendientes = [raiz]
+    while pendientes:
+        nodo = pendientes.pop()
+        filas = max(filas, nodo.get("Plan Rows", 0))
+        pendientes.extend(nodo.get("Plans", []))
+
+    if max_coste and coste > max_coste:
+        raise SQLRechazado(f"Consulta demasiado costosa (coste estimado {coste:.0f} > {max_coste:.0f})")
+    if max_filas and filas > max_filas:
+        raise SQLRechazado(f"Consulta demasiado grande ({filas} filas estimadas > {max_filas})")
+    return coste, filas
@@ -0,0 +1,225 @@
+"""
+Deduplicación del trabajo en curso ("single flight").
+
+Si llegan a la vez varias peticiones con la misma clave (misma pregunta normalizada,
+mismo SQL...), solo la primera hace el trabajo y el resto espera y comparte su resultado.
+Dentro de un proceso se coordinan los hilos; con `ruta_compartida` (un SQLite local)
+también los workers de gunicorn de la misma máquina.
+"""
+import asyncio
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+
+class _Vuelo:
+    __slots__ = ("hecho", "valor", "error")
+
+    def __init__(self):
+        self.hecho = threading.Event()
+        self.valor = None
+        self.error = None
+
+
+class VueloUnico:
+    """
+    `ejecutar(tipo, clave, fn)` llama a `fn()` una sola vez por clave en curso.
+    `tipo` ("intencion", "sql"...) solo sirve para separar claves y contadores.
+
+    - `espera_max`: segundos que se espera al que está calculando; después se calcula aparte.
+    - `ruta_compartida`: fichero SQLite para coordinar procesos (None = solo hilos).
+    - `retencion`: segundos que el resultado queda en el SQLite para los que están sondeando.
+    """
+
+    def __init__(self, espera_max=30.0, ruta_compartida=None, retencion=1.0, sondeo=0.05):
+        self.espera_max = espera_max
+        self.ruta_compartida = ruta_compartida
+        self.retencion = retencion
+        self.sondeo = sondeo
+
+        self._vuelos = {}
+        self._futuros = {}   # versión asyncio (un único event loop)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._contadores = {}
+
+    def _contar(self, tipo, campo):
+        with self._lock:
+            contadores = self._contadores.setdefault(
+                tipo, {"ejecutadas": 0, "coalescidas": 0, "coalescidas_otro_worker": 0, "esperas_agotadas": 0}
+            )
+            contadores[campo] += 1
+
+    # ----------------------
+    # Hilos del mismo proceso
+    # ----------------------
+    def ejecutar(self, tipo, clave, fn):
+        clave = (tipo, clave)
+        with self._lock:
+            vuelo = self._vuelos.get(clave)
+            lider = vuelo is None
+            if lider:
+                vuelo = self._vuelos[clave] = _Vuelo()
+
+        if not lider:
+            if not vuelo.hecho.wait(self.espera_max):
+                self._contar(tipo, "esperas_agotadas")
+                return fn()
+            self._contar(tipo, "coalescidas")
+            if vuelo.error is not None:
+                raise vuelo.error
+            return vuelo.valor
+
+        try:
+            vuelo.valor = self._ejecutar_compartido(tipo, clave, fn)
+            return vuelo.valor
+        except Exception as e:
+            vuelo.error = e
+            raise
+        finally:
+            with self._lock:
+                self._vuelos.pop(clave, None)
+            vuelo.hecho.set()
+
+    # ----------------------
+    # Entre workers (SQLite)
+    # ----------------------
+    def _db(self):
+        # Una conexión por hilo; tras un fork no se reutiliza la del padre
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.ruta_compartida, timeout=5, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS vuelos ("
+                "clave TEXT PRIMARY KEY, pid INTEGER, inicio REAL, fin REAL, valor BLOB)"
+            )
+            self._local.db, self._local.pid = db, os.getpid()
+        return db
+
+    def _reclamar(self, db, huella):
+        """Devuelve ("lider", None), ("hecho", valor) o ("esperar", None)."""
+        ahora = time.time()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            fila = db.execute("SELECT inicio, fin, valor FROM vuelos WHERE clave = ?", (huella,)).fetchone()
+            libre = (
+                fila is None
+                or (fila[1] is None and ahora - fila[0] > self.espera_max)   # el líder murió
+                or (fila[1] is not None and ahora - fila[1] > self.retencion)
+            )
+            if libre:
+                db.execute(
+                    "INSERT OR REPLACE INTO vuelos (clave, pid, inicio, fin, valor) VALUES (?, ?, ?, NULL, NULL)",
+                    (huella, os.getpid(), ahora),
+                )
+                return "lider", None
+            if fila[1] is not None:
+                return "hecho", fila[2]
+            return "esperar", None
+        finally:
+            db.execute("COMMIT")
+
+    def _ejecutar_compartido(self, tipo, clave, fn):
+        if not self.ruta_compartida:
+            self._contar(tipo, "ejecutadas")
+            return fn()
+        try:
+            db = self._db()
+        except sqlite3.Error as e:
+            print(f"⚠️ Vuelo único: SQLite no disponible ({e})")
+            self._contar(tipo, "ejecutadas")
+            return fn()
+
+        huella = hashlib.sha256(repr(clave).encode()).hexdigest()
+        limite = time.monotonic() + self.espera_max
+        while True:
+            try:
+                estado, valor = self._reclamar(db, huella)
+            except sqlite3.Error:
+                estado, valor = "lider", None
+                huella = None
+            if estado == "hecho":
+                self._contar(tipo, "coalescidas_otro_worker")
+                return pickle.loads(valor)
+            if estado == "lider":
+                break
+            if time.monotonic() > limite:
+                self._contar(tipo, "esperas_agotadas")
+                return fn()
+            time.sleep(self.sondeo)
+
+        self._contar(tipo, "ejecutadas")
+        try:
+            valor = fn()
+        except Exception:
+            self._liberar(db, huella)
+            raise
+        if huella is not None:
+            try:
+                ahora = time.time()
+                db.execute(
+                    "UPDATE vuelos SET fin = ?, valor = ? WHERE clave = ? AND pid = ?",
+                    (ahora, pickle.dumps(valor), huella, os.getpid()),
+                )
+                db.execute("DELETE FROM vuelos WHERE COALESCE(fin, inicio) < ?",
+                           (ahora - self.espera_max - self.retencion,))
+            except (sqlite3.Error, pickle.PicklingError, TypeError):
+                # Los que esperan en otros workers lo calcularán por su cuenta
+                self._liberar(db, huella)
+        return valor
+
+    @staticmethod
+    def _liberar(db, huella):
+        if huella is None:
+            return
+        try:
+            db.execute("DELETE FROM vuelos WHERE clave = ? AND fin IS NULL", (huella,))
+        except sqlite3.Error:
+            pass
+
+    # ----------------------
+    # asyncio (app_async.py)
+    # ----------------------
+    async def ejecutar_async(self, tipo, clave, fabrica):
+        """Igual que `ejecutar` pero `fabrica()` devuelve una corrutina. Solo dentro del proceso."""
+        clave = (tipo, clave)
+        futuro = self._futuros.get(clave)
+        if futuro is not None:
+            try:
+                valor = await asyncio.wait_for(asyncio.shield(futuro), self.espera_max)
+                self._contar(tipo, "coalescidas")
+                return valor
+            except asyncio.TimeoutError:
+                self._contar(tipo, "esperas_agotadas")
+                return await fabrica()
+            except asyncio.CancelledError:
+                if not futuro.cancelled():
+                    raise
+                return await fabrica()
+
+        futuro = asyncio.get_running_loop().create_future()
+        self._futuros[clave] = futuro
+        self._contar(tipo, "ejecutadas")
+        try:
+            valor = await fabrica()
+            futuro.set_result(valor)
+            return valor
+        except asyncio.CancelledError:
+            futuro.cancel()
+            raise
+        except Exception as e:
+            futuro.set_exception(e)
+            futuro.exception()   # evita el aviso "exception was never retrieved" si nadie esperaba
+            raise
+        finally:
+            self._futuros.pop(clave, None)
+
+    def estadisticas(self):
+        with self._lock:
+            datos = {tipo: dict(c) for tipo, c in self._contadores.items()}
+            datos["en_curso"] = len(self._vuelos) + len(self._futuros)
+        return datos
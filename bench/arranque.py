@@ -0,0 +1,180 @@
+"""
+Mide el arranque en frío de la API.
+
+- Import: `python -X importtime -c "import app"` en varios procesos nuevos; mediana del
+  total y de los módulos que importan app.py y comun.py directamente, de más a menos pesado.
+- Servidor (--servidor): tiempo desde lanzar el proceso hasta la primera respuesta de
+  /health y, con --consulta, latencia de la primera y la segunda pregunta contra el Groq
+  falso, sin y con CALENTAR=1. La consulta necesita PostgreSQL con datos (sembrar.py).
+
+    python bench/arranque.py --salida bench/arranque.json
+    python bench/arranque.py --comparar bench/arranque.json
+    python bench/arranque.py --servidor --modo gunicorn --consulta
+
+El bytecode de api/ se compila antes de medir, como en la imagen (compileall).
+"""
+import argparse
+import compileall
+import json
+import os
+import re
+import signal
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+from groq_falso import CORPUS, arrancar, cargar_corpus
+from reproducir import RAIZ
+from servidores import MODOS, esperar_listo
+
+API = os.path.join(RAIZ, "api")
+_LINEA = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$")
+_INTERMEDIOS = ("comun",)   # módulos propios que solo reúnen imports: se desglosan sus hijos
+
+
+def perfil_import(modulo, entorno, repeticiones):
+    """{"total_ms": {...}, "modulos_ms": {nombre: mediana}} de `import modulo` en procesos nuevos."""
+    totales, por_modulo = [], {}
+    for _ in range(repeticiones):
+        hijos = []   # importtime escribe los hijos antes que el padre
+        proceso = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {modulo}"],
+                                 cwd=API, env=entorno, capture_output=True, text=True)
+        if proceso.returncode != 0:
+            raise RuntimeError(f"import {modulo} falló:\n{proceso.stderr[-2000:]}")
+        for linea in proceso.stderr.splitlines():
+            m = _LINEA.match(linea)
+            if not m:
+                continue
+            acumulado_ms, profundidad, nombre = int(m[2]) / 1000, len(m[3]) // 2, m[4]
+            if profundidad == 0 and nombre == modulo:
+                totales.append(acumulado_ms)
+            elif profundidad == 2:
+                hijos.append((nombre, acumulado_ms))
+            elif profundidad == 1:
+                for hijo, ms in (hijos if nombre in _INTERMEDIOS else [(nombre, acumulado_ms)]):
+                    por_modulo.setdefault(hijo, []).append(ms)
+                hijos = []
+    modulos = {nombre: round(statistics.median(v), 1) for nombre, v in por_modulo.items()}
+    return {
+        "total_ms": {"mediana": round(statistics.median(totales), 1), "min": round(min(totales), 1)},
+        "modulos_ms": dict(sorted(modulos.items(), key=lambda m: -m[1])),
+    }
+
+
+def _preguntar(url, prompt, timeout):
+    inicio = time.perf_counter()
+    respuesta = httpx.post(url, json={"prompt": prompt}, timeout=timeout)
+    return round(1000 * (time.perf_counter() - inicio), 1), respuesta.status_code
+
+
+def medir_servidor(modo, args, entorno, calentar, prompt):
+    puerto = str(args.puerto)
+    orden = [p.format(puerto=puerto, workers=entorno.get("WEB_WORKERS", "1")) for p in MODOS[modo]]
+    base = f"http://127.0.0.1:{puerto}"
+    inicio = time.perf_counter()
+    proceso = subprocess.Popen(orden, cwd=API, env={**entorno, "CALENTAR": "1" if calentar else "0"},
+                               start_new_session=True)
+    try:
+        esperar_listo(base + "/health", args.timeout, intervalo=0.01)
+        medida = {"modo": modo, "calentar": calentar,
+                  "health_ms": round(1000 * (time.perf_counter() - inicio), 1)}
+        if args.consulta:
+            # Lo que tarda la plataforma en enrutar la primera petición; el calentamiento corre mientras
+            time.sleep(args.pausa)
+            for clave in ("primera_consulta_ms", "segunda_consulta_ms"):
+                ms, status = _preguntar(base + "/consulta", prompt, args.timeout)
+                medida[clave] = ms if status == 200 else f"HTTP {status}"
+        return medida
+    finally:
+        os.killpg(proceso.pid, signal.SIGTERM)
+        try:
+            proceso.wait(timeout=args.timeout)
+        except subprocess.TimeoutExpired:
+            os.killpg(proceso.pid, signal.SIGKILL)
+
+
+def comparar(actual, base, tolerancia):
+    """Regresiones del tiempo de import (total y por módulo) respecto a una ejecución anterior."""
+    regresiones = []
+    antes, ahora = base["import"]["total_ms"]["mediana"], actual["import"]["total_ms"]["mediana"]
+    if ahora > antes * (1 + tolerancia):
+        regresiones.append(f"import app: {antes} -> {ahora} ms")
+    for nombre, ms in actual["import"]["modulos_ms"].items():
+        previo = base["import"]["modulos_ms"].get(nombre)
+        # Menos de 5 ms es ruido; un módulo nuevo por encima de eso también se avisa
+        if ms >= 5 and (previo is None or ms > previo * (1 + tolerancia)):
+            regresiones.append(f"import {nombre}: {previo if previo is not None else '-'} -> {ms} ms")
+    return regresiones
+
+
+def imprimir(informe, top):
+    total = informe["import"]["total_ms"]
+    print(f"import app: mediana {total['mediana']} ms (mín {total['min']} ms)")
+    for nombre, ms in list(informe["import"]["modulos_ms"].items())[:top]:
+        print(f"    {nombre:<24} {ms:>8} ms")
+    for medida in informe.get("servidor", []):
+        extra = "".join(f"   {k.replace('_ms', '')} {v} ms" for k, v in medida.items() if k.endswith("consulta_ms"))
+        print(f"{medida['modo']:<9} CALENTAR={int(medida['calentar'])}   /health {medida['health_ms']} ms{extra}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeticiones", type=int, default=7, help="Procesos para el perfil de import")
+    parser.add_argument("--top", type=int, default=12, help="Módulos a mostrar")
+    parser.add_argument("--servidor", action="store_true", help="Medir también el arranque del servidor")
+    parser.add_argument("--modo", action="append", choices=sorted(MODOS), help="Por defecto gunicorn")
+    parser.add_argument("--consulta", action="store_true", help="Primera y segunda pregunta tras arrancar")
+    parser.add_argument("--pausa", type=float, default=0.5, help="Segundos entre /health y la primera pregunta")
+    parser.add_argument("--corpus", default=CORPUS)
+    parser.add_argument("--latencia-intencion", type=float, default=400, help="ms del Groq falso")
+    parser.add_argument("--latencia-respuesta", type=float, default=600, help="ms del Groq falso")
+    parser.add_argument("--puerto", type=int, default=5050)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--salida", help="Guardar el informe en este JSON")
+    parser.add_argument("--comparar", help="Informe JSON anterior con el que comparar")
+    parser.add_argument("--tolerancia", type=float, default=0.2, help="Empeoramiento admitido (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    compileall.compile_dir(API, quiet=1)
+    corpus = cargar_corpus(args.corpus)
+    _, url_groq = arrancar(0, corpus, args.latencia_intencion, args.latencia_respuesta, 0.0)
+    entorno = {
+        **os.environ,
+        "GROQ_BASE_URL": url_groq,
+        "GROQ_API_KEY": os.environ.get("GROQ_API_KEY", "bench"),
+        "CACHE_INTENCION_TTL": "1e-9",
+        "CACHE_RESULTADOS_MAX_BYTES": "0",
+        "PORT": str(args.puerto),
+        "WEB_BIND": f"127.0.0.1:{args.puerto}",
+        "WEB_WORKERS": os.environ.get("WEB_WORKERS", "1"),
+        "FLASK_DEBUG": "0",
+        "CALENTAR": "0",
+    }
+
+    informe = {"python": sys.version.split()[0], "import": perfil_import("app", entorno, args.repeticiones)}
+    if args.servidor:
+        informe["servidor"] = [
+            medir_servidor(modo, args, entorno, calentar, corpus[0]["prompt"])
+            for modo in args.modo or ["gunicorn"]
+            for calentar in (False, True)
+        ]
+    imprimir(informe, args.top)
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(informe, f, indent=2, ensure_ascii=False)
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            regresiones = comparar(informe, json.load(f), args.tolerancia)
+        if regresiones:
+            print("\n⚠️ Regresiones:\n  " + "\n  ".join(regresiones))
+            sys.exit(1)
+        print("\nSin regresiones respecto a", args.comparar)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Test de carga para /consulta.
+
+Lanza N peticiones con C en vuelo a la vez y mide throughput y latencias.
+Sirve para comparar la API síncrona (app.py) con la asíncrona (app_async.py):
+
+    python bench/carga.py --url http://127.0.0.1:5000/consulta -n 500 -c 100
+    python bench/carga.py --url http://127.0.0.1:5001/consulta -n 500 -c 100
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import httpx
+
+PROMPTS_POR_DEFECTO = [
+    "ventas por categoría",
+    "¿cuántos clientes hay por país?",
+    "importe total por método de pago",
+    "top 5 productos más vendidos",
+    "ventas por mes",
+]
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    k = max(0, min(len(ordenados) - 1, round(p / 100 * len(ordenados) + 0.5) - 1))
+    return ordenados[k]
+
+
+async def lanzar(url, prompts, n, concurrencia, timeout):
+    latencias, errores = [], {}
+    semaforo = asyncio.Semaphore(concurrencia)
+    limites = httpx.Limits(max_connections=concurrencia, max_keepalive_connections=concurrencia)
+
+    async with httpx.AsyncClient(timeout=timeout, limits=limites) as cliente:
+        async def una(i):
+            async with semaforo:
+                inicio = time.perf_counter()
+                try:
+                    r = await cliente.post(url, json={"prompt": prompts[i % len(prompts)]})
+                    clave = None if r.status_code == 200 else f"HTTP {r.status_code}"
+                except Exception as e:
+                    clave = type(e).__name__
+                latencias.append(time.perf_counter() - inicio)
+                if clave:
+                    errores[clave] = errores.get(clave, 0) + 1
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(una(i) for i in range(n)))
+        total = time.perf_counter() - inicio
+
+    return {
+        "url": url,
+        "peticiones": n,
+        "concurrencia": concurrencia,
+        "segundos": round(total, 3),
+        "rps": round(n / total, 2) if total else 0.0,
+        "latencia_ms": {
+            "media": round(1000 * statistics.mean(latencias), 1) if latencias else 0.0,
+            "p50": round(1000 * percentil(latencias, 50), 1),
+            "p95": round(1000 * percentil(latencias, 95), 1),
+            "p99": round(1000 * percentil(latencias, 99), 1),
+        },
+        "errores": errores,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", action="append", required=True, help="Endpoint /consulta (se puede repetir)")
+    parser.add_argument("-n", type=int, default=200, help="Número total de peticiones")
+    parser.add_argument("-c", type=int, default=50, help="Peticiones en vuelo a la vez")
+    parser.add_argument("--prompts", help="Fichero con un prompt por línea")
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    prompts = PROMPTS_POR_DEFECTO
+    if args.prompts:
+        with open(args.prompts, encoding="utf-8") as f:
+            prompts = [linea.strip() for linea in f if linea.strip()]
+
+    resultados = [asyncio.run(lanzar(url, prompts, args.n, args.c, args.timeout)) for url in args.url]
+    print(json.dumps(resultados, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
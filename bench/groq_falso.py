@@ -0,0 +1,165 @@
+"""
+Servidor falso de Groq para medir Kairo sin red ni cupo.
+
+Responde a POST /openai/v1/chat/completions con el mismo JSON que Groq (y a GET
+/openai/v1/models para la sonda /ready):
+- Llamada de intención (response_format json_object): el SQL del corpus para ese prompt.
+- Llamada de respuesta: un texto fijo (también en streaming SSE si stream=true).
+La latencia de cada tipo de llamada es configurable (media + jitter uniforme).
+
+    python bench/groq_falso.py --puerto 8090 --latencia-intencion 400 --latencia-respuesta 600
+    GROQ_BASE_URL=http://127.0.0.1:8090 python api/app.py
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus.json")
+SQL_POR_DEFECTO = {"sql": "SELECT COUNT(*) AS transacciones FROM transacciones;", "type": "data", "chart_type": None}
+RESPUESTA = ("Según los datos, la categoría con más ventas destaca claramente sobre el resto, "
+             "seguida de otras dos con valores parecidos. El resto de categorías tiene un peso menor.")
+
+
+def cargar_corpus(ruta=CORPUS):
+    with open(ruta, encoding="utf-8") as f:
+        return json.load(f)
+
+
+class _Manejador(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = None   # se asigna en arrancar()
+
+    def log_message(self, *args):
+        pass
+
+    def _esperar(self, media_ms):
+        jitter = self.config["jitter"]
+        time.sleep(max(0.0, media_ms * random.uniform(1 - jitter, 1 + jitter)) / 1000)
+
+    def _cabeceras_cupo(self):
+        # Cupo amplio para que el planificador de Kairo nunca tenga que esperar
+        return {
+            "x-ratelimit-limit-requests": "1000000",
+            "x-ratelimit-remaining-requests": "999999",
+            "x-ratelimit-reset-requests": "1s",
+            "x-ratelimit-limit-tokens": "100000000",
+            "x-ratelimit-remaining-tokens": "99999999",
+            "x-ratelimit-reset-tokens": "1s",
+        }
+
+    def do_GET(self):
+        # La sonda /ready de la API lista los modelos
+        if not self.path.endswith("/models"):
+            self.send_error(404)
+            return
+        datos = json.dumps({"object": "list", "data": [
+            {"id": "llama-3.3-70b-versatile", "object": "model", "created": 0, "owned_by": "groq-falso"},
+            {"id": "llama-3.1-8b-instant", "object": "model", "created": 0, "owned_by": "groq-falso"},
+        ]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def do_POST(self):
+        if not self.path.endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        cuerpo = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        mensajes = cuerpo.get("messages", [])
+        prompt = next((m.get("content", "") for m in reversed(mensajes) if m.get("role") == "user"), "")
+        entrada = sum(len(m.get("content") or "") for m in mensajes) // 4
+
+        if (cuerpo.get("response_format") or {}).get("type") == "json_object":
+            self._esperar(self.config["latencia_intencion"])
+            intencion = self.config["corpus"].get(prompt.strip().lower(), SQL_POR_DEFECTO)
+            contenido = json.dumps({k: intencion.get(k) for k in ("sql", "type", "chart_type")})
+        else:
+            self._esperar(self.config["latencia_respuesta"])
+            contenido = RESPUESTA
+        uso = {"prompt_tokens": entrada, "completion_tokens": len(contenido) // 4,
+               "total_tokens": entrada + len(contenido) // 4}
+
+        if cuerpo.get("stream"):
+            self._stream(cuerpo, contenido, uso)
+            return
+
+        datos = json.dumps({
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": cuerpo.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": contenido},
+                         "finish_reason": "stop"}],
+            "usage": uso,
+        }).encode()
+        self.send_response(200)
+        for clave, valor in self._cabeceras_cupo().items():
+            self.send_header(clave, valor)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def _stream(self, cuerpo, contenido, uso):
+        self.send_response(200)
+        for clave, valor in self._cabeceras_cupo().items():
+            self.send_header(clave, valor)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        base = {"id": f"chatcmpl-{uuid.uuid4().hex}", "object": "chat.completion.chunk",
+                "created": int(time.time()), "model": cuerpo.get("model")}
+        palabras = contenido.split(" ")
+        for i, palabra in enumerate(palabras):
+            trozo = {**base, "choices": [{"index": 0, "delta": {"content": palabra + " "}, "finish_reason": None}]}
+            if i == len(palabras) - 1:
+                trozo["choices"][0]["finish_reason"] = "stop"
+                trozo["x_groq"] = {"usage": uso}
+            self.wfile.write(f"data: {json.dumps(trozo)}\n\n".encode())
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+
+def arrancar(puerto=0, corpus=None, latencia_intencion=400, latencia_respuesta=600, jitter=0.2):
+    """Arranca el servidor en un hilo. Devuelve (servidor, url base para GROQ_BASE_URL)."""
+    entradas = corpus if corpus is not None else cargar_corpus()
+    manejador = type("Manejador", (_Manejador,), {"config": {
+        "corpus": {e["prompt"].strip().lower(): e for e in entradas},
+        "latencia_intencion": latencia_intencion,
+        "latencia_respuesta": latencia_respuesta,
+        "jitter": jitter,
+    }})
+    servidor = ThreadingHTTPServer(("127.0.0.1", puerto), manejador)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name="groq-falso", daemon=True).start()
+    return servidor, f"http://127.0.0.1:{servidor.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--puerto", type=int, default=8090)
+    parser.add_argument("--corpus", default=CORPUS)
+    parser.add_argument("--latencia-intencion", type=float, default=400, help="ms")
+    parser.add_argument("--latencia-respuesta", type=float, default=600, help="ms")
+    parser.add_argument("--jitter", type=float, default=0.2, help="variación relativa (0.2 = ±20%%)")
+    args = parser.parse_args()
+
+    servidor, url = arrancar(args.puerto, cargar_corpus(args.corpus),
+                             args.latencia_intencion, args.latencia_respuesta, args.jitter)
+    print(f"Groq falso en {url} (GROQ_BASE_URL={url})")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        servidor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
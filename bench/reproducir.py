@@ -0,0 +1,203 @@
+"""
+Reproduce un corpus de preguntas contra /consulta a varios niveles de concurrencia.
+
+Por defecto todo ocurre en este proceso: arranca el Groq falso (groq_falso.py), importa
+api/app.py apuntando a él y lanza las peticiones con el cliente de pruebas de Flask desde
+un pool de hilos. Solo hace falta un PostgreSQL con datos sintéticos (sembrar.py).
+
+Cada petición pide {"timings": true}, así que además de la latencia total se obtiene
+p50/p95/p99 de cada etapa (intención, BBDD, respuesta, serialización...).
+
+    python bench/sembrar.py --transacciones 1000000
+    python bench/reproducir.py -c 1 -c 8 -c 32 -n 200 --salida bench/base.json
+    # ...cambios...
+    python bench/reproducir.py -c 1 -c 8 -c 32 -n 200 --comparar bench/base.json
+
+Con --url se mide un servidor ya arrancado (gunicorn, uvicorn...); --pid indica el proceso
+del que leer la memoria máxima (VmHWM).
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from carga import percentil
+from groq_falso import CORPUS, arrancar, cargar_corpus
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _percentiles(valores):
+    return {
+        "p50": round(percentil(valores, 50), 1),
+        "p95": round(percentil(valores, 95), 1),
+        "p99": round(percentil(valores, 99), 1),
+    }
+
+
+def memoria_max_mb(pid=None):
+    """Memoria residente máxima (high-water mark) del proceso, en MB."""
+    if pid is None:
+        # En Linux ru_maxrss va en KB
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    with open(f"/proc/{pid}/status") as f:
+        for linea in f:
+            if linea.startswith("VmHWM:"):
+                return round(int(linea.split()[1]) / 1024, 1)
+    return None
+
+
+def cliente_en_proceso(args):
+    """Importa la API con el entorno del benchmark. Devuelve una función prompt -> (status, json)."""
+    _, url_groq = arrancar(0, cargar_corpus(args.corpus), args.latencia_intencion,
+                           args.latencia_respuesta, args.jitter)
+    os.environ["GROQ_BASE_URL"] = url_groq
+    os.environ.setdefault("GROQ_API_KEY", "bench")
+    os.environ.setdefault("ESTRATEGIA_RESPUESTA", "llm")   # las dos llamadas a Groq en cada pregunta
+    if not args.caches:
+        # Cada petición hace todo el trabajo (caché de intención con TTL casi nulo)
+        os.environ["CACHE_RESULTADOS_MAX_BYTES"] = "0"
+        os.environ["CACHE_INTENCION_TTL"] = "1e-9"
+        os.environ["VUELO_UNICO"] = "0"
+    sys.path.insert(0, os.path.join(RAIZ, "api"))
+    import app as api
+
+    def peticion(prompt):
+        respuesta = api.app.test_client().post("/consulta", json={"prompt": prompt, "timings": True})
+        return respuesta.status_code, respuesta.get_json(silent=True)
+
+    return peticion
+
+
+def cliente_http(args):
+    import httpx
+    cliente = httpx.Client(timeout=args.timeout, limits=httpx.Limits(max_connections=max(args.c)))
+
+    def peticion(prompt):
+        respuesta = cliente.post(args.url, json={"prompt": prompt, "timings": True})
+        try:
+            return respuesta.status_code, respuesta.json()
+        except ValueError:
+            return respuesta.status_code, None
+
+    return peticion
+
+
+def nivel(peticion, prompts, n, concurrencia, pid):
+    latencias, etapas, errores = [], {}, {}
+
+    def una(i):
+        inicio = time.perf_counter()
+        try:
+            status, cuerpo = peticion(prompts[i % len(prompts)])
+            error = None if status == 200 else f"HTTP {status}"
+        except Exception as e:
+            cuerpo, error = None, type(e).__name__
+        latencias.append(1000 * (time.perf_counter() - inicio))
+        if error:
+            errores[error] = errores.get(error, 0) + 1
+            return
+        timings = ((cuerpo or {}).get("metadata") or {}).get("timings") or {}
+        for etapa, ms in timings.get("etapas_ms", {}).items():
+            etapas.setdefault(etapa, []).append(ms)
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrencia) as ejecutor:
+        list(ejecutor.map(una, range(n)))
+    segundos = time.perf_counter() - inicio
+
+    return {
+        "concurrencia": concurrencia,
+        "peticiones": n,
+        "segundos": round(segundos, 3),
+        "rps": round(n / segundos, 2) if segundos else 0.0,
+        "latencia_ms": {"media": round(statistics.mean(latencias), 1), **_percentiles(latencias)},
+        "etapas_ms": {etapa: _percentiles(valores) for etapa, valores in sorted(etapas.items())},
+        "memoria_max_mb": memoria_max_mb(pid),
+        "errores": errores,
+    }
+
+
+def comparar(actual, base, tolerancia):
+    """Líneas con las regresiones (p95 y rps) respecto a una ejecución anterior."""
+    regresiones = []
+    anteriores = {n["concurrencia"]: n for n in base["niveles"]}
+    for n in actual["niveles"]:
+        previo = anteriores.get(n["concurrencia"])
+        if previo is None:
+            continue
+        c = n["concurrencia"]
+        if n["latencia_ms"]["p95"] > previo["latencia_ms"]["p95"] * (1 + tolerancia):
+            regresiones.append(f"c={c}: p95 {previo['latencia_ms']['p95']} -> {n['latencia_ms']['p95']} ms")
+        if n["rps"] < previo["rps"] * (1 - tolerancia):
+            regresiones.append(f"c={c}: rps {previo['rps']} -> {n['rps']}")
+        for etapa, p in n["etapas_ms"].items():
+            antes = previo["etapas_ms"].get(etapa)
+            # Las etapas de menos de 1 ms son ruido
+            if antes and antes["p95"] >= 1 and p["p95"] > antes["p95"] * (1 + tolerancia):
+                regresiones.append(f"c={c}: etapa {etapa} p95 {antes['p95']} -> {p['p95']} ms")
+    return regresiones
+
+
+def imprimir(informe):
+    for n in informe["niveles"]:
+        lat = n["latencia_ms"]
+        print(f"\nc={n['concurrencia']:<4} {n['rps']:>8} rps   p50 {lat['p50']:>8} ms   p95 {lat['p95']:>8} ms"
+              f"   p99 {lat['p99']:>8} ms   memoria máx {n['memoria_max_mb']} MB   errores {n['errores'] or 0}")
+        for etapa, p in n["etapas_ms"].items():
+            print(f"    {etapa:<24} p50 {p['p50']:>8}   p95 {p['p95']:>8}   p99 {p['p99']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-c", type=int, action="append", help="Concurrencia (se puede repetir). Por defecto 1, 8 y 32")
+    parser.add_argument("-n", type=int, default=200, help="Peticiones por nivel")
+    parser.add_argument("--corpus", default=CORPUS, help="JSON con prompt/sql/type/chart_type")
+    parser.add_argument("--calentamiento", type=int, default=5, help="Peticiones previas que no cuentan")
+    parser.add_argument("--latencia-intencion", type=float, default=400, help="ms del Groq falso")
+    parser.add_argument("--latencia-respuesta", type=float, default=600, help="ms del Groq falso")
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--caches", action="store_true", help="No desactivar cachés ni deduplicación")
+    parser.add_argument("--url", help="Medir un servidor ya arrancado en vez de la API en proceso")
+    parser.add_argument("--pid", type=int, help="Con --url: proceso del que leer la memoria máxima")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--salida", help="Guardar el informe en este JSON")
+    parser.add_argument("--comparar", help="Informe JSON anterior con el que comparar")
+    parser.add_argument("--tolerancia", type=float, default=0.15, help="Empeoramiento admitido (0.15 = 15%%)")
+    args = parser.parse_args()
+    args.c = args.c or [1, 8, 32]
+
+    prompts = [e["prompt"] for e in cargar_corpus(args.corpus)]
+    peticion = cliente_http(args) if args.url else cliente_en_proceso(args)
+    pid = args.pid if args.url else None
+
+    for i in range(args.calentamiento):
+        peticion(prompts[i % len(prompts)])
+
+    informe = {
+        "modo": "http" if args.url else "en_proceso",
+        "latencia_groq_ms": {"intencion": args.latencia_intencion, "respuesta": args.latencia_respuesta},
+        "caches": args.caches,
+        "niveles": [nivel(peticion, prompts, args.n, c, pid) for c in args.c],
+    }
+    imprimir(informe)
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(informe, f, indent=2, ensure_ascii=False)
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            regresiones = comparar(informe, json.load(f), args.tolerancia)
+        if regresiones:
+            print("\n⚠️ Regresiones:\n  " + "\n  ".join(regresiones))
+            sys.exit(1)
+        print("\nSin regresiones respecto a", args.comparar)
+
+
+if __name__ == "__main__":
+    main()
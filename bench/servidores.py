@@ -0,0 +1,157 @@
+"""
+Compara el servidor de desarrollo de Flask con el perfil de producción (gunicorn).
+
+Arranca el Groq falso, levanta cada modo como un proceso aparte sobre el mismo puerto,
+espera a /ready y le pasa el corpus con reproducir.py a varios niveles de concurrencia.
+Solo hace falta un PostgreSQL con datos sintéticos (sembrar.py) en DATABASE_URL.
+
+    python bench/servidores.py -c 8 -c 32 -n 200 --salida bench/servidores.json
+    WEB_WORKERS=2 WEB_THREADS=16 python bench/servidores.py --modo gunicorn
+
+Modos: flask (python app.py), gunicorn (gunicorn.conf.py) y uvicorn (app_async.py).
+La memoria es la suma de los máximos (VmHWM) del proceso y sus workers.
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+from types import SimpleNamespace
+
+import httpx
+
+from groq_falso import CORPUS, arrancar, cargar_corpus
+from reproducir import RAIZ, cliente_http, imprimir, memoria_max_mb, nivel
+
+MODOS = {
+    "flask": [sys.executable, "app.py"],
+    "gunicorn": [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"],
+    "uvicorn": [sys.executable, "-m", "uvicorn", "app_async:app", "--host", "127.0.0.1", "--port", "{puerto}",
+                "--workers", "{workers}", "--log-level", "warning"],
+}
+
+
+def _hijos(pid):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(p) for p in f.read().split()]
+    except OSError:
+        return []
+
+
+def memoria_total_mb(pid):
+    """Suma de la memoria máxima del proceso y de todos sus descendientes."""
+    pendientes, total = [pid], 0.0
+    while pendientes:
+        actual = pendientes.pop()
+        try:
+            total += memoria_max_mb(actual) or 0.0
+        except OSError:
+            continue
+        pendientes.extend(_hijos(actual))
+    return round(total, 1)
+
+
+def esperar_listo(url, timeout, intervalo=0.25):
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        try:
+            if httpx.get(url, timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(intervalo)
+    raise RuntimeError(f"{url} no responde tras {timeout}s")
+
+
+def medir_modo(modo, args, entorno, prompts):
+    puerto = str(args.puerto)
+    workers = entorno.get("WEB_WORKERS", "4")
+    orden = [p.format(puerto=puerto, workers=workers) for p in MODOS[modo]]
+    proceso = subprocess.Popen(orden, cwd=os.path.join(RAIZ, "api"), env=entorno, start_new_session=True)
+    base = f"http://127.0.0.1:{puerto}"
+    try:
+        esperar_listo(base + args.sonda, args.arranque)
+        peticion = cliente_http(SimpleNamespace(url=base + "/consulta", timeout=args.timeout, c=args.c))
+        for i in range(args.calentamiento):
+            peticion(prompts[i % len(prompts)])
+        niveles = []
+        for c in args.c:
+            resultado = nivel(peticion, prompts, args.n, c, None)
+            resultado["memoria_max_mb"] = memoria_total_mb(proceso.pid)
+            niveles.append(resultado)
+        return {"modo": modo, "orden": " ".join(orden), "niveles": niveles}
+    finally:
+        # SIGTERM al grupo: gunicorn y uvicorn terminan sus workers ordenadamente
+        os.killpg(proceso.pid, signal.SIGTERM)
+        try:
+            proceso.wait(timeout=args.arranque)
+        except subprocess.TimeoutExpired:
+            os.killpg(proceso.pid, signal.SIGKILL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modo", action="append", choices=sorted(MODOS),
+                        help="Modo a medir (se puede repetir). Por defecto flask y gunicorn")
+    parser.add_argument("-c", type=int, action="append", help="Concurrencia (se puede repetir). Por defecto 8 y 32")
+    parser.add_argument("-n", type=int, default=200, help="Peticiones por nivel")
+    parser.add_argument("--corpus", default=CORPUS)
+    parser.add_argument("--calentamiento", type=int, default=5)
+    parser.add_argument("--latencia-intencion", type=float, default=400, help="ms del Groq falso")
+    parser.add_argument("--latencia-respuesta", type=float, default=600, help="ms del Groq falso")
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--puerto", type=int, default=5050)
+    parser.add_argument("--arranque", type=float, default=30, help="Segundos para arrancar/parar cada servidor")
+    parser.add_argument("--sonda", default="/ready", help="Endpoint que indica que el servidor está listo")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--salida", help="Guardar el informe en este JSON")
+    args = parser.parse_args()
+    args.modo = args.modo or ["flask", "gunicorn"]
+    args.c = args.c or [8, 32]
+
+    corpus = cargar_corpus(args.corpus)
+    prompts = [e["prompt"] for e in corpus]
+    _, url_groq = arrancar(0, corpus, args.latencia_intencion, args.latencia_respuesta, args.jitter)
+
+    # Mismo entorno para todos: cachés y deduplicación fuera, como reproducir.py
+    entorno = {
+        **os.environ,
+        "GROQ_BASE_URL": url_groq,
+        "GROQ_API_KEY": os.environ.get("GROQ_API_KEY", "bench"),
+        "ESTRATEGIA_RESPUESTA": "llm",
+        "CACHE_RESULTADOS_MAX_BYTES": "0",
+        "CACHE_INTENCION_TTL": "1e-9",
+        "VUELO_UNICO": "0",
+        "PORT": str(args.puerto),
+        "WEB_BIND": f"127.0.0.1:{args.puerto}",
+        "FLASK_DEBUG": "0",
+    }
+
+    informes = []
+    for modo in args.modo:
+        print(f"\n=== {modo} ===")
+        informe = medir_modo(modo, args, entorno, prompts)
+        imprimir(informe)
+        informes.append(informe)
+
+    if len(informes) > 1:
+        print("\nResumen (rps / p95 ms / memoria MB):")
+        for c in args.c:
+            celdas = []
+            for informe in informes:
+                n = next(x for x in informe["niveles"] if x["concurrencia"] == c)
+                celdas.append(f"{informe['modo']} {n['rps']} / {n['latencia_ms']['p95']} / {n['memoria_max_mb']}")
+            print(f"  c={c:<4} " + "   |   ".join(celdas))
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump({"latencia_groq_ms": {"intencion": args.latencia_intencion,
+                                            "respuesta": args.latencia_respuesta},
+                       "modos": informes}, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,6 +3,13 @@ import requests
 import pandas as pd
 import plotly.express as px
 import os
+import json
+
+# pyarrow es opcional: si está, pedimos los datos en Arrow IPC (más compacto y sin parseo JSON)
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
 
 # --- CONFIGURACIÓN DE PÁGINA ---
 st.set_page_config(
@@ -14,12 +21,27 @@ st.set_page_config(
 # --- CONFIGURACIÓN URL BACKEND ---
 # Intenta leer la variable de entorno (Docker), si no, usa localhost
 API_URL = "http://127.0.0.1:5000/consulta"
+MIME_ARROW = "application/vnd.apache.arrow.stream"
 #API_URL = "https://kairo-ejt6.onrender.com/consulta"
 
 # --- SIDEBAR ---
 with st.sidebar:
     st.header("⚙️ Configuración")
     api_url = st.text_input("URL del Backend", value=API_URL)
+    usar_stream = st.toggle("Respuesta en streaming", value=True)
+    estrategia = st.selectbox(
+        "Respuesta textual",
+        ["auto", "llm", "plantilla", "ninguna"],
+        help="auto: frase local para resultados pequeños y resumen con IA para el resto. "
+             "ninguna: solo datos o gráfico (más rápido).",
+    )
+    conversacion = st.toggle(
+        "Modo conversación", value=True,
+        help="Las preguntas de seguimiento (\"¿y solo en España?\") se entienden a partir de las anteriores.",
+    )
+    if st.button("Nueva conversación"):
+        st.session_state.pop("sesion", None)
+        st.session_state.pop("respuesta", None)
     st.divider()
     st.info("Escribe tu pregunta y la IA decidirá si mostrarte una tabla o un gráfico.")
 
@@ -35,71 +57,231 @@ with st.form("my_form"):
     )
     submitted = st.form_submit_button("Analizar")
 
-if submitted and text_input:
-    with st.spinner("🧠 Analizando intención, generando SQL y consultando datos..."):
-        try:
-            # Petición al Backend
-            response = requests.post(api_url, json={"prompt": text_input})
+# --- FUNCIONES AUXILIARES ---
+def df_columnar(bloque):
+    """DataFrame a partir del formato columnar {"columns", "types", "data"} de la API."""
+    if not bloque:
+        return pd.DataFrame()
+    df = pd.DataFrame(bloque.get("data", []), columns=bloque.get("columns", []))
+    for columna, tipo in zip(bloque.get("columns", []), bloque.get("types", [])):
+        if tipo in ("date", "datetime"):
+            df[columna] = pd.to_datetime(df[columna], errors="coerce")
+    return df
+
+def leer_respuesta(response):
+    """Devuelve (metadatos, DataFrame) tanto si la API respondió en JSON como en Arrow."""
+    if pa is not None and response.headers.get("Content-Type", "").startswith(MIME_ARROW):
+        tabla = pa.ipc.open_stream(response.content).read_all()
+        data_json = json.loads((tabla.schema.metadata or {}).get(b"kairo", b"{}"))
+        # Conversión sin copias extra en lo posible
+        return data_json, tabla.to_pandas(split_blocks=True, self_destruct=True)
+    data_json = response.json()
+    return data_json, df_columnar(data_json.get("data"))
+
+def cabeceras_formato():
+    return {"Accept": MIME_ARROW} if pa is not None else {"Accept": "application/json"}
+
+def mostrar_grafico(grafico):
+    """Pinta el bloque "grafico" de la API: ejes ya elegidos y puntos ya reducidos."""
+    df = df_columnar(grafico["datos"])
+    x, ys, serie = grafico["x"], grafico["y"], grafico.get("serie")
+    st.subheader(f"📈 Visualización: {grafico['tipo'].upper()}")
+    if grafico["tipo"] == "pie":
+        fig = px.pie(df, names=x, values=ys[0], title=f"Distribución por {x}")
+    elif grafico["tipo"] == "line":
+        fig = px.line(df, x=x, y=ys if not serie else ys[0], color=serie)
+    else:
+        fig = px.bar(df, x=x, y=ys if not serie else ys[0], color=serie)
+    st.plotly_chart(fig, use_container_width=True)
+    if grafico.get("reduccion"):
+        st.caption(f"Se muestran {grafico['puntos']} puntos calculados a partir de {grafico['filas']} filas.")
+
+def mostrar_datos(df, viz_type, chart_type, grafico=None):
+    if viz_type == "chart" and grafico:
+        mostrar_grafico(grafico)
+    elif df is not None and not df.empty:
+        
+        # Lógica de Visualización
+        if viz_type == "chart" and not df.empty:
+            st.subheader(f"📈 Visualización: {(chart_type or '').upper()}")
             
-            if response.status_code == 200:
-                data_json = response.json()
-                
-                # 1. RESPUESTA VERBAL
-                st.success("Respuesta:")
-                st.write(data_json.get("respuesta_bot", "Sin respuesta textual."))
-                
-                # 2. PROCESAMIENTO DE DATOS Y GRÁFICOS
-                raw_data = data_json.get("data", [])
-                viz_type = data_json.get("type", "data")       # 'chart' o 'data'
-                chart_type = data_json.get("chart_type", None) # 'bar', 'line', 'pie'
+            # Heurística simple: Asumimos Col 1 = Eje X (Texto), Col 2 = Eje Y (Numérico)
+            # Si hay más columnas, el usuario o el modelo deberían especificar, pero esto es un MVP.
+            col_names = df.columns.tolist()
+            
+            if len(col_names) >= 2:
+                x_col = col_names[0]
+                y_col = col_names[1]
                 
-                if raw_data:
-                    df = pd.DataFrame(raw_data)
+                if chart_type == "bar":
+                    st.bar_chart(df.set_index(x_col)[y_col])
+                    
+                elif chart_type == "line":
+                    st.line_chart(df.set_index(x_col)[y_col])
                     
-                    # Lógica de Visualización
-                    if viz_type == "chart" and not df.empty:
-                        st.subheader(f"📈 Visualización: {chart_type.upper()}")
-                        
-                        # Heurística simple: Asumimos Col 1 = Eje X (Texto), Col 2 = Eje Y (Numérico)
-                        # Si hay más columnas, el usuario o el modelo deberían especificar, pero esto es un MVP.
-                        col_names = df.columns.tolist()
-                        
-                        if len(col_names) >= 2:
-                            x_col = col_names[0]
-                            y_col = col_names[1]
-                            
-                            if chart_type == "bar":
-                                st.bar_chart(df.set_index(x_col)[y_col])
-                                
-                            elif chart_type == "line":
-                                st.line_chart(df.set_index(x_col)[y_col])
-                                
-                            elif chart_type == "pie":
-                                fig = px.pie(df, names=x_col, values=y_col, title=f"Distribución por {x_col}")
-                                st.plotly_chart(fig, use_container_width=True)
-                            
-                            else:
-                                st.warning(f"Tipo de gráfico '{chart_type}' no reconocido. Mostrando datos.")
-                                st.dataframe(df)
-                        else:
-                            st.warning("No hay suficientes columnas para generar un gráfico (mínimo 2).")
-                            st.dataframe(df)
-                            
-                    else:
-                        # Si es solo datos o el dataframe está vacío
-                        st.subheader("📋 Tabla de Datos")
-                        st.dataframe(df)
+                elif chart_type == "pie":
+                    fig = px.pie(df, names=x_col, values=y_col, title=f"Distribución por {x_col}")
+                    st.plotly_chart(fig, use_container_width=True)
+                
                 else:
-                    st.info("La consulta no devolvió resultados numéricos.")
+                    st.warning(f"Tipo de gráfico '{chart_type}' no reconocido. Mostrando datos.")
+                    st.dataframe(df)
+            else:
+                st.warning("No hay suficientes columnas para generar un gráfico (mínimo 2).")
+                st.dataframe(df)
+                
+        else:
+            # Si es solo datos o el dataframe está vacío
+            st.subheader("📋 Tabla de Datos")
+            st.dataframe(df)
+    else:
+        st.info("La consulta no devolvió resultados numéricos.")
 
-                # 3. ZONA TÉCNICA (DEBUG)
-                with st.expander("🕵️ Ver detalles técnicos (SQL)"):
-                    st.code(data_json.get("sql", "--"), language="sql")
-                    st.json(data_json)
+def leer_eventos_sse(response):
+    """Convierte la respuesta en streaming en pares (evento, datos)."""
+    evento, datos = "message", []
+    for linea in response.iter_lines(decode_unicode=True):
+        if linea is None:
+            continue
+        if linea == "":
+            if datos:
+                yield evento, json.loads("\n".join(datos))
+            evento, datos = "message", []
+        elif linea.startswith("event:"):
+            evento = linea[len("event:"):].strip()
+        elif linea.startswith("data:"):
+            datos.append(linea[len("data:"):].strip())
 
-            else:
-                st.error(f"Error {response.status_code}: {response.text}")
+def mostrar_respuesta(data_json, df):
+    """Pinta una respuesta completa ya recibida (respuesta verbal, datos y debug)."""
+    # 1. RESPUESTA VERBAL
+    if data_json.get("respuesta_bot"):
+        st.success("Respuesta:")
+        st.write(data_json["respuesta_bot"])
+    
+    # 2. PROCESAMIENTO DE DATOS Y GRÁFICOS
+    viz_type = data_json.get("type", "data")       # 'chart' o 'data'
+    chart_type = data_json.get("chart_type", None) # 'bar', 'line', 'pie'
+    
+    mostrar_datos(df, viz_type, chart_type, data_json.get("grafico"))
 
+    # 3. ZONA TÉCNICA (DEBUG)
+    mostrar_debug(data_json)
+
+def mostrar_debug(data_json):
+    with st.expander("🕵️ Ver detalles técnicos (SQL)"):
+        st.code(data_json.get("sql", "--"), language="sql")
+        st.json({k: v for k, v in data_json.items() if k != "data"})
+
+def cuerpo_consulta(prompt):
+    # En modo conversación se manda el id de la sesión (true la primera vez: la crea el backend)
+    # Si la respuesta es un gráfico basta con los puntos ya preparados por la API
+    cuerpo = {"prompt": prompt, "respuesta": estrategia, "solo_grafico": True}
+    if conversacion:
+        cuerpo["sesion"] = st.session_state.get("sesion") or True
+    return cuerpo
+
+def guardar_sesion(info):
+    if conversacion and info and info.get("id"):
+        st.session_state["sesion"] = info["id"]
+
+def consulta_en_streaming(url, prompt):
+    """Pinta cada etapa (SQL, datos, respuesta) en cuanto llega del backend."""
+    data_json, df = {}, None
+    estado = st.status("🧠 Analizando intención y generando SQL...", expanded=False)
+    zona_respuesta = st.empty()
+    zona_datos = st.container()
+    zona_sql = st.empty()
+    texto = ""
+
+    with requests.post(url.rstrip("/") + "/stream", json=cuerpo_consulta(prompt), stream=True) as response:
+        if response.status_code != 200:
+            st.error(f"Error {response.status_code}: {response.text}")
+            return None, None
+
+        for evento, datos in leer_eventos_sse(response):
+            if evento == "sql":
+                data_json.update(datos)
+                estado.update(label="🗄️ Consultando datos...")
+                zona_sql.code(datos.get("sql", "--"), language="sql")
+            elif evento == "data":
+                df = df_columnar(datos.pop("data", None))
+                data_json.update(datos)
+                guardar_sesion(datos.get("sesion"))
+                estado.update(label="✍️ Redactando respuesta...")
+                with zona_datos:
+                    mostrar_datos(df, data_json.get("type", "data"), data_json.get("chart_type"),
+                                  data_json.get("grafico"))
+            elif evento == "token":
+                texto += datos.get("token", "")
+                zona_respuesta.success(texto)
+            elif evento == "fin":
+                data_json.update(datos)
+                if datos.get("respuesta_bot") or texto:
+                    zona_respuesta.success(datos.get("respuesta_bot") or texto)
+                estado.update(label="✅ Listo", state="complete")
+            elif evento == "error":
+                estado.update(label="❌ Error", state="error")
+                st.error(f"Error: {datos}")
+                return None, None
+
+    # ZONA TÉCNICA (DEBUG)
+    mostrar_debug(data_json)
+    return data_json, df
+
+def consulta_normal(url, prompt):
+    with st.spinner("🧠 Analizando intención, generando SQL y consultando datos..."):
+        # Petición al Backend
+        response = requests.post(url, json=cuerpo_consulta(prompt), headers=cabeceras_formato())
+        
+    if response.status_code == 200:
+        data_json, df = leer_respuesta(response)
+        guardar_sesion((data_json.get("metadata") or {}).get("sesion"))
+        mostrar_respuesta(data_json, df)
+        return data_json, df
+
+    st.error(f"Error {response.status_code}: {response.text}")
+    return None, None
+
+def cargar_mas(url, guardada):
+    """Pide la siguiente página de un resultado truncado y la añade a la respuesta guardada."""
+    data_json = guardada["json"]
+    response = requests.post(
+        url.rstrip("/") + "/pagina", json={"token": data_json["next_token"]}, headers=cabeceras_formato()
+    )
+    if response.status_code != 200:
+        st.error(f"Error {response.status_code}: {response.text}")
+        return
+    pagina, df_pagina = leer_respuesta(response)
+    guardada["df"] = pd.concat([guardada["df"], df_pagina], ignore_index=True)
+    data_json["truncated"] = pagina.get("truncated", False)
+    data_json["next_token"] = pagina.get("next_token")
+
+# --- FLUJO PRINCIPAL ---
+# La última respuesta se guarda en sesión para poder paginar sin repetir la pregunta
+if submitted and text_input:
+    st.session_state.pop("respuesta", None)
+    try:
+        if usar_stream:
+            data_json, df = consulta_en_streaming(api_url, text_input)
+        else:
+            data_json, df = consulta_normal(api_url, text_input)
+        if data_json is not None:
+            st.session_state["respuesta"] = {"json": data_json, "df": df}
+    except requests.exceptions.ConnectionError:
+        st.error("🚨 No se pudo conectar con el Backend.")
+        st.markdown(f"Verifica que la API esté corriendo en: `{api_url}`")
+
+elif st.session_state.get("respuesta"):
+    mostrar_respuesta(st.session_state["respuesta"]["json"], st.session_state["respuesta"]["df"])
+
+# --- PAGINACIÓN ---
+respuesta_actual = st.session_state.get("respuesta")
+if respuesta_actual and respuesta_actual["json"].get("truncated") and not respuesta_actual["json"].get("grafico"):
+    st.caption(f"⚠️ Resultado parcial: se muestran {len(respuesta_actual['df'])} filas.")
+    if respuesta_actual["json"].get("next_token") and st.button("Cargar más filas"):
+        try:
+            cargar_mas(api_url, respuesta_actual)
+            st.rerun()
         except requests.exceptions.ConnectionError:
             st.error("🚨 No se pudo conectar con el Backend.")
-            st.markdown(f"Verifica que la API esté corriendo en: `{api_url}`")
\ No newline at end of file